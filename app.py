@@ -1,15 +1,28 @@
-from flask import Flask, redirect, request, jsonify, render_template
+from flask import Flask, redirect, request, jsonify, render_template, stream_with_context
 from openai import OpenAI
-import os, requests, atexit, time, tempfile
+import json, multiprocessing, os, requests, time, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 # Import project functions
-from functions.strava_api import _load_tokens, _save_tokens, _auth_url, get_strava_activity, get_strava_activities
-from functions.strava_activities import filter_activities, generate_route
-from functions.map_funcs import build_empty_map, build_polyline_route_map, build_single_route_map, _cleanup_map_file
-from functions.llm_funcs import llm_with_response_schema, llm_general_chat, llm_analyze_activity, RouterOptions, RouteInfo, GenerateRouteInfo, transcribe_audio
+from functions.strava_api import _load_tokens, _save_tokens, _auth_url, get_strava_activity, prefetch_strava_activities, invalidate_activity_details
+from functions.activity_store import sync_activities, load_activities
+from functions.stream_store import start_stream_ingest, delete_streams, compact_streams, load_streams, get_activity_streams, describe_streams, BACKGROUND_INGEST_LIMIT
+from functions.strava_fetcher import EXECUTOR
+from functions.warmup import start_warmup, warmup_status
+from functions.strava_activities import filter_activities, generate_routes, map_city_to_coords
+from functions.map_funcs import route_geojson, route_etag
+from functions.polyline_funcs import decode_polylines, route_at_zoom
+from functions.route_image import get_route_image, png_data_url
+from functions.llm_funcs import llm_with_response_schema, llm_general_chat, llm_general_chat_stream, llm_analyze_activity, RouterOptions, RouteInfo, GenerateRouteInfo, transcribe_audio
 from functions.llm_prompts import ROUTER_PROMPT, RUN_INFO_PROMPT, GENERATE_RUN_PROMPT, SUMMARIZE_OPTIONS_PROMPT, GENERAL_CHAT_PROMPT, ACTIVITY_ANALYSIS_PROMPT
-from functions.rag_funcs import rag_ranking
+from functions.rag_funcs import rank_activities, numeric_ranking, query_embedding, embedding_client, update_activity_index, get_activity_index, search_activity_history, RANKING_MODES
+from functions.embedding_store import get_embedding_store
+from functions.pipeline import StageScheduler
+from functions.llm_cache import llm_cache_stats
+from functions.context_builder import CONTEXT_BUDGETS, fit_messages, rollup, activity_table, activity_detail_text, coords_text, count_tokens, truncate_to_tokens
+from functions.intent_classifier import classify_intent, log_router_decision, INTENT_THRESHOLD
 
 
 # ----- Setup -----
@@ -26,22 +39,183 @@ REDIRECT_URI = os.getenv("STRAVA_REDIRECT_URI", "http://localhost:5000/callback"
 
 # File paths
 TOKEN_FILE = "tokens.json"
-MAP_PATH = "static/map.html"
-
-# Make sure map file is cleaned when app stops
-atexit.register(_cleanup_map_file)
-build_empty_map(MAP_PATH)
+CACHE_DIR = "cache"
+ACTIVITY_DB = os.path.join(CACHE_DIR, "activities.db")
+DETAIL_CACHE_DIR = os.path.join(CACHE_DIR, "details")
+STREAMS_DIR = os.path.join(CACHE_DIR, "streams")
+ROUTE_IMAGE_DIR = os.path.join(CACHE_DIR, "route_images")
+EMBEDDINGS_DIR = os.path.join(CACHE_DIR, "embeddings")
+ACTIVITY_INDEX = os.path.join(CACHE_DIR, "activity_index.npz")
+
+# Number of top-ranked activities whose details are prefetched for analysis
+PREFETCH_TOP = 3
+
+# Ranked activities returned per search, and the default ranking engine (auto, embedding or numeric)
+RAG_TOP_K = 25
+RANKING_MODE = os.getenv("RANKING_MODE", "auto")
+
+# History search when filters match nothing: allowed distance deviation (fraction of target), and how many
+# more index hits are fetched when results must also start in the requested city
+HISTORY_DISTANCE_SLACK = 0.5
+HISTORY_CITY_OVERFETCH = 4
+
+# Run-search work (extraction, activity sync) starts before the router answers only if the local classifier
+# gives suggest_run at least this probability
+SPECULATE_SUGGEST_FLOOR = 0.25
+
+# Loop generation: candidates scored per request and options shown
+GENERATE_CANDIDATES = 8
+GENERATE_TOP_K = 3
+
+# Areas whose street graphs are preloaded in the background (comma separated)
+HOME_AREAS = [a.strip() for a in os.getenv("HOME_AREAS", "Uppsala").split(",") if a.strip()]
+
+# Background work runs in the serving process only (not the debug reloader's parent or route pool workers, which import this module)
+SERVING_PROCESS = multiprocessing.parent_process() is None and (__name__ != "__main__" or os.environ.get("WERKZEUG_RUN_MAIN") == "true")
+
+# Preload graphs for home areas
+if SERVING_PROCESS:
+    start_warmup(HOME_AREAS)
+
+# Voice input recorded in segments: session id -> {"segments": {index: future}, "updated": time, "closed": bool}
+TRANSCRIPTS = {}
+TRANSCRIBE_LOCK = threading.Lock()
+TRANSCRIBE_SESSION_TTL = 300
+TRANSCRIBE_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="transcribe")
 
 # Keep history of conversation
 HISTORY = []
 MAX_HISTORY = 20
 
-# Helper: add message to memory and keep it short
+# Geometry of routes shown to the user, served as GeoJSON by id
+ROUTES = OrderedDict()
+MAX_ROUTES = 500
+ROUTES_LOCK = threading.Lock()
+
+# Helper: add message to memory and keep it short (oldest messages are folded into a summary)
 def _append_history(role, content):
     """Store chat history so LLM can keep context."""
     HISTORY.append({"role": role, "content": content})
     if len(HISTORY) > MAX_HISTORY:
-        del HISTORY[: len(HISTORY) - MAX_HISTORY]
+        HISTORY[: len(HISTORY) - MAX_HISTORY + 1] = [rollup(HISTORY[: len(HISTORY) - MAX_HISTORY + 1])]
+
+
+# Helper: remember route geometry so the map can fetch it by id
+def _register_route(route_id, name, coords=None, polyline=None):
+    """Store coords or an encoded polyline for a route id."""
+    with ROUTES_LOCK:
+        ROUTES[route_id] = {"name": name, "coords": coords, "polyline": polyline}
+        ROUTES.move_to_end(route_id)
+        while len(ROUTES) > MAX_ROUTES:
+            ROUTES.popitem(last=False)
+
+# Helper: look up route geometry (Strava routes can be rebuilt from the store)
+def _find_route(route_id):
+    """Return registered route data or None."""
+    with ROUTES_LOCK:
+        if route_id in ROUTES:
+            return ROUTES[route_id]
+    if route_id.startswith("strava-"):
+        for activity in load_activities(ACTIVITY_DB):
+            if str(activity.get("id")) == route_id[len("strava-"):]:
+                map_data = activity.get("map") or {}
+                _register_route(route_id, activity.get("name"), polyline=map_data.get("summary_polyline") or map_data.get("polyline"))
+                return _find_route(route_id)
+    return None
+
+# Helper: server-side image of a route (with elevation profile when streams are stored)
+def _route_image(route_id, streams=None):
+    """Return cached PNG bytes for a registered route, or None if unknown."""
+    route = _find_route(route_id)
+    if not route:
+        return None
+    coords = route["coords"] if route["coords"] is not None else decode_polylines([route["polyline"]])[0]
+    if streams is None and route_id.startswith("strava-"):
+        streams = load_streams(route_id[len("strava-"):], STREAMS_DIR)
+    distance, elevation = (streams or {}).get("distance"), (streams or {}).get("altitude")
+    return get_route_image(route_id, coords, distance, elevation, ROUTE_IMAGE_DIR)
+
+# Helper: embed new or edited activities into the history index
+def _refresh_activity_index():
+    """Update the history index from the activity store (logs instead of raising)."""
+    try:
+        update_activity_index(CLIENT, load_activities(ACTIVITY_DB), ACTIVITY_INDEX, EMBEDDINGS_DIR)
+    except Exception as e:
+        print(f"Activity index update failed: {e}")
+
+# Helper: build the history index in the background (cold-start triggers share one pending build)
+INDEX_BUILD = {"future": None}
+INDEX_BUILD_LOCK = threading.Lock()
+
+def _start_index_refresh():
+    """Submit an index update unless one is already queued or running; returns at once."""
+    with INDEX_BUILD_LOCK:
+        if INDEX_BUILD["future"] is None or INDEX_BUILD["future"].done():
+            INDEX_BUILD["future"] = EXECUTOR.submit(_refresh_activity_index)
+
+# Bring the index up to date at start-up when activities are already stored
+if SERVING_PROCESS and os.path.exists(ACTIVITY_DB):
+    _start_index_refresh()
+
+# Helper: semantic search over all activities when the hard filters match nothing
+def _search_history(user_input, route_info, activities, mode=RANKING_MODE, center=None):
+    """Return up to RAG_TOP_K activities from the whole history near the requested city, ranked by the query."""
+    # The city still applies; only the distance, time etc. targets are relaxed
+    nearby = filter_activities(activities, {}, center=center) if center else activities
+    if not nearby:
+        return []
+    if mode != "numeric":
+        try:
+            index = get_activity_index(ACTIVITY_INDEX)
+            if index is None:
+                # Cold start: build the index in the background and rank the nearby activities directly meanwhile
+                _start_index_refresh()
+                return rank_activities(CLIENT, user_input, nearby, route_info, mode, EMBEDDINGS_DIR, RAG_TOP_K)
+            target = float(route_info.get("distance", 0) or 0)
+            filters = {"distance": ((1 - HISTORY_DISTANCE_SLACK) * target, (1 + HISTORY_DISTANCE_SLACK) * target)} if target else None
+            top_k = RAG_TOP_K * (HISTORY_CITY_OVERFETCH if center else 1)
+            ids = search_activity_history(CLIENT, user_input, filters, top_k, ACTIVITY_INDEX)
+            by_id = {a.get("id"): a for a in nearby}
+            found = [by_id[i] for i in ids if i in by_id][:RAG_TOP_K]
+            if found:
+                return found
+        except Exception as e:
+            print(f"History search failed, using numeric ranking: {e}")
+    return numeric_ranking(nearby, route_info, RAG_TOP_K)
+
+# Helper: sync and load activities (runs as a speculative chat stage)
+def _load_synced_activities():
+    """Sync the activity store and return all stored activities."""
+    _sync_activity_store()
+    return load_activities(ACTIVITY_DB)
+
+# Helper: bring local activity store up to date with Strava
+def _sync_activity_store():
+    """Sync activities incrementally; keep serving local data if Strava fails."""
+    try:
+        changes = sync_activities(ACTIVITY_DB, TOKEN_FILE, STRAVA_CLIENT_ID, STRAVA_CLIENT_SECRET)
+        invalidate_activity_details(changes["updated"] + changes["deleted"], DETAIL_CACHE_DIR)
+        # Streams only go stale when the route or stats change (not on kudos, comments or renames)
+        stale = changes["reshaped"] + changes["deleted"]
+        delete_streams(stale, STREAMS_DIR)
+        get_embedding_store(EMBEDDINGS_DIR).forget(changes["deleted"])
+
+        # Fetch per-second streams for new or reshaped activities in the background
+        fresh = (changes["added"] + changes["reshaped"])[:BACKGROUND_INGEST_LIMIT]
+        if fresh:
+            start_stream_ingest(fresh, STREAMS_DIR, TOKEN_FILE, STRAVA_CLIENT_ID, STRAVA_CLIENT_SECRET)
+        if stale:
+            EXECUTOR.submit(compact_streams, STREAMS_DIR)
+
+        # Keep the semantic index over the full history current (and build it after the first sync)
+        if any(changes.values()):
+            EXECUTOR.submit(_refresh_activity_index)
+        elif get_activity_index(ACTIVITY_INDEX) is None:
+            _start_index_refresh()
+        return changes
+    except Exception as e:
+        print(f"Activity sync failed: {e}")
+        return {"added": [], "updated": [], "deleted": [], "reshaped": []}
 
 
 # ----- Routes -----
@@ -85,38 +259,108 @@ def callback():
     return redirect("/")
 
 
-@app.route("/api/chat", methods=["POST"])
-def chat():
-    """Main chat endpoint that decides if user wants a run or general chat."""
+# Helper: validate a chat request
+def _chat_request():
+    """Return (user_input, ranking_mode, error_response)."""
     if not _load_tokens(TOKEN_FILE):
-        return jsonify({"error": "Please login with Strava first."}), 401
-    
+        return None, None, (jsonify({"error": "Please login with Strava first."}), 401)
     data = request.get_json(silent=True) or {}
     user_input = (data.get("message") or "").strip()
     if not user_input:
-        return jsonify({"error": "Missing 'message' in request."}), 400
-    
+        return None, None, (jsonify({"error": "Missing 'message' in request."}), 400)
+    ranking_mode = data.get("ranking") if data.get("ranking") in RANKING_MODES else RANKING_MODE
+    return user_input, ranking_mode, None
+
+# Helper: LLM text as one call, or as streamed deltas
+def _llm_text(stages, name, msgs, instructions, stream):
+    """Yield ("delta", {"text"}) events when streaming; returns the full text."""
+    if not stream:
+        return stages.run(name, llm_general_chat, CLIENT, msgs, instructions)
+    start, parts = time.time(), []
+    for delta in llm_general_chat_stream(CLIENT, msgs, instructions):
+        parts.append(delta)
+        yield "delta", {"text": delta}
+    stages.record(name, time.time() - start)
+    return "".join(parts)
+
+# Helper: wait for the speculative query embedding before ranking
+def _ranking_mode(stages, mode):
+    """Return the mode to rank with: numeric (stage dropped) in auto mode when the query embedding is missing or failed."""
+    if "query_embedding" not in stages.futures:
+        return "numeric" if mode == "auto" else mode
+    try:
+        stages.result("query_embedding")
+        return mode
+    except Exception as e:
+        print(f"Query embedding failed: {e}")
+        stages.discard("query_embedding")
+        return "numeric" if mode == "auto" else mode
+
+# Helper: Server-Sent Events frame
+def _sse(event, payload):
+    """Format one SSE event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+
+# Chat pipeline shared by the JSON and streaming endpoints
+def _chat_events(user_input, ranking_mode, stream=False):
+    """Yield ("results" | "delta" | "done", payload) events; "done" carries the full response."""
     # Build conversation history for LLM
     msgs = HISTORY.copy()
     msgs.append({"role": "user", "content": user_input})
 
-    # Ask model if user is talking about a run
-    start = time.time()
-    route_decision = llm_with_response_schema(CLIENT, msgs, RouterOptions, ROUTER_PROMPT)
-    print(f"Route: {time.time() - start:.2f} seconds")
+    # Local classifier first; the LLM router only decides when it is unsure
+    stages = StageScheduler()
+    intent = stages.run("intent", classify_intent, user_input, has_history=bool(HISTORY))
+    local = intent["confidence"] >= INTENT_THRESHOLD
+    print(f"Intent: {intent['intent']} {intent['confidence']:.2f} ({intent['source']}{'' if local else ', asking router'})")
+
+    # Extract run details (unless parsed locally) and load activities for a run search; started before the
+    # router answers when a run search is likely
+    def start_run_search():
+        if intent["route_info"] is None:
+            stages.start("extraction", llm_with_response_schema, CLIENT, fit_messages(msgs, CONTEXT_BUDGETS["extraction"]), RouteInfo,
+                         RUN_INFO_PROMPT)
+        stages.start("activities", _load_synced_activities)
+
+    if not local:
+        stages.start("router", llm_with_response_schema, CLIENT, fit_messages(msgs, CONTEXT_BUDGETS["router"]), RouterOptions, ROUTER_PROMPT)
+    likely_run = intent["intent"] == "suggest_run" if local else intent["probabilities"]["suggest_run"] >= SPECULATE_SUGGEST_FLOOR
+    if likely_run:
+        start_run_search()
+    if local:
+        route_decision = intent["decision"]
+    else:
+        route_decision = stages.result("router")
+        EXECUTOR.submit(log_router_decision, user_input, route_decision)
 
     if route_decision.get("suggest_run"):
         # Get run details (distance, city etc.)
-        start = time.time()
-        route_info = llm_with_response_schema(CLIENT, msgs, RouteInfo, RUN_INFO_PROMPT)
-        print(f"Extraction: {time.time() - start:.2f} seconds")
+        start_run_search()
+        route_info = intent["route_info"] or stages.result("extraction")
         msgs.append({"role": "assistant", "content": str(route_info)})
         print(route_info)
 
-        # Fetch and filter user activities from Strava
-        start = time.time()
-        strava_activities = get_strava_activities(200, TOKEN_FILE, STRAVA_CLIENT_ID, STRAVA_CLIENT_SECRET)
-        activities = filter_activities(strava_activities, route_info)
+        # Geocode the city and embed the query (with the client ranking will use) while the activity sync finishes
+        stages.start("geocoding", map_city_to_coords, route_info.get("city", ""))
+        embedder = embedding_client(CLIENT, ranking_mode)
+        if embedder is not None:
+            stages.start("query_embedding", query_embedding, embedder, user_input)
+        strava_activities = stages.result("activities")
+        center = stages.result("geocoding")
+
+        # Filter the local activity store
+        activities = stages.run("filtering", filter_activities, strava_activities, route_info, center=center)
+        ranked = False
+        if not strava_activities:
+            # Nothing to rank, so the query embedding is not needed
+            stages.discard("query_embedding")
+        else:
+            ranking_mode = _ranking_mode(stages, ranking_mode)
+        if not activities:
+            # Filters left nothing: search the whole history instead (already ranked)
+            activities = stages.run("history_search", _search_history, user_input, route_info, strava_activities, ranking_mode, center)
+            ranked = True
         filtered_activities = []
         for activity in activities:
             map_data = (activity.get("map") or {})
@@ -127,133 +371,224 @@ def chat():
                 "total_elevation_gain": activity.get("total_elevation_gain"), "average_speed": activity.get("average_speed"),
                 "average_heartrate": activity.get("average_heartrate"), "start_date": activity.get("start_date"), "polyline": polyline_str
             })
-        print(f"Filtering: {time.time() - start:.2f} seconds")
+        # Decode all result polylines in one batch for the map endpoint
+        for a, points in zip(filtered_activities, decode_polylines([a["polyline"] for a in filtered_activities])):
+            _register_route(a["route_id"], a["name"], coords=points)
         
         # RAG filtering and sorting
-        start = time.time()
-        rag_activities = rag_ranking(CLIENT, user_input, filtered_activities)
-        print(f"RAG: {time.time() - start:.2f} seconds")
-        
-        # Summary via LLM
-        summary_copy = [{k: v for k, v in a.items() if k != "polyline"} for a in rag_activities]
-        summary_input = msgs + [{"role": "assistant", "content": str(summary_copy)}]
-        start = time.time()
-        summary = llm_general_chat(CLIENT, summary_input, SUMMARIZE_OPTIONS_PROMPT)
-        print(f"Summary: {time.time() - start:.2f} seconds")
+        rag_activities = filtered_activities if ranked else stages.run(
+            "ranking", rank_activities, CLIENT, user_input, filtered_activities, route_info, ranking_mode, EMBEDDINGS_DIR, RAG_TOP_K)
 
+        # Fetch details and streams and render images of the top results in the background so "analyze" is instant
+        try:
+            top_ids = [a["id"] for a in rag_activities[:PREFETCH_TOP]]
+            prefetch_strava_activities(top_ids, TOKEN_FILE, STRAVA_CLIENT_ID, STRAVA_CLIENT_SECRET, DETAIL_CACHE_DIR)
+            stream_fetches = start_stream_ingest(top_ids, STREAMS_DIR, TOKEN_FILE, STRAVA_CLIENT_ID, STRAVA_CLIENT_SECRET)
+            for a in rag_activities[:PREFETCH_TOP]:
+                # Images include the elevation profile, so render once the streams are stored
+                fetch = stream_fetches.get(str(a["id"]))
+                if fetch is None:
+                    EXECUTOR.submit(_route_image, a["route_id"])
+                else:
+                    fetch.add_done_callback(lambda _, route_id=a["route_id"]: EXECUTOR.submit(_route_image, route_id))
+        except Exception as e:
+            print(f"Prefetch failed: {e}")
+        
         # Pick the first route to show by default
         auto_select_route_id = None
         if rag_activities:
             auto_select_route_id = rag_activities[0]["route_id"]
 
+        # Routes can be shown before the summary is written
+        results = {
+            "input": user_input, "mode": "run", "run_details": route_info, "count": len(rag_activities), "results": rag_activities,
+            "auto_select_route_id": auto_select_route_id
+        }
+        yield "results", results
+
+        # Summary via LLM (results as a compact table, history fitted into the rest of the budget)
+        budget = CONTEXT_BUDGETS["summary"]
+        results_table = activity_table(rag_activities, budget=budget // 2) or "No matching routes."
+        summary_input = fit_messages(msgs, budget - count_tokens(results_table)) + [{"role": "assistant", "content": results_table}]
+        summary = yield from _llm_text(stages, "summary", summary_input, SUMMARIZE_OPTIONS_PROMPT, stream)
+        print(stages.report())
+
         # Add interaction to history
         _append_history("user", user_input)
         _append_history("assistant", summary)
 
         # Send back to frontend
-        return jsonify({
-            "input": user_input, "mode": "run", "run_details": route_info, "count": len(rag_activities), "results": rag_activities,
-            "auto_select_route_id": auto_select_route_id, "response": summary, "map": f"/{MAP_PATH}"
-        })
+        yield "done", {**results, "response": summary}
     
     elif route_decision.get("generate_new_route"):
+        # Speculative run-search work is not needed
+        stages.discard("extraction", "activities")
+
         # Get run details (distance, city etc.)
-        start = time.time()
-        route_info = llm_with_response_schema(CLIENT, msgs, GenerateRouteInfo, GENERATE_RUN_PROMPT)
-        print(f"Extract: {time.time() - start:.2f} seconds")
+        route_info = intent["generate_info"] or stages.run(
+            "extraction", llm_with_response_schema, CLIENT, fit_messages(msgs, CONTEXT_BUDGETS["extraction"]), GenerateRouteInfo,
+            GENERATE_RUN_PROMPT)
         msgs.append({"role": "assistant", "content": str(route_info)})
     
-        # Generate new route
-        start = time.time()
-        route_id = f"gen-{int(time.time()*1000)}"
-        coords = generate_route(route_info)
+        # Generate several candidate loops and keep the best scored ones
+        stamp = int(time.time()*1000)
+        routes = stages.run("generation", generate_routes, route_info, n_candidates=GENERATE_CANDIDATES, top_k=GENERATE_TOP_K)
         activities = [{
-            "route_id": route_id, "kind": "generated", "name": "Generated Route", "distance": route_info.get("distance"), 
-            "start_city": route_info.get("city"), "coords": coords
-        }]
-        print(f"Generation: {time.time() - start:.2f} seconds")
+            "route_id": f"gen-{stamp}-{i}", "kind": "generated", "name": f"Generated Route {i + 1}", "distance": r["distance"],
+            "total_elevation_gain": r["elevation_gain"], "distance_error": r["distance_error"], "overlap_ratio": r["overlap_ratio"],
+            "turns": r["turns"], "start_city": route_info.get("city"), "coords": r["coords"]
+        } for i, r in enumerate(routes)]
+        for a in activities:
+            _register_route(a["route_id"], a["name"], coords=a["coords"])
+        print(stages.report())
 
         # Create a short summary for the user
-        summary_text = f"Generated a ~{int(route_info.get('distance', 0) or 0)} m loop in {route_info.get('city','unknown')}."
+        city = route_info.get('city','unknown')
+        if activities:
+            summary_text = (f"Generated {len(activities)} loop option(s) of ~{int(route_info.get('distance', 0) or 0)} m in {city}. "
+                            f"The best one is {activities[0]['distance'] / 1000:.2f} km.")
+        else:
+            summary_text = f"Could not generate a loop in {city}."
 
         # Save message and response to chat history
         _append_history("user", user_input)
         _append_history("assistant", summary_text)
 
         # Send back route info to frontend
-        return jsonify({
-            "input": user_input, "mode": "run", "run_details": route_info, "count": 1, "results": activities,
-            "auto_select_route_id": route_id, "response": summary_text, "map": f"/{MAP_PATH}"
-        })
+        results = {
+            "input": user_input, "mode": "run", "run_details": route_info, "count": len(activities), "results": activities,
+            "auto_select_route_id": activities[0]["route_id"] if activities else None
+        }
+        yield "results", results
+        yield "done", {**results, "response": summary_text}
     
     else:
-        # If message was not about a specific run, do normal chat
-        start = time.time()
-        chat_response = llm_general_chat(CLIENT, msgs, GENERAL_CHAT_PROMPT)
-        print(f"Chat: {time.time() - start:.2f} seconds")
+        # If message was not about a specific run, do normal chat (speculative work is dropped)
+        stages.discard("extraction", "activities")
+        chat_response = yield from _llm_text(stages, "chat", fit_messages(msgs, CONTEXT_BUDGETS["chat"]), GENERAL_CHAT_PROMPT, stream)
+        print(stages.report())
 
         # Save question and answer to history
         _append_history("user", user_input)
         _append_history("assistant", chat_response)
         
         # Send normal chat reply
-        return jsonify({"input": user_input, "mode": "chat", "response": chat_response})
+        yield "done", {"input": user_input, "mode": "chat", "response": chat_response}
 
 
-@app.route("/api/select_route", methods=["POST"])
-def select_route():
-    """Show one selected route on the map."""
-    data = request.get_json(silent=True) or {}
-    name = (data.get("name") or "").strip() or "Route"
-    coords = data.get("coords")
-    polyline = data.get("polyline")
-
-    # Draw generated route (lat/lon list)
-    if coords and isinstance(coords, list):
-        build_single_route_map(coords, name, MAP_PATH)
-        return jsonify({"ok": True})
+@app.route("/api/chat", methods=["POST"])
+def chat():
+    """Main chat endpoint that decides if user wants a run or general chat."""
+    user_input, ranking_mode, error = _chat_request()
+    if error:
+        return error
+    for event, payload in _chat_events(user_input, ranking_mode):
+        if event == "done":
+            return jsonify(payload)
+
+
+@app.route("/api/chat/stream", methods=["POST"])
+def chat_stream():
+    """Chat endpoint as Server-Sent Events: routes as soon as they are ranked, then summary tokens."""
+    user_input, ranking_mode, error = _chat_request()
+    if error:
+        return error
+
+    def events():
+        try:
+            for event, payload in _chat_events(user_input, ranking_mode, stream=True):
+                yield _sse(event, payload)
+        except Exception as e:
+            yield _sse("error", {"error": str(e)})
+
+    return app.response_class(stream_with_context(events()), mimetype="text/event-stream",
+                              headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/map")
+def map_shell():
+    """Serve the map page once; routes are drawn into it as GeoJSON layers."""
+    return render_template("map.html")
+
+
+@app.route("/api/route/<route_id>.geojson")
+def route_geometry(route_id):
+    """Return one route's geometry as a GeoJSON feature, simplified for ?zoom= and sent with a strong ETag."""
+    route = _find_route(route_id)
+    if not route:
+        return jsonify({"error": "Unknown route"}), 404
+    coords = route["coords"] if route["coords"] is not None else decode_polylines([route["polyline"]])[0]
+    zoom = request.args.get("zoom", type=int)
+
+    # Browser already has this exact geometry: skip simplifying and encoding
+    key = route_etag(coords, route["name"], zoom)
+    if key in request.if_none_match:
+        resp = app.response_class(status=304)
+    else:
+        # Simplified for the requested zoom (or the zoom that fits the whole route)
+        resp = jsonify(route_geojson(route_at_zoom(coords, zoom), route["name"]))
+    resp.set_etag(key)
+    resp.headers["Cache-Control"] = "private, max-age=3600"
+    return resp
 
-    # Draw Strava route from encoded polyline
-    if polyline:
-        build_polyline_route_map(polyline, name, MAP_PATH)
-        return jsonify({"ok": True})
 
-    # If no route data, reset map
-    build_empty_map(MAP_PATH)
-    return jsonify({"ok": True, "empty": True})
+@app.route("/api/warmup_status")
+def warmup():
+    """Report which home areas have their street graphs loaded."""
+    status = warmup_status()
+    return jsonify({"ready": all(s.get("state") == "ready" for s in status.values()), "areas": status})
 
 
-@app.route("/api/clear_route", methods=["POST"])
-def clear_route():
-    """Reset map to default empty state."""
-    build_empty_map(MAP_PATH)
-    return jsonify({"ok": True})
+@app.route("/api/llm_cache_stats")
+def llm_cache():
+    """Report LLM response cache hits and misses per call type."""
+    return jsonify(llm_cache_stats())
 
 
 @app.route("/api/analyze_activity", methods=["POST"])
 def analyze_activity():
     """Send selected activity to LLM for analysis."""
     data = request.get_json(silent=True) or {}
-    kind = (data.get("kind") or "").strip()
-
-    # Get map screenshot from frontend
-    image_data_url = data.get("image_data_url")
+    route_id = (data.get("route_id") or "").strip()
+    kind = (data.get("kind") or ("strava" if route_id.startswith("strava-") else "generated" if route_id else "")).strip()
 
     try:
         # Create text input for LLM depending on route type
+        streams = None
         if kind == "strava":
-            route_id = data.get("id")
-            activity = get_strava_activity(route_id, TOKEN_FILE, STRAVA_CLIENT_ID, STRAVA_CLIENT_SECRET)
-            text_blob = f"Strava activity full JSON follows. Name: {activity.get('name')}\n\n" + str(activity)
+            activity_id = data.get("id") or route_id[len("strava-"):]
+            route_id = route_id or f"strava-{activity_id}"
+            activity = get_strava_activity(activity_id, TOKEN_FILE, STRAVA_CLIENT_ID, STRAVA_CLIENT_SECRET, DETAIL_CACHE_DIR)
+
+            # Add splits and intensity from per-second streams when available (else Strava's own splits)
+            stream_text = ""
+            try:
+                streams = get_activity_streams(activity_id, STREAMS_DIR, TOKEN_FILE, STRAVA_CLIENT_ID, STRAVA_CLIENT_SECRET)
+                stream_text = describe_streams(streams)
+            except Exception as e:
+                print(f"Streams unavailable: {e}")
+            text_blob = "Strava activity stats:\n" + activity_detail_text(activity, splits=not stream_text)
+            if stream_text:
+                text_blob += "\n\n" + stream_text
         elif kind == "generated":
-            coords = data.get("coords") or []
+            route = _find_route(route_id) if route_id else None
+            coords = [tuple(p) for p in route["coords"]] if route and route["coords"] is not None else data.get("coords") or []
             distance = data.get("distance")
-            text_blob = f"Generated route. Distance (m): {distance}. No Strava stats available.\nCoordinates (first 50):\n{coords[:50]}"
+            text_blob = (f"Generated route. Distance (m): {distance}. No Strava stats available.\n"
+                         f"Coordinates (lat,lon; evenly sampled):\n{coords_text(coords, budget=CONTEXT_BUDGETS['analysis'] // 2)}")
         else:
             return jsonify({"ok": False, "error": "Unknown kind"}), 400
 
+        # Route image rendered on the server (cached per route)
+        image_data_url = None
+        try:
+            png = _route_image(route_id, streams) if route_id else None
+            image_data_url = png_data_url(png) if png else None
+        except Exception as e:
+            print(f"Route image failed: {e}")
+
         # Ask LLM for analysis
-        analysis = llm_analyze_activity(CLIENT, text_blob, image_data_url, ACTIVITY_ANALYSIS_PROMPT)
+        analysis = llm_analyze_activity(CLIENT, truncate_to_tokens(text_blob, CONTEXT_BUDGETS["analysis"]), image_data_url, ACTIVITY_ANALYSIS_PROMPT)
         return jsonify({"ok": True, "analysis": analysis})
     
     except Exception as e:
@@ -267,20 +602,49 @@ def transcribe():
     if not file:
         return jsonify({"error": "Missing 'file' in form-data."}), 400
 
-    # Save to a temp path
-    fd, tmp_path = tempfile.mkstemp(suffix=".webm")
-    os.close(fd)
-    file.save(tmp_path)
+    # Passed on in memory, no temp file
     try:
-        text = transcribe_audio(CLIENT, tmp_path) or ""
+        text = transcribe_audio(CLIENT, file.read(), file.filename or "input.webm") or ""
         return jsonify({"text": text})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
+
+
+@app.route("/api/transcribe/segment", methods=["POST"])
+def transcribe_segment():
+    """Receive one recorded segment (session, index, file); the final one returns the whole transcript."""
+    file = request.files.get("file")
+    session_id = (request.form.get("session") or "").strip()
+    index = request.form.get("index", type=int)
+    if not file or not session_id or index is None:
+        return jsonify({"error": "Need 'file', 'session' and 'index' in form-data."}), 400
+
+    # Start transcribing right away; segments of a session finish in any order
+    audio = file.read()
+    final = request.form.get("final") == "1"
+    now = time.time()
+    with TRANSCRIBE_LOCK:
+        for sid in [sid for sid, session in TRANSCRIPTS.items() if now - session["updated"] > TRANSCRIBE_SESSION_TTL]:
+            del TRANSCRIPTS[sid]
+        session = TRANSCRIPTS.setdefault(session_id, {"segments": {}, "updated": now, "closed": False})
+        # Closed sessions are kept until they expire so late segments are refused, not started as new sessions
+        if session["closed"]:
+            return jsonify({"error": "Session already finished."}), 409
+        session["updated"] = now
+        if audio:
+            session["segments"][index] = TRANSCRIBE_EXECUTOR.submit(transcribe_audio, CLIENT, audio, file.filename or "segment.webm")
+        if final:
+            session["closed"] = True
+            segments, session["segments"] = session["segments"], {}
+    if not final:
+        return jsonify({"ok": True})
+
+    # Last segment: join all transcripts in recording order
+    try:
+        texts = [segments[i].result().strip() for i in sorted(segments)]
+        return jsonify({"text": " ".join(t for t in texts if t), "segments": len(segments)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 
 if __name__ == "__main__":
@@ -0,0 +1,112 @@
+"""Micro-benchmark: old pandas ranking path vs. the stored-embedding path in rag_funcs.
+
+Run from the repository root:
+    python benchmarks/ranking_benchmark.py [--sizes 10000 100000] [--dim 256] [--repeats 3]
+
+Embedding API calls are replaced by a local fake, so only ranking work is timed. The new path is timed
+cold (description and query caches cleared before every run) and warm (repeated question, caches filled).
+"""
+import argparse, os, statistics, sys, tempfile, time
+from types import SimpleNamespace
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from functions import rag_funcs
+
+
+# Embeddings client that answers from a random generator instead of the API
+class FakeClient:
+    def __init__(self, dim, seed=0):
+        rng = np.random.default_rng(seed)
+        create = lambda model, input: SimpleNamespace(data=[
+            SimpleNamespace(embedding=rng.standard_normal(dim).astype(np.float32).tolist())
+            for _ in ([input] if isinstance(input, str) else input)])
+        self.embeddings = SimpleNamespace(create=create)
+
+
+# Synthetic activities with the fields used for descriptions
+def make_activities(n, seed=1):
+    """Return n activity dicts with plausible running stats."""
+    rng = np.random.default_rng(seed)
+    days = rng.integers(0, 3 * 365, n)
+    return [{
+        "id": i, "name": f"Run {i}", "distance": float(rng.uniform(2000, 25000)), "moving_time": float(rng.uniform(600, 9000)),
+        "total_elevation_gain": float(rng.uniform(0, 400)), "average_speed": float(rng.uniform(2.2, 4.5)),
+        "average_heartrate": float(rng.uniform(120, 175)),
+        "start_date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(1_600_000_000 + int(d) * 86400 + i % 86400)),
+    } for i, d in enumerate(days)]
+
+
+# The ranking path before the embedding store (embeddings already fetched)
+def legacy_rank(client, query, activities, embeddings):
+    """DataFrame, iterrows text building, per-call norms and a full argsort."""
+    import pandas as pd
+    df = pd.DataFrame.from_records(activities)
+    texts = [rag_funcs._row_to_text(row) for _, row in df.iterrows()]
+    q_resp = client.embeddings.create(model=rag_funcs.EMBED_MODEL, input=query)
+    query_vec = np.array(q_resp.data[0].embedding, dtype=np.float32)
+    denom = (np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query_vec) + 1e-8)
+    scores = (embeddings @ query_vec) / denom
+    best_idx = np.argsort(scores)[::-1]
+    results = df.iloc[best_idx]
+    return df.iloc[results.index].to_dict('records'), texts
+
+
+def clear_caches():
+    """Empty the in-process description and query-embedding caches of rag_funcs."""
+    rag_funcs._describe.cache_clear()
+    with rag_funcs._LOCK:
+        rag_funcs._QUERIES.clear()
+
+
+def timed(fn, repeats, setup=None):
+    """Return median wall time of fn over repeats (setup runs untimed before each one)."""
+    times = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--dim", type=int, default=256, help="embedding size (text-embedding-3-small uses 1536)")
+    parser.add_argument("--top-k", type=int, default=25)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    try:
+        import pandas  # noqa: F401
+        has_pandas = True
+    except ImportError:
+        has_pandas = False
+        print("pandas not installed: timing only the new path")
+
+    print(f"{'activities':>10} {'old (s)':>9} {'cold (s)':>9} {'warm (s)':>9} {'speedup':>8}")
+    for n in args.sizes:
+        client = FakeClient(args.dim)
+        activities = make_activities(n)
+        with tempfile.TemporaryDirectory() as store_dir:
+            # Fill the store once (a normal ranking call finds every activity already embedded)
+            rag_funcs.rag_ranking(client, "warm-up", activities, store_dir, args.top_k)
+            query = "easy 10 km evening run"
+            rank = lambda: rag_funcs.rag_ranking(client, query, activities, store_dir, args.top_k)
+            cold = timed(rank, args.repeats, setup=clear_caches)
+            rank()
+            warm = timed(rank, args.repeats)
+
+            old = None
+            if has_pandas:
+                embeddings = np.asarray(np.random.default_rng(2).standard_normal((n, args.dim)), dtype=np.float64)
+                old = timed(lambda: legacy_rank(client, query, activities, embeddings), args.repeats)
+        # Speedup is against the cold run: a new question over a freshly started process
+        speedup = f"{old / cold:7.1f}x" if old else "      -"
+        print(f"{n:>10} {old if old is not None else float('nan'):>9.3f} {cold:>9.3f} {warm:>9.3f} {speedup:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import threading
+import numpy as np
+
+
+# Allowed deviation from each target, in percent
+FILTER_TOLERANCES = {"distance": 10, "elevation_gain": 10, "time": 5, "pace": 5, "heart_rate": 3}
+
+# Activities must start within this many km of the requested city
+CITY_RADIUS_KM = 15.0
+
+# Size of spatial grid cells in degrees (~28 km north-south)
+GRID_DEG = 0.25
+EARTH_RADIUS_KM = 6371.0088
+
+# Target key (RouteInfo) -> Strava activity field
+FIELDS = {
+    "distance": "distance",
+    "elevation_gain": "total_elevation_gain",
+    "time": "moving_time",
+    "pace": "average_speed",
+    "heart_rate": "average_heartrate",
+}
+
+# Last built table, reused while the same activity list is passed in
+_CACHE = {"source": None, "table": None}
+_CACHE_LOCK = threading.Lock()
+
+
+# Great-circle distance from one point to many points
+def haversine_km(lat, lon, lats, lons):
+    """Return distances in km from (lat, lon) to arrays of coordinates."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+# Columnar view of the activity list with a grid index on start position
+class ActivityTable:
+    def __init__(self, activities):
+        self.activities = activities
+        self.columns = {
+            key: np.array([a.get(field) or 0 for a in activities], dtype=np.float64)
+            for key, field in FIELDS.items()
+        }
+        coords = [a.get("start_latlng") or () for a in activities]
+        has_coords = np.array([len(c) >= 2 for c in coords], dtype=bool)
+        self.lat = np.array([c[0] if len(c) >= 2 else np.nan for c in coords], dtype=np.float64)
+        self.lon = np.array([c[1] if len(c) >= 2 else np.nan for c in coords], dtype=np.float64)
+
+        # Activities need a start position; a missing value (0) only excludes them from queries targeting that field
+        self.valid = has_coords
+
+        # Grid cell -> row indices, for radius queries
+        self.grid = {}
+        rows = np.flatnonzero(has_coords)
+        cells = np.floor(np.stack([self.lat[rows], self.lon[rows]], axis=1) / GRID_DEG).astype(np.int64)
+        for (ci, cj), row in zip(map(tuple, cells), rows):
+            self.grid.setdefault((ci, cj), []).append(row)
+        self.grid = {cell: np.array(r, dtype=np.int64) for cell, r in self.grid.items()}
+
+    def __len__(self):
+        return len(self.activities)
+
+    def within_radius(self, lat, lon, radius_km):
+        """Return row indices of activities starting within radius_km of (lat, lon)."""
+        dlat = radius_km / 111.2
+        dlon = radius_km / (111.2 * max(np.cos(np.radians(lat)), 0.01))
+        i0, i1 = int(np.floor((lat - dlat) / GRID_DEG)), int(np.floor((lat + dlat) / GRID_DEG))
+        j0, j1 = int(np.floor((lon - dlon) / GRID_DEG)), int(np.floor((lon + dlon) / GRID_DEG))
+        parts = [self.grid[(i, j)] for i in range(i0, i1 + 1) for j in range(j0, j1 + 1) if (i, j) in self.grid]
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        rows = np.concatenate(parts)
+        return np.sort(rows[haversine_km(lat, lon, self.lat[rows], self.lon[rows]) <= radius_km])
+
+    def query(self, targets, center=None, tolerances=None, radius_km=CITY_RADIUS_KM):
+        """Return row indices matching all range targets and (optionally) a start radius."""
+        tolerances = {**FILTER_TOLERANCES, **(tolerances or {})}
+        mask = self.valid.copy()
+        for key, target in targets.items():
+            if not target:
+                continue
+            col, pct = self.columns[key], tolerances[key] / 100
+            mask &= (col != 0) & (col >= target * (1 - pct)) & (col <= target * (1 + pct))
+        if center is None:
+            return np.flatnonzero(mask)
+        near = self.within_radius(center[0], center[1], radius_km)
+        return near[mask[near]]
+
+
+# Get table for an activity list (cached while the same list is used)
+def get_activity_table(activities):
+    """Return an ActivityTable for activities, reusing the last one if possible."""
+    with _CACHE_LOCK:
+        if _CACHE["source"] is activities:
+            return _CACHE["table"]
+    table = ActivityTable(activities)
+    with _CACHE_LOCK:
+        _CACHE.update({"source": activities, "table": table})
+    return table
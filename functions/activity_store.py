@@ -0,0 +1,134 @@
+import json, os, sqlite3, threading, time, calendar
+from pathlib import Path
+
+from functions.strava_api import get_all_strava_activities
+
+
+# Sync settings
+MIN_SYNC_INTERVAL = 300            # seconds between two incremental syncs
+RECONCILE_WINDOW = 14 * 24 * 3600  # recent history re-checked for edits and deletions
+
+# Fields that change an activity's route or recorded data; edits to anything else (kudos, comments, name)
+# keep its stored streams
+STREAM_FIELDS = ("distance", "moving_time", "elapsed_time", "start_date", "total_elevation_gain", "average_speed",
+                 "average_heartrate", "start_latlng", "end_latlng", "map", "sport_type", "type")
+
+# Only one sync per process at a time
+_SYNC_LOCK = threading.Lock()
+
+# Parsed activities kept in memory until the store changes
+_CACHE = {"db_path": None, "version": None, "activities": []}
+_CACHE_LOCK = threading.Lock()
+
+
+# Helper for opening the store (creates tables on first use)
+def _connect(db_path):
+    """Open the SQLite activity store."""
+    Path(os.path.dirname(db_path) or ".").mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS activities ("
+        "id INTEGER PRIMARY KEY, start_ts INTEGER NOT NULL, data TEXT NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_activities_start ON activities(start_ts)")
+    conn.execute("CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT)")
+    return conn
+
+# Helpers for reading and writing sync state values
+def _get_state(conn, key, default=None):
+    """Return one sync state value or default."""
+    row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+    return json.loads(row[0]) if row else default
+
+def _set_state(conn, key, value):
+    """Store one sync state value."""
+    conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+# Helper for converting Strava's ISO start time to a Unix timestamp
+def _start_ts(activity):
+    """Return activity start as Unix timestamp (0 if missing)."""
+    start = activity.get("start_date")
+    if not start:
+        return 0
+    return calendar.timegm(time.strptime(start, "%Y-%m-%dT%H:%M:%SZ"))
+
+
+# Sync local store with Strava (full backfill once, then incremental)
+def sync_activities(db_path, token_file, strava_client_id, strava_client_secret, force=False):
+    """Bring the local store up to date and return ids that were added, updated or deleted.
+
+    "reshaped" lists the updated ids whose STREAM_FIELDS changed."""
+    changes = {"added": [], "updated": [], "deleted": [], "reshaped": []}
+    with _SYNC_LOCK:
+        conn = _connect(db_path)
+        try:
+            last_sync = _get_state(conn, "last_sync", 0)
+            cursor = _get_state(conn, "cursor")
+            if not force and cursor is not None and time.time() - last_sync < MIN_SYNC_INTERVAL:
+                return changes
+
+            # Re-read a recent window so edits and deletions there are picked up
+            after = None if cursor is None else max(0, cursor - RECONCILE_WINDOW)
+            fetched = get_all_strava_activities(token_file, strava_client_id, strava_client_secret, after=after)
+
+            # Compare with what is stored for the same window
+            if after is None:
+                rows = conn.execute("SELECT id, data FROM activities").fetchall()
+            else:
+                rows = conn.execute("SELECT id, data FROM activities WHERE start_ts > ?", (after,)).fetchall()
+            local = {row[0]: row[1] for row in rows}
+
+            seen = set()
+            for activity in fetched:
+                activity_id = activity.get("id")
+                if activity_id is None:
+                    continue
+                seen.add(activity_id)
+                data = json.dumps(activity, sort_keys=True)
+                if activity_id not in local:
+                    changes["added"].append(activity_id)
+                elif local[activity_id] != data:
+                    changes["updated"].append(activity_id)
+                    stored = json.loads(local[activity_id])
+                    if any(stored.get(field) != activity.get(field) for field in STREAM_FIELDS):
+                        changes["reshaped"].append(activity_id)
+                else:
+                    continue
+                conn.execute(
+                    "INSERT OR REPLACE INTO activities (id, start_ts, data) VALUES (?, ?, ?)",
+                    (activity_id, _start_ts(activity), data)
+                )
+
+            # Anything stored in the window that Strava no longer lists was deleted
+            changes["deleted"] = [activity_id for activity_id in local if activity_id not in seen]
+            conn.executemany("DELETE FROM activities WHERE id = ?", [(i,) for i in changes["deleted"]])
+
+            # Move cursor and bump version so readers reload
+            newest = conn.execute("SELECT MAX(start_ts) FROM activities").fetchone()[0]
+            _set_state(conn, "cursor", newest or 0)
+            _set_state(conn, "last_sync", time.time())
+            if any(changes.values()):
+                _set_state(conn, "version", _get_state(conn, "version", 0) + 1)
+            conn.commit()
+        finally:
+            conn.close()
+    return changes
+
+# Read all stored activities (newest first), cached until the store changes
+def load_activities(db_path):
+    """Return every activity in the local store."""
+    conn = _connect(db_path)
+    try:
+        version = _get_state(conn, "version", 0)
+        with _CACHE_LOCK:
+            if _CACHE["db_path"] == db_path and _CACHE["version"] == version:
+                return _CACHE["activities"]
+        rows = conn.execute("SELECT data FROM activities ORDER BY start_ts DESC").fetchall()
+    finally:
+        conn.close()
+
+    activities = [json.loads(row[0]) for row in rows]
+    with _CACHE_LOCK:
+        _CACHE.update({"db_path": db_path, "version": version, "activities": activities})
+    return activities
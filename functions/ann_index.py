@@ -0,0 +1,203 @@
+import json, os, threading
+from pathlib import Path
+import numpy as np
+
+
+# Inverted-file (IVF-flat) layout
+TRAIN_MIN = 1024              # below this many vectors every search is exact
+N_PROBE = 8                   # lists scanned per search (more if filters leave too few hits)
+KMEANS_ITERS = 8
+KMEANS_SAMPLE = 20_000        # vectors used to train the list centroids
+RETRAIN_GROWTH = 4            # retrain when the index has grown this much since training
+TAIL_RATIO = 0.02             # rows inserted since the last reorganisation, scanned exactly
+CHUNK = 16_384                # rows per matrix product when assigning lists
+
+# Metadata that searches can filter on (missing values are NaN and never match a range)
+META_FIELDS = ("start_ts", "distance")
+
+
+# Approximate nearest-neighbour index over unit vectors
+class IVFIndex:
+    """Rows [0, n_sorted) are grouped by list (see bounds); later rows form an exact-scan tail."""
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.lock = threading.RLock()
+        self.size, self.n_sorted = 0, 0
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.meta = {f: np.zeros(0, dtype=np.float64) for f in META_FIELDS}
+        self.alive = np.zeros(0, dtype=bool)
+        self.assign = np.zeros(0, dtype=np.int32)
+        self.centroids, self.bounds, self.trained_size = None, None, 0
+        self.positions = {}       # id -> row
+        self.hashes = {}          # id -> text hash the vector was built from
+
+    def __len__(self):
+        return len(self.positions)
+
+    # Storage helpers
+    def _reserve(self, n):
+        """Grow arrays (doubling) so n more rows fit."""
+        need = self.size + n
+        if need <= len(self.ids):
+            return
+        cap = max(need, 2 * len(self.ids), 256)
+        grow = lambda a, fill: np.concatenate([a[:self.size], np.full((cap - self.size,) + a.shape[1:], fill, dtype=a.dtype)])
+        self.ids, self.vectors = grow(self.ids, -1), grow(self.vectors, 0)
+        self.alive, self.assign = grow(self.alive, False), grow(self.assign, -1)
+        self.meta = {f: grow(col, np.nan) for f, col in self.meta.items()}
+
+    def _nearest_list(self, vectors):
+        """Return the closest centroid for each vector."""
+        out = np.empty(len(vectors), dtype=np.int32)
+        for i in range(0, len(vectors), CHUNK):
+            out[i:i + CHUNK] = np.argmax(vectors[i:i + CHUNK] @ self.centroids.T, axis=1)
+        return out
+
+    def _train(self):
+        """Fit list centroids with spherical k-means on a sample of live vectors."""
+        live = np.flatnonzero(self.alive[:self.size])
+        n_lists = max(1, int(np.sqrt(len(live))))
+        rng = np.random.default_rng(len(live))
+        sample = self.vectors[rng.choice(live, min(len(live), KMEANS_SAMPLE), replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(KMEANS_ITERS):
+            self.centroids = centroids
+            labels = self._nearest_list(sample)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=n_lists)
+            empty = counts == 0
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-8)
+        self.centroids = centroids.astype(np.float32)
+        self.assign[:self.size] = -1
+        self.trained_size = len(live)
+
+    def _reorganise(self):
+        """Drop deleted rows and regroup all rows by list so each list is one slice."""
+        live = np.flatnonzero(self.alive[:self.size])
+        if self.centroids is not None:
+            fresh = live[self.assign[live] < 0]
+            self.assign[fresh] = self._nearest_list(self.vectors[fresh])
+            live = live[np.argsort(self.assign[live], kind="stable")]
+        self.ids, self.vectors, self.alive, self.assign = self.ids[live], self.vectors[live], self.alive[live], self.assign[live]
+        self.meta = {f: col[live] for f, col in self.meta.items()}
+        self.size = self.n_sorted = len(live)
+        self.positions = {int(i): r for r, i in enumerate(self.ids.tolist())}
+        if self.centroids is not None:
+            self.bounds = np.searchsorted(self.assign, np.arange(len(self.centroids) + 1))
+
+    def _maintain(self):
+        """Train, retrain or regroup when the index has drifted enough."""
+        n = len(self.positions)
+        if self.centroids is None and n < TRAIN_MIN:
+            return
+        if self.centroids is None or n > RETRAIN_GROWTH * self.trained_size:
+            self._train()
+            self._reorganise()
+        elif self.size - self.n_sorted > TAIL_RATIO * max(n, 1) or self.size > 2 * n:
+            self._reorganise()
+
+    # Updates
+    def add(self, ids, vectors, meta=None, hashes=None):
+        """Insert or replace vectors (unit length) for ids, with optional metadata columns and text hashes."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        ids = [int(i) for i in ids]
+        with self.lock:
+            self.remove(ids)
+            self._reserve(len(ids))
+            rows = slice(self.size, self.size + len(ids))
+            self.ids[rows], self.vectors[rows], self.alive[rows], self.assign[rows] = ids, vectors, True, -1
+            for f in META_FIELDS:
+                values = (meta or {}).get(f)
+                self.meta[f][rows] = np.nan if values is None else np.asarray(values, dtype=np.float64)
+            for r, i in enumerate(ids, start=self.size):
+                self.positions[i] = r
+            if hashes is not None:
+                self.hashes.update(zip(ids, hashes))
+            self.size += len(ids)
+            self._maintain()
+
+    def remove(self, ids):
+        """Delete ids (space is reclaimed at the next reorganisation)."""
+        with self.lock:
+            for i in ids:
+                row = self.positions.pop(int(i), None)
+                self.hashes.pop(int(i), None)
+                if row is not None:
+                    self.alive[row] = False
+
+    # Search
+    def _filter_mask(self, rows, filters):
+        """Return which rows are alive and inside all (low, high) metadata ranges."""
+        mask = self.alive[rows].copy()
+        for field, (low, high) in (filters or {}).items():
+            col = self.meta[field][rows]
+            if low is not None:
+                mask &= col >= low
+            if high is not None:
+                mask &= col <= high
+        return mask
+
+    def search(self, query, k=10, filters=None, n_probe=N_PROBE):
+        """Return (ids, scores) of up to k best rows by dot product, restricted to filters {field: (low, high)}."""
+        q = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        with self.lock:
+            hit_rows, hit_scores = [], []
+
+            def scan(start, stop):
+                scores = self.vectors[start:stop] @ q
+                mask = self._filter_mask(slice(start, stop), filters)
+                hit_rows.append(np.flatnonzero(mask) + start)
+                hit_scores.append(scores[mask])
+                return int(mask.sum())
+
+            # Tail rows are scanned exactly; lists are probed nearest-first until enough rows pass the filters
+            found = scan(self.n_sorted, self.size)
+            if self.centroids is None:
+                found += scan(0, self.n_sorted)
+            else:
+                for probed, l in enumerate(np.argsort(-(self.centroids @ q))):
+                    if probed >= n_probe and found >= k:
+                        break
+                    found += scan(int(self.bounds[l]), int(self.bounds[l + 1]))
+
+            rows, scores = np.concatenate(hit_rows), np.concatenate(hit_scores)
+            if len(rows) > k:
+                best = np.argpartition(-scores, k)[:k]
+                rows, scores = rows[best], scores[best]
+            order = np.argsort(-scores, kind="stable")
+            return self.ids[rows[order]], scores[order]
+
+    # Persistence
+    def save(self, path):
+        """Write the index to an .npz file atomically."""
+        with self.lock:
+            self._reorganise()
+            Path(os.path.dirname(path) or ".").mkdir(parents=True, exist_ok=True)
+            arrays = {"ids": self.ids, "vectors": self.vectors, "assign": self.assign,
+                      **{f"meta_{f}": col for f, col in self.meta.items()}}
+            if self.centroids is not None:
+                arrays["centroids"] = self.centroids
+            state = {"dim": self.dim, "trained_size": self.trained_size, "hashes": {str(i): h for i, h in self.hashes.items()}}
+            with open(path + ".tmp", "wb") as f:
+                np.savez(f, state=np.array(json.dumps(state)), **arrays)
+            os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by save()."""
+        with np.load(path, allow_pickle=False) as data:
+            state = json.loads(str(data["state"]))
+            index = cls(state["dim"])
+            index.ids, index.vectors, index.assign = data["ids"], data["vectors"], data["assign"]
+            index.meta = {f: data[f"meta_{f}"] if f"meta_{f}" in data else np.full(len(index.ids), np.nan) for f in META_FIELDS}
+            index.centroids = data["centroids"] if "centroids" in data else None
+        index.alive = np.ones(len(index.ids), dtype=bool)
+        index.size = len(index.ids)
+        index.trained_size = state["trained_size"]
+        index.hashes = {int(i): h for i, h in state["hashes"].items()}
+        index._reorganise()
+        return index
@@ -0,0 +1,211 @@
+import math
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:           # optional: token counts are estimated from length without it
+    tiktoken = None
+
+
+# Input token budget per call type (instructions and images excluded)
+CONTEXT_BUDGETS = {
+    "router": 1000,
+    "extraction": 1500,
+    "summary": 3000,
+    "chat": 3000,
+    "analysis": 2500,
+}
+
+# Older chat messages are folded into one system message of at most this size (roles stay inside the text)
+ROLLUP_PREFIX = "Summary of earlier conversation:"
+ROLLUP_TOKENS = 300
+ROLLUP_LINE_CHARS = 160
+
+# Encoding used by gpt-4o; without tiktoken a token is taken as ~4 characters
+TOKEN_ENCODING = "o200k_base"
+CHARS_PER_TOKEN = 4
+
+
+# Formatters for compact tables
+def _km(m):
+    return f"{m / 1000:.2f}"
+
+def _clock(s):
+    s = int(round(s))
+    return f"{s // 3600}:{s % 3600 // 60:02d}:{s % 60:02d}"
+
+def _pace(mps):
+    if not mps:
+        return ""
+    secs = 1000 / mps
+    return f"{int(secs // 60)}:{int(secs % 60):02d}"
+
+def _round(digits):
+    return lambda v: f"{v:.{digits}f}" if isinstance(v, (int, float)) else str(v)
+
+def _date(v):
+    return str(v)[:16].replace("T", " ")
+
+# Columns used when activities are listed for the summary prompt: field -> (header, formatter)
+ACTIVITY_COLUMNS = {
+    "name": ("name", str),
+    "distance": ("km", _km),
+    "moving_time": ("time", _clock),
+    "average_speed": ("pace/km", _pace),
+    "total_elevation_gain": ("elev_m", _round(0)),
+    "average_heartrate": ("avg_hr", _round(0)),
+    "start_date": ("date", _date),
+    "distance_error": ("dist_err", _round(2)),
+    "overlap_ratio": ("overlap", _round(2)),
+    "turns": ("turns", _round(0)),
+    "start_city": ("city", str),
+}
+
+# Fields of a Strava activity detail used for analysis (map, segments, photos etc. are dropped)
+DETAIL_FIELDS = {
+    "name": str, "sport_type": str, "start_date_local": _date, "location_city": str, "description": str,
+    "distance": _round(0), "moving_time": _clock, "elapsed_time": _clock, "total_elevation_gain": _round(0),
+    "elev_low": _round(0), "elev_high": _round(0), "average_speed": _pace, "max_speed": _pace,
+    "average_heartrate": _round(0), "max_heartrate": _round(0), "average_cadence": _round(0),
+    "suffer_score": _round(0), "calories": _round(0), "workout_type": str,
+}
+
+# Columns of the per-km splits Strava includes in a detail
+SPLIT_COLUMNS = {
+    "split": ("km", str),
+    "moving_time": ("time", _clock),
+    "average_speed": ("pace/km", _pace),
+    "elevation_difference": ("elev_diff_m", _round(0)),
+    "average_heartrate": ("avg_hr", _round(0)),
+}
+
+
+# Token counting
+@lru_cache(maxsize=1)
+def _encoding():
+    """Return the tiktoken encoding, or None if unavailable."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception as e:
+        print(f"tiktoken unavailable: {e}")
+        return None
+
+@lru_cache(maxsize=4096)
+def count_tokens(text):
+    """Return the number of tokens in text (estimated from its length without tiktoken)."""
+    enc = _encoding()
+    if enc is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(enc.encode(text, disallowed_special=()))
+
+def _message_tokens(message):
+    """Return tokens of one chat message, counting a few for its role and framing."""
+    content = message.get("content")
+    return 4 + count_tokens(content if isinstance(content, str) else str(content))
+
+def truncate_to_tokens(text, budget):
+    """Cut text to at most budget tokens, marking the cut."""
+    if count_tokens(text) <= budget:
+        return text
+    enc = _encoding()
+    if enc is not None:
+        return enc.decode(enc.encode(text, disallowed_special=())[:max(budget - 3, 0)]) + " [...]"
+    return text[:max(budget - 3, 0) * CHARS_PER_TOKEN] + " [...]"
+
+
+# Tables
+def table(rows, columns, budget=None):
+    """Render dict rows as a pipe-separated table, keeping only columns some row has and rows that fit the budget."""
+    used = [(field, header, fmt) for field, (header, fmt) in columns.items() if any(r.get(field) not in (None, "") for r in rows)]
+    if not used:
+        return ""
+    lines = [" | ".join(header for _, header, _ in used)]
+    tokens = count_tokens(lines[0])
+    for i, row in enumerate(rows):
+        cells = []
+        for field, _, fmt in used:
+            value = row.get(field)
+            cells.append("" if value in (None, "") else fmt(value).replace("|", "/").replace("\n", " "))
+        line = " | ".join(cells)
+        tokens += count_tokens(line) + 1
+        if budget is not None and tokens > budget:
+            lines.append(f"... {len(rows) - i} more not shown")
+            break
+        lines.append(line)
+    return "\n".join(lines)
+
+def activity_table(activities, budget=None):
+    """Return ranked activities (Strava or generated) as a compact table."""
+    return table(activities, ACTIVITY_COLUMNS, budget)
+
+def activity_detail_text(activity, budget=None, splits=True):
+    """Return the fields of a Strava activity detail the analysis uses (plus its splits) as plain text."""
+    lines = []
+    for field, fmt in DETAIL_FIELDS.items():
+        value = activity.get(field)
+        if value not in (None, ""):
+            lines.append(f"{field}: {fmt(value)}")
+    rows = (activity.get("splits_metric") or []) if splits else []
+    if rows:
+        lines.append("Per-km splits:")
+        lines.append(table(rows, SPLIT_COLUMNS))
+    text = "\n".join(lines)
+    return truncate_to_tokens(text, budget) if budget else text
+
+def coords_text(coords, budget=None):
+    """Return lat,lon pairs (4 decimals, ~10 m) separated by ';', evenly thinned to fit the budget."""
+    points = [f"{lat:.4f},{lon:.4f}" for lat, lon in coords]
+    if budget and points:
+        per_point = count_tokens(points[0] + ";")
+        keep = max(2, budget // max(per_point, 1))
+        if len(points) > keep:
+            step = (len(points) - 1) / (keep - 1)
+            points = [points[round(i * step)] for i in range(keep)]
+    return ";".join(points)
+
+
+# Conversation history
+def _rollup_line(message):
+    """Return one short line for a message."""
+    content = message.get("content")
+    text = " ".join((content if isinstance(content, str) else str(content)).split())
+    if len(text) > ROLLUP_LINE_CHARS:
+        text = text[:ROLLUP_LINE_CHARS - 3] + "..."
+    return f"{message.get('role')}: {text}"
+
+def rollup(messages, budget=ROLLUP_TOKENS):
+    """Fold messages (and any earlier rollup among them) into one summary message, newest lines kept first."""
+    lines = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str) and content.startswith(ROLLUP_PREFIX):
+            lines.extend(l for l in content[len(ROLLUP_PREFIX):].split("\n") if l.strip())
+        else:
+            lines.append(_rollup_line(message))
+    kept, tokens = [], count_tokens(ROLLUP_PREFIX)
+    for line in reversed(lines):
+        tokens += count_tokens(line) + 1
+        if tokens > budget:
+            break
+        kept.append(line)
+    return {"role": "system", "content": "\n".join([ROLLUP_PREFIX] + kept[::-1])}
+
+def fit_messages(messages, budget):
+    """Return messages within budget: the last one always, then the newest that fit, older ones rolled up."""
+    if not messages:
+        return []
+    last = dict(messages[-1])
+    if _message_tokens(last) > budget:
+        last["content"] = truncate_to_tokens(str(last["content"]), budget - 4)
+    kept, tokens = [last], _message_tokens(last)
+    older = messages[:-1]
+    while older and tokens + _message_tokens(older[-1]) <= budget:
+        tokens += _message_tokens(older[-1])
+        kept.append(older.pop())
+    if older:
+        room = min(ROLLUP_TOKENS, budget - tokens - 4)
+        if room > count_tokens(ROLLUP_PREFIX) + 8:
+            kept.append(rollup(older, room))
+    return kept[::-1]
@@ -0,0 +1,141 @@
+import hashlib, json, os, threading
+from pathlib import Path
+import numpy as np
+
+
+# Default embedding model and store location
+EMBED_MODEL = "text-embedding-3-small"
+EMBEDDINGS_DIR = os.path.join("cache", "embeddings")
+
+# Texts sent per embeddings request
+EMBED_BATCH = 256
+
+# Rewrite the vector file when more than this share of rows is stale
+COMPACT_RATIO = 0.5
+
+_LOCK = threading.Lock()
+_STORES = {}    # (store_dir, model) -> EmbeddingStore
+
+
+# Hash of a description, stored with each vector
+def text_hash(text):
+    """Return a short hash identifying an embedded text."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+# Scale rows to unit length so cosine similarity is a plain dot product
+def normalize_rows(vectors):
+    """Return float32 rows divided by their L2 norm."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-8)
+
+
+# Append-only float32 vector file (unit-length rows) with a JSON id index, one pair per model
+class EmbeddingStore:
+    def __init__(self, store_dir, model=EMBED_MODEL):
+        self.store_dir, self.model = store_dir, model
+        name = model.replace("/", "_")
+        self.data_path = os.path.join(store_dir, f"{name}.f32")
+        self.index_path = os.path.join(store_dir, f"{name}.json")
+        self.lock = threading.Lock()
+        self.index, self.dim, self._mmap = {}, None, None
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r") as f:
+                    saved = json.load(f)
+                self.index, self.dim = saved.get("items", {}), saved.get("dim")
+            except (OSError, ValueError):
+                self.index, self.dim = {}, None
+
+    def _rows(self):
+        """Return the vector file as a read-only (n, dim) memory map."""
+        size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        if not size or not self.dim:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        if self._mmap is None or self._mmap.shape[0] * self.dim * 4 != size:
+            self._mmap = np.memmap(self.data_path, dtype=np.float32, mode="r", shape=(size // (4 * self.dim), self.dim))
+        return self._mmap
+
+    def _write_index(self):
+        """Persist the id index atomically."""
+        with open(self.index_path + ".tmp", "w") as f:
+            json.dump({"model": self.model, "dim": self.dim, "items": self.index}, f)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def _append(self, keys, hashes, vectors):
+        """Append vectors and point the index at them."""
+        Path(self.store_dir).mkdir(parents=True, exist_ok=True)
+        vectors = np.ascontiguousarray(normalize_rows(vectors))
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        start = self._rows().shape[0]
+        with open(self.data_path, "ab") as f:
+            vectors.tofile(f)
+        for i, (key, h) in enumerate(zip(keys, hashes)):
+            self.index[key] = {"row": start + i, "hash": h}
+        self._write_index()
+
+    def _compact(self):
+        """Rewrite the vector file without rows no id points to."""
+        rows = self._rows()
+        if not len(rows) or len(self.index) >= (1 - COMPACT_RATIO) * len(rows):
+            return
+        keys = list(self.index)
+        live = np.array(rows[[self.index[k]["row"] for k in keys]])
+        with open(self.data_path + ".tmp", "wb") as f:
+            live.tofile(f)
+        self._mmap = None
+        os.replace(self.data_path + ".tmp", self.data_path)
+        for i, key in enumerate(keys):
+            self.index[key]["row"] = i
+        self._write_index()
+
+    def missing(self, ids, hashes):
+        """Return positions whose id is unknown or whose text hash changed."""
+        empty, index = {}, self.index
+        with self.lock:
+            return [i for i, (key, h) in enumerate(zip(ids, hashes)) if index.get(key, empty).get("hash") != h]
+
+    def lookup(self, client, ids, texts, batch_size=EMBED_BATCH):
+        """Return (matrix, rows): all unit vectors and the row of each id, embedding only new or changed texts."""
+        keys = [str(i) for i in ids]
+        hashes = [text_hash(t) for t in texts]
+        todo = self.missing(keys, hashes)
+
+        # Embed what is missing in batches (outside the lock; slow network call)
+        for start in range(0, len(todo), batch_size):
+            chunk = todo[start:start + batch_size]
+            response = client.embeddings.create(model=self.model, input=[texts[i] for i in chunk])
+            vectors = np.array([d.embedding for d in response.data], dtype=np.float32)
+            with self.lock:
+                self._append([keys[i] for i in chunk], [hashes[i] for i in chunk], vectors)
+        if todo:
+            print(f"Embedded {len(todo)} of {len(keys)} activities")
+
+        with self.lock:
+            self._compact()
+            index = self.index
+            rows = np.fromiter((index[k]["row"] for k in keys), dtype=np.int64, count=len(keys))
+            return self._rows(), rows
+
+    def vectors(self, client, ids, texts, batch_size=EMBED_BATCH):
+        """Return an (n, dim) float32 array of unit vectors for ids."""
+        matrix, rows = self.lookup(client, ids, texts, batch_size)
+        return np.array(matrix[rows]) if len(rows) else np.zeros((0, self.dim or 0), dtype=np.float32)
+
+    def forget(self, ids):
+        """Drop ids (e.g. deleted activities); their rows go at the next compaction."""
+        with self.lock:
+            removed = [self.index.pop(str(i), None) for i in ids]
+            if any(removed):
+                self._write_index()
+
+
+# Get the shared store for a directory and model
+def get_embedding_store(store_dir=EMBEDDINGS_DIR, model=EMBED_MODEL):
+    """Return one EmbeddingStore per (store_dir, model)."""
+    key = (os.path.abspath(store_dir), model)
+    with _LOCK:
+        if key not in _STORES:
+            _STORES[key] = EmbeddingStore(store_dir, model)
+        return _STORES[key]
@@ -0,0 +1,64 @@
+import time
+import numpy as np
+
+from functions.activity_filter import FIELDS
+
+
+# Relative importance of each feature in the weighted distance
+FEATURE_WEIGHTS = {
+    "distance": 1.0, "elevation_gain": 0.5, "time": 0.7, "pace": 0.7, "heart_rate": 0.4,
+    "time_of_day": 0.3, "recency": 0.2,
+}
+
+# Distance (in standard deviations) charged when an activity lacks a targeted value
+MISSING_PENALTY = 2.0
+
+# Age at which the recency term reaches 1 (days), and the time-of-day scale (hours)
+RECENCY_SCALE_DAYS = 365.0
+TIME_OF_DAY_SCALE_H = 3.0
+
+
+# Numeric columns for a list of activities
+def feature_columns(activities, now=None):
+    """Return {feature: float array} for the RouteInfo targets plus time of day and age in days."""
+    columns = {key: np.array([np.nan if a.get(field) is None else float(a[field]) for a in activities], dtype=np.float64)
+               for key, field in FIELDS.items()}
+    # Hour of day in local time when Strava provides it; age from the UTC start
+    local = np.array([(a.get("start_date_local") or a.get("start_date") or "NaT")[:19] for a in activities], dtype="datetime64[s]")
+    utc = np.array([(a.get("start_date") or "NaT")[:19] for a in activities], dtype="datetime64[s]")
+    seconds = (local - local.astype("datetime64[D]")).astype(np.float64)
+    columns["time_of_day"] = np.where(np.isnat(local), np.nan, seconds / 3600)
+    now = np.datetime64(int(now if now is not None else time.time()), "s")
+    columns["recency"] = np.where(np.isnat(utc), np.nan, (now - utc).astype(np.float64) / 86400)
+    return columns
+
+# Weighted distance of every activity from the targets (lower is closer)
+def numeric_scores(activities, route_info, weights=None, now=None):
+    """Return one score per activity from standardized feature distances to the route_info targets."""
+    weights = {**FEATURE_WEIGHTS, **(weights or {})}
+    columns = feature_columns(activities, now)
+    total = np.zeros(len(activities))
+
+    # Targets from RouteInfo, scaled by the spread of the candidates
+    for key in FIELDS:
+        target = float((route_info or {}).get(key, 0) or 0)
+        if not target or not weights.get(key):
+            continue
+        col = columns[key]
+        spread = np.nanstd(col) if np.isfinite(col).sum() > 1 else 0.0
+        scale = spread if spread > 0 else max(abs(target) * 0.1, 1e-6)
+        z = np.abs(col - target) / scale
+        total += weights[key] * np.where(np.isnan(z), MISSING_PENALTY, z) ** 2
+
+    # Preferred start hour if one was given (circular distance; the extraction uses -1 for none)
+    hour = (route_info or {}).get("time_of_day")
+    if hour not in (None, "") and float(hour) >= 0 and weights.get("time_of_day"):
+        diff = np.abs(columns["time_of_day"] - float(hour)) % 24
+        z = np.minimum(diff, 24 - diff) / TIME_OF_DAY_SCALE_H
+        total += weights["time_of_day"] * np.where(np.isnan(z), MISSING_PENALTY, z) ** 2
+
+    # Mild preference for recent runs (also orders results when no targets were given)
+    if weights.get("recency"):
+        age = columns["recency"] / RECENCY_SCALE_DAYS
+        total += weights["recency"] * np.where(np.isnan(age), MISSING_PENALTY, np.clip(age, 0, None)) ** 2
+    return total
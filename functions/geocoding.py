@@ -0,0 +1,167 @@
+import difflib, json, os, threading, time, unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from geopy.geocoders import Nominatim
+
+
+# Files used by the geocoder
+GEOCODE_CACHE_FILE = os.path.join("cache", "geocode.json")
+GAZETTEER_FILE = os.getenv("GAZETTEER_FILE", str(Path(__file__).resolve().parent.parent / "data" / "cities.tsv"))
+
+# Geocoder settings
+MEMORY_CACHE_SIZE = 1024
+NOMINATIM_TIMEOUT = 3          # seconds before falling back to the gazetteer
+NOMINATIM_MIN_INTERVAL = 1.0   # Nominatim usage policy: max one request per second
+FUZZY_CUTOFF = 0.8
+
+# Country names accepted after a comma ("Uppsala, Sweden"); country and admin1 codes ("Uppsala, SE") always work
+COUNTRY_NAMES = {
+    "at": ("austria",), "au": ("australia",), "be": ("belgium",), "ch": ("switzerland",), "cz": ("czechia", "czech republic"),
+    "de": ("germany",), "dk": ("denmark",), "ee": ("estonia",), "es": ("spain",), "fi": ("finland",), "fr": ("france",),
+    "gb": ("united kingdom", "uk", "great britain", "england", "scotland", "wales"), "gr": ("greece",), "ie": ("ireland",),
+    "is": ("iceland",), "it": ("italy",), "jp": ("japan",), "lv": ("latvia",), "nl": ("netherlands", "holland"),
+    "no": ("norway",), "pl": ("poland",), "pt": ("portugal",), "se": ("sweden",), "us": ("united states", "usa", "america"),
+}
+
+_LOCK = threading.Lock()       # guards caches
+_NET_LOCK = threading.Lock()   # serializes Nominatim requests
+_MEMORY = OrderedDict()        # normalized name -> (lat, lon) or None
+_STATE = {"disk": None, "gazetteer": None, "geolocator": None, "last_request": 0.0}
+
+
+# Helper for turning a city string into a cache key
+def normalize_city(city_name):
+    """Lowercase, strip accents and extra whitespace/punctuation."""
+    text = unicodedata.normalize("NFKD", city_name or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+    text = "".join(ch if ch.isalnum() or ch in " ,-" else " " for ch in text)
+    return " ".join(text.replace("-", " ").split()).strip(" ,")
+
+
+# Helpers for the memory and disk caches
+def _remember(key, coords):
+    """Store a result in the memory LRU."""
+    _MEMORY[key] = coords
+    _MEMORY.move_to_end(key)
+    while len(_MEMORY) > MEMORY_CACHE_SIZE:
+        _MEMORY.popitem(last=False)
+
+def _disk_cache():
+    """Return the persistent cache, loading it on first use."""
+    if _STATE["disk"] is None:
+        try:
+            with open(GEOCODE_CACHE_FILE, "r", encoding="utf-8") as f:
+                _STATE["disk"] = {k: tuple(v) for k, v in json.load(f).items()}
+        except (OSError, ValueError):
+            _STATE["disk"] = {}
+    return _STATE["disk"]
+
+def _save_disk_cache():
+    """Write the persistent cache atomically."""
+    Path(os.path.dirname(GEOCODE_CACHE_FILE) or ".").mkdir(parents=True, exist_ok=True)
+    tmp_path = GEOCODE_CACHE_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(_disk_cache(), f)
+    os.replace(tmp_path, GEOCODE_CACHE_FILE)
+
+
+# Load a GeoNames-style cities file into a name index
+def _gazetteer():
+    """Return {normalized name: (lat, lon)}, a sorted name list for fuzzy matching and
+    {normalized name: [(population, (lat, lon), qualifiers)]} for names given with a country or region."""
+    if _STATE["gazetteer"] is None:
+        index, best_pop, places = {}, {}, {}
+        try:
+            with open(GAZETTEER_FILE, "r", encoding="utf-8") as f:
+                for line in f:
+                    cols = line.rstrip("\n").split("\t")
+                    if len(cols) < 15:
+                        continue
+                    coords = (float(cols[4]), float(cols[5]))
+                    population = int(cols[14] or 0)
+                    country = cols[8].casefold()
+                    qualifiers = frozenset(q for q in (country, cols[10].casefold(), *COUNTRY_NAMES.get(country, ())) if q)
+                    for name in {normalize_city(n) for n in [cols[1], cols[2]] + cols[3].split(",")}:
+                        if not name:
+                            continue
+                        places.setdefault(name, []).append((population, coords, qualifiers))
+                        # On name clashes keep the most populated place
+                        if population >= best_pop.get(name, -1):
+                            index[name], best_pop[name] = coords, population
+        except OSError:
+            pass
+        _STATE["gazetteer"] = (index, sorted(index), places)
+    return _STATE["gazetteer"]
+
+# Look a name up in the gazetteer, honouring a qualifier after the comma
+def _gazetteer_match(name, qualifier, index, places):
+    """Return coords for name, restricted to places matching the qualifier ("paris, texas") when one is given."""
+    if not qualifier:
+        return index.get(name)
+    parts = {normalize_city(p) for p in qualifier.split(",")} - {""}
+    matches = [(population, coords) for population, coords, qualifiers in places.get(name, ()) if parts & qualifiers]
+    return max(matches)[1] if matches else None
+
+# Offline check used when parsing messages (no network)
+def is_known_city(city_name):
+    """Return True if the name is in the geocode cache or the gazetteer."""
+    key = normalize_city(city_name)
+    if not key:
+        return False
+    with _LOCK:
+        return key in _MEMORY and _MEMORY[key] is not None or key in _disk_cache() or key in _gazetteer()[0]
+
+# Ask Nominatim (rate limited, short timeout)
+def _nominatim(city):
+    """Return (lat, lon) from Nominatim, None if not found; raises if unreachable."""
+    if _STATE["geolocator"] is None:
+        _STATE["geolocator"] = Nominatim(user_agent="strava-running-assistant", timeout=NOMINATIM_TIMEOUT)
+    wait = _STATE["last_request"] + NOMINATIM_MIN_INTERVAL - time.time()
+    if wait > 0:
+        time.sleep(wait)
+    _STATE["last_request"] = time.time()
+    loc = _STATE["geolocator"].geocode(city)
+    return (loc.latitude, loc.longitude) if loc else None
+
+
+# Geocode a city using caches, gazetteer and Nominatim
+def geocode_city(city_name):
+    """Return (lat, lon) for a city string, or None if not found."""
+    key = normalize_city(city_name)
+    if not key:
+        return None
+
+    with _LOCK:
+        if key in _MEMORY:
+            _MEMORY.move_to_end(key)
+            return _MEMORY[key]
+        disk = _disk_cache()
+        if key in disk:
+            _remember(key, disk[key])
+            return disk[key]
+
+        # Exact gazetteer hit on the full string, or on the name part if the place also matches the qualifier
+        # ("Uppsala, Sweden"); "Paris, Texas" is left to Nominatim rather than matched to Paris, France
+        index, names, places = _gazetteer()
+        name, _, qualifier = (part.strip() for part in key.partition(","))
+        coords = index.get(key) or _gazetteer_match(name, qualifier, index, places)
+        if coords:
+            _remember(key, coords)
+            return coords
+
+    # Online lookup outside the cache lock; results are persisted
+    try:
+        with _NET_LOCK:
+            coords = _nominatim(city_name.strip())
+        with _LOCK:
+            if coords:
+                _disk_cache()[key] = coords
+                _save_disk_cache()
+            _remember(key, coords)
+        return coords
+    except Exception as e:
+        print(f"Nominatim unavailable: {e}")
+
+    # Offline fallback: closest gazetteer name (that also matches the qualifier, if any)
+    match = difflib.get_close_matches(name, names, n=1, cutoff=FUZZY_CUTOFF)
+    return _gazetteer_match(match[0], qualifier, index, places) if match else None
@@ -0,0 +1,151 @@
+import math, os, pickle, threading, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+import networkx as nx
+import osmnx as ox
+from osmnx import distance as oxd
+
+
+# Where pre-built tile graphs are stored
+GRAPH_CACHE_DIR = os.path.join("cache", "graphs")
+
+# Tile grid and cache bounds
+TILE_DEG = 0.1                        # tile height/width in degrees (~11 km north-south)
+TILE_OVERLAP_M = 150                  # extra margin so neighbouring tiles share boundary nodes
+MAX_DISK_BYTES = 512 * 1024 * 1024    # evict least recently used tiles above this size
+MEMORY_TILES = 16                     # tiles kept unpickled in memory
+DOWNLOAD_WORKERS = 4                  # tiles fetched from Overpass at the same time
+MEMORY_MERGED = 4                     # merged multi-tile graphs kept in memory
+
+_LOCK = threading.Lock()
+_TILE_LOCKS = {}                      # tile key -> lock, so each tile is downloaded once
+_TILES = OrderedDict()                # tile key -> graph
+_MERGED = OrderedDict()               # (network_type, tile keys) -> merged graph
+_DOWNLOADS = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix="graph-tile")
+
+# Errors osmnx raises when an area simply has no streets
+_EMPTY_AREA_ERRORS = (ValueError, getattr(getattr(ox, "_errors", None), "InsufficientResponseError", ValueError))
+
+
+# Helpers for the tile grid
+def _tile_of(lat, lon):
+    """Return (row, col) of the tile containing a point."""
+    return (math.floor(lat / TILE_DEG), math.floor(lon / TILE_DEG))
+
+def tiles_for_area(coords, dist):
+    """Return all tiles covering a square of +-dist metres around coords."""
+    lat, lon = coords
+    dlat = dist / 111_320
+    dlon = dist / (111_320 * max(math.cos(math.radians(lat)), 0.01))
+    (i0, j0), (i1, j1) = _tile_of(lat - dlat, lon - dlon), _tile_of(lat + dlat, lon + dlon)
+    return [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+
+def tile_bounds(tile, pad_m=TILE_OVERLAP_M):
+    """Return (west, south, east, north) of a tile in degrees, padded by pad_m metres on each side."""
+    south, west = tile[0] * TILE_DEG, tile[1] * TILE_DEG
+    pad_lat = pad_m / 111_320
+    # Longitude degrees are shortest at the poleward edge, so pad for that edge
+    pad_lon = pad_m / (111_320 * max(math.cos(math.radians(max(abs(south), abs(south + TILE_DEG)))), 0.01))
+    return (west - pad_lon, south - pad_lat, west + TILE_DEG + pad_lon, south + TILE_DEG + pad_lat)
+
+def _tile_path(network_type, tile):
+    """Return disk path for one cached tile."""
+    return os.path.join(GRAPH_CACHE_DIR, f"{network_type}_{TILE_DEG:g}_{tile[0]}_{tile[1]}.pkl")
+
+
+# Download one tile from OSM and add edge lengths
+def _download_tile(network_type, tile):
+    """Build the street graph for a tile (empty graph if it has no streets), stamped with its download time."""
+    try:
+        # Only the tile's own box plus the overlap margin (a square around its centre would span ~2x the tile in longitude)
+        G = ox.graph_from_bbox(tile_bounds(tile), network_type=network_type, truncate_by_edge=True)
+        G = oxd.add_edge_lengths(G)
+    except _EMPTY_AREA_ERRORS:
+        # Water, forest etc.: remember that the tile is empty
+        G = nx.MultiDiGraph(crs="epsg:4326")
+    G.graph["fetched_at"] = time.time()
+    return G
+
+def _is_fresh(G, max_age):
+    """Return True if a tile was downloaded less than max_age seconds ago (always, if max_age is None)."""
+    return max_age is None or time.time() - G.graph.get("fetched_at", 0) <= max_age
+
+# Keep disk cache below MAX_DISK_BYTES (oldest access first)
+def _evict_disk():
+    """Delete least recently used tile files until under the size limit."""
+    files = [p for p in Path(GRAPH_CACHE_DIR).glob("*.pkl")]
+    stats = sorted(((p.stat().st_mtime, p.stat().st_size, p) for p in files), key=lambda x: x[0])
+    total = sum(size for _, size, _ in stats)
+    for _, size, path in stats:
+        if total <= MAX_DISK_BYTES:
+            break
+        try:
+            path.unlink()
+            total -= size
+        except OSError:
+            pass
+
+# Load one tile from memory, disk or OSM
+def _get_tile(network_type, tile, max_age=None):
+    """Return the graph for one tile, downloading it again if it is older than max_age seconds."""
+    key = (network_type, tile)
+    with _LOCK:
+        if key in _TILES and _is_fresh(_TILES[key], max_age):
+            _TILES.move_to_end(key)
+            return _TILES[key]
+        tile_lock = _TILE_LOCKS.setdefault(key, threading.Lock())
+
+    with tile_lock:
+        with _LOCK:
+            if key in _TILES and _is_fresh(_TILES[key], max_age):
+                return _TILES[key]
+        path = _tile_path(network_type, tile)
+        G = None
+        if os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    G = pickle.load(f)
+                os.utime(path)  # mark as recently used
+            except Exception:
+                G = None
+        if G is not None and not _is_fresh(G, max_age):
+            G = None
+        if G is None:
+            G = _download_tile(network_type, tile)
+            Path(GRAPH_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(G, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+            _evict_disk()
+
+        with _LOCK:
+            _TILES[key] = G
+            while len(_TILES) > MEMORY_TILES:
+                _TILES.popitem(last=False)
+    return G
+
+
+# Get a street graph around a point, merged from cached tiles
+def get_graph(coords, dist, network_type="walk", max_age=None):
+    """Return a graph with edge lengths covering +-dist metres around coords (tiles older than max_age are re-fetched)."""
+    tiles = tuple(tiles_for_area(coords, dist))
+    key = (network_type, tiles)
+    with _LOCK:
+        if key in _MERGED and max_age is None:
+            _MERGED.move_to_end(key)
+            return _MERGED[key]
+
+    # Missing tiles are downloaded in parallel (bounded by DOWNLOAD_WORKERS across all requests)
+    if len(tiles) == 1:
+        graphs = [_get_tile(network_type, tiles[0], max_age)]
+    else:
+        graphs = list(_DOWNLOADS.map(partial(_get_tile, network_type, max_age=max_age), tiles))
+    graphs = [g for g in graphs if len(g)] or graphs[:1]
+    G = graphs[0] if len(graphs) == 1 else nx.compose_all(graphs)
+    with _LOCK:
+        _MERGED[key] = G
+        while len(_MERGED) > MEMORY_MERGED:
+            _MERGED.popitem(last=False)
+    return G
@@ -0,0 +1,280 @@
+import json, math, os, re, threading
+from collections import Counter
+from pathlib import Path
+
+from functions.geocoding import is_known_city
+
+
+# Model trained from seed phrases plus logged LLM router decisions
+INTENT_MODEL_FILE = os.path.join("cache", "intent_model.json")
+ROUTER_LOG_FILE = os.path.join("cache", "router_log.jsonl")
+RETRAIN_EVERY = 50            # retrain after this many new logged decisions
+
+# Below this confidence the LLM router decides
+INTENT_THRESHOLD = 0.85
+RULE_CONFIDENCE = 0.95
+
+# The model decides alone only once it has learned from this many logged router decisions
+MODEL_MIN_TRAINED = 200
+
+INTENTS = ("enable_chat", "suggest_run", "generate_new_route")
+
+# Defaults GENERATE_RUN_PROMPT uses when nothing is said (and there is no history to look at)
+# Phrases the model starts from before any traffic is logged
+SEED_EXAMPLES = [
+    ("thanks!", "enable_chat"), ("thank you", "enable_chat"), ("hi", "enable_chat"), ("hello there", "enable_chat"),
+    ("ok great", "enable_chat"), ("how should I train for a marathon", "enable_chat"),
+    ("what is a good pace for beginners", "enable_chat"), ("how do I avoid shin splints", "enable_chat"),
+    ("what should I eat before a long run", "enable_chat"), ("tell me about interval training", "enable_chat"),
+    ("why is my heart rate so high", "enable_chat"), ("how many times a week should I run", "enable_chat"),
+    ("find me a 5k run in uppsala", "suggest_run"), ("suggest a run", "suggest_run"), ("give me a 10 km run", "suggest_run"),
+    ("show me my runs in stockholm", "suggest_run"), ("recommend a route i have run before", "suggest_run"),
+    ("any old 8 km routes near lund", "suggest_run"), ("find a hilly run", "suggest_run"), ("suggest a long run", "suggest_run"),
+    ("what runs have i done around göteborg", "suggest_run"), ("pick one of my previous runs", "suggest_run"),
+    ("generate a 10 km loop", "generate_new_route"), ("create a new route in uppsala", "generate_new_route"),
+    ("make me a 5k loop in malmö", "generate_new_route"), ("generate a new 7 km route", "generate_new_route"),
+    ("plan a new loop around stockholm", "generate_new_route"), ("design a 12 km route in lund", "generate_new_route"),
+    ("build a new running route", "generate_new_route"), ("new loop of 6 km please", "generate_new_route"),
+]
+
+# Distances: "5k", "10 km", "3 miles", "5000 m", "half marathon"
+_DISTANCE = re.compile(r"\b(\d+(?:[.,]\d+)?)\s*(k|km|kms|kilometers?|kilometres?|mi|miles?|m|meters?|metres?)\b", re.I)
+_NAMED_DISTANCE = re.compile(r"\b(half[- ]marathon|marathon)\b", re.I)
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+# Targets stated without digits ("an hour", "half an hour at easy pace") are left to the LLM
+_OTHER_TARGETS = re.compile(r"\b(hours?|minutes?|mins?|pace|bpm|heart ?rate|elevation|climb(ing)?|one|two|three|four|five|six|seven|eight|nine|ten|twenty)\b", re.I)
+# A preferred start time only matters for finding past runs (RouteInfo.time_of_day)
+_TIME_OF_DAY = re.compile(r"\b(morning|lunch(time)?|noon|afternoon|evening|night|tonight|[ap]\.?m\.?|o'?clock)\b", re.I)
+_UNIT_M = {"k": 1000, "km": 1000, "kms": 1000, "kilometer": 1000, "kilometers": 1000, "kilometre": 1000, "kilometres": 1000,
+           "mi": 1609.344, "mile": 1609.344, "miles": 1609.344, "m": 1, "meter": 1, "meters": 1, "metre": 1, "metres": 1}
+
+# Places follow a preposition ("in Uppsala", "around New York")
+_PLACE = re.compile(r"\b(?:in|around|near|at|from)\s+([^\W\d_][\w\-']*(?:\s+[^\W\d_][\w\-']*){0,2})", re.I)
+# Words that may follow a place without qualifying it ("in Uppsala please"); a comma after the place starts a qualifier
+_PLACE_FILLERS = {"please", "today", "tomorrow", "tonight", "now", "again", "instead", "too", "thanks"}
+_QUALIFIER = re.compile(r"\s*,\s*[^\W\d_]")
+
+# Unambiguous request phrasings: the verb must govern the run noun ("find me a 5k run"), so up to four words may sit
+# between them but none that turn it into a question about running ("show me how to stretch after runs")
+_GOVERNED = r"\s+(?:(?!(?:how|to|tips?|advice|on|about|for|after|before|with|why|what|when|during|into|improve|better)\b)[\w.,'-]+\s+){{0,4}}{noun}\b"
+_GENERATE = re.compile(r"\b(generate|create|make|plan|design|build|draw)" + _GOVERNED.format(noun=r"(routes?|loops?|runs?|course|path)")
+                       + r"|\bnew (route|loop|course)\b", re.I)
+_SUGGEST = re.compile(r"\b(find|suggest|recommend|show|give|pick|choose|any)" + _GOVERNED.format(noun=r"(runs?|routes?|loops?)")
+                      + r"|\bmy (previous|old|past|earlier) (runs?|routes?)\b", re.I)
+
+# Questions ("how do I make my runs faster?") are left to the model and the router
+_QUESTION = re.compile(r"^\W*(how|why|what|when|which|where|should|is|are|do|does|can i|could i)\b", re.I)
+
+# Small talk: a greeting or thanks plus at most two more words
+_SMALL_TALK = re.compile(r"^\W*(thanks?( you)?|thx|ty|hi|hey|hello|ok(ay)?|cool|great|nice|perfect|bye|good (morning|night))\b"
+                         r"(\W+\w+){0,2}\W*$", re.I)
+
+_LOCK = threading.Lock()
+_MODELS = {}                  # model path -> (mtime, model)
+_LOGGED = {}                  # log path -> number of logged decisions
+
+
+# Words, numbers as one token, and word pairs
+def _tokens(text):
+    """Return unigram and bigram features of a message."""
+    words = ["<num>" if w[0].isdigit() else w for w in re.findall(r"[^\W_]+", text.lower())]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+# Multinomial naive Bayes over message tokens
+class IntentModel:
+    def __init__(self, counts=None, docs=None, trained_on=0):
+        self.counts = {c: Counter((counts or {}).get(c, {})) for c in INTENTS}
+        self.docs = {c: (docs or {}).get(c, 0) for c in INTENTS}
+        self.trained_on = trained_on
+        self._prepare()
+
+    def _prepare(self):
+        """Cache totals used by predict."""
+        self.totals = {c: sum(self.counts[c].values()) for c in INTENTS}
+        self.vocab = len(set().union(*self.counts.values())) or 1
+        n = sum(self.docs.values()) or 1
+        self.priors = {c: math.log((self.docs[c] + 1) / (n + len(INTENTS))) for c in INTENTS}
+
+    def fit(self, examples):
+        """Add (text, intent) examples."""
+        for text, intent in examples:
+            if intent in self.counts:
+                self.counts[intent].update(_tokens(text))
+                self.docs[intent] += 1
+        self._prepare()
+        return self
+
+    def probabilities(self, text):
+        """Return {intent: probability}."""
+        tokens = _tokens(text)
+        logp = {c: self.priors[c] + sum(math.log((self.counts[c][t] + 1) / (self.totals[c] + self.vocab)) for t in tokens)
+                for c in INTENTS}
+        top = max(logp.values())
+        probs = {c: math.exp(v - top) for c, v in logp.items()}
+        total = sum(probs.values())
+        return {c: p / total for c, p in probs.items()}
+
+    def predict(self, text):
+        """Return (intent, probability)."""
+        probs = self.probabilities(text)
+        best = max(probs, key=probs.get)
+        return best, probs[best]
+
+    def save(self, path):
+        """Write counts to JSON atomically."""
+        Path(os.path.dirname(path) or ".").mkdir(parents=True, exist_ok=True)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"counts": self.counts, "docs": self.docs, "trained_on": self.trained_on}, f)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a model written by save()."""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["counts"], data["docs"], data.get("trained_on", 0))
+
+
+# Load the model (reloaded when the file changes; seed model if none is saved)
+def get_intent_model(model_path=INTENT_MODEL_FILE):
+    """Return the current IntentModel."""
+    mtime = os.path.getmtime(model_path) if os.path.exists(model_path) else None
+    with _LOCK:
+        hit = _MODELS.get(model_path)
+        if hit and hit[0] == mtime:
+            return hit[1]
+    try:
+        model = IntentModel.load(model_path) if mtime else IntentModel().fit(SEED_EXAMPLES)
+    except (OSError, ValueError, KeyError):
+        model = IntentModel().fit(SEED_EXAMPLES)
+    with _LOCK:
+        _MODELS[model_path] = (mtime, model)
+    return model
+
+# Retrain from seeds plus the router log
+def train_intent_model(log_path=ROUTER_LOG_FILE, model_path=INTENT_MODEL_FILE):
+    """Fit a new model on seed phrases and logged LLM decisions and save it."""
+    examples = list(SEED_EXAMPLES)
+    try:
+        with open(log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    examples.append((entry["text"], entry["intent"]))
+                except (ValueError, KeyError):
+                    continue
+    except OSError:
+        pass
+    model = IntentModel(trained_on=len(examples) - len(SEED_EXAMPLES)).fit(examples)
+    model.save(model_path)
+    return model
+
+# Log what the LLM router decided so the local model can learn from it
+def log_router_decision(text, decision, log_path=ROUTER_LOG_FILE, model_path=INTENT_MODEL_FILE):
+    """Append one decision and retrain every RETRAIN_EVERY entries."""
+    intent = next((c for c in INTENTS if decision.get(c)), None)
+    if not intent:
+        return
+    Path(os.path.dirname(log_path) or ".").mkdir(parents=True, exist_ok=True)
+    with _LOCK:
+        # Lines are counted once per process, then kept as a counter
+        if log_path not in _LOGGED:
+            try:
+                with open(log_path, "r", encoding="utf-8") as f:
+                    _LOGGED[log_path] = sum(1 for _ in f)
+            except OSError:
+                _LOGGED[log_path] = 0
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"text": text, "intent": intent}) + "\n")
+        _LOGGED[log_path] += 1
+        logged = _LOGGED[log_path]
+    if logged - get_intent_model(model_path).trained_on >= RETRAIN_EVERY:
+        train_intent_model(log_path, model_path)
+
+
+# Pull distance and city out of a message
+def extract_slots(text):
+    """Return {"distance", "city", "unparsed_numbers", "unresolved_place"}; distance in metres, city as written (or None).
+
+    unresolved_place is True when a place was named but could not be taken as a city."""
+    distance, spans = None, []
+    match = _DISTANCE.search(text)
+    if match:
+        distance = float(match.group(1).replace(",", ".")) * _UNIT_M[match.group(2).lower()]
+        spans.append(match.span())
+    else:
+        named = _NAMED_DISTANCE.search(text)
+        if named:
+            distance = 21097.5 if named.group(1).lower().startswith("half") else 42195.0
+    unparsed = sum(1 for n in _NUMBER.finditer(text) if not any(a <= n.start() < b for a, b in spans))
+
+    # Longest known place after a preposition, else a capitalised word there; a place followed by other words
+    # ("paris texas", "Paris, Texas") may be a different town with the same name, so no city is returned for it
+    city, unresolved = None, False
+    for place in _PLACE.finditer(text):
+        words = place.group(1).split()
+        size = next((n for n in range(len(words), 0, -1) if is_known_city(" ".join(words[:n]))), 0)
+        if not size and words[0][0].isupper():
+            size = 1
+        if not size:
+            continue
+        qualified = any(w.lower() not in _PLACE_FILLERS for w in words[size:]) or (
+            size == len(words) and _QUALIFIER.match(text, place.end()))
+        city, unresolved = (None, True) if qualified else (" ".join(words[:size]), False)
+        break
+    return {"distance": distance, "city": city, "unparsed_numbers": unparsed, "unresolved_place": unresolved}
+
+# Intent from rules that are unambiguous on their own
+def _rule_intent(text):
+    """Return an intent if exactly one rule matches, else None."""
+    if _SMALL_TALK.match(text):
+        return "enable_chat"
+    if _QUESTION.match(text):
+        return None
+    generate, suggest = bool(_GENERATE.search(text)), bool(_SUGGEST.search(text))
+    if generate != suggest:
+        return "generate_new_route" if generate else "suggest_run"
+    return None
+
+
+# Classify a message and fill run details locally when the message is simple enough
+def classify_intent(text, has_history=False, model_path=INTENT_MODEL_FILE):
+    """Return {"intent", "confidence", "source", "decision", "probabilities", "route_info", "generate_info"}.
+
+    probabilities holds the model's estimate per intent (raised to the rule confidence for an intent a rule
+    matched). route_info / generate_info are None when the LLM should extract them (other numbers, or details
+    that may come from earlier messages)."""
+    text = (text or "").strip()
+    model = get_intent_model(model_path)
+    probabilities = model.probabilities(text)
+    model_intent = max(probabilities, key=probabilities.get)
+    model_conf = probabilities[model_intent]
+    rule = _rule_intent(text)
+    if rule is None:
+        # Without a rule the seed-only model is too sure of itself to skip the router
+        intent, confidence, source = model_intent, model_conf, "model"
+        if model.trained_on < MODEL_MIN_TRAINED:
+            confidence = min(confidence, INTENT_THRESHOLD - 0.01)
+    elif rule == model_intent:
+        intent, confidence, source = rule, max(RULE_CONFIDENCE, model_conf), "rules"
+    else:
+        intent, confidence, source = rule, RULE_CONFIDENCE * (1 - model_conf / 2), "rules"
+    if rule is not None:
+        probabilities[rule] = max(probabilities[rule], confidence)
+
+    slots = extract_slots(text)
+    simple = slots["unparsed_numbers"] == 0 and not slots["unresolved_place"] and not _OTHER_TARGETS.search(text)
+    route_info = generate_info = None
+    if simple and not _TIME_OF_DAY.search(text) and (slots["city"] or not has_history):
+        route_info = {"distance": slots["distance"] or 0, "elevation_gain": 0, "time": 0, "pace": 0, "heart_rate": 0,
+                      "city": slots["city"] or "", "time_of_day": -1}
+    if simple and slots["city"] and slots["distance"]:
+        generate_info = {"distance": slots["distance"], "city": slots["city"]}
+
+    # Generating needs a distance and a city; without both the router decides (and chat asks for them)
+    if intent == "generate_new_route" and generate_info is None:
+        confidence = min(confidence, INTENT_THRESHOLD - 0.01)
+    return {"intent": intent, "confidence": round(confidence, 3), "source": source,
+            "decision": {c: c == intent for c in INTENTS}, "probabilities": {c: round(p, 3) for c, p in probabilities.items()},
+            "route_info": route_info, "generate_info": generate_info}
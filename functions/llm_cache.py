@@ -0,0 +1,153 @@
+import copy, hashlib, json, os, threading, time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+
+
+# Responses kept in memory; all responses are also written to disk (oldest files dropped above the limit)
+LLM_CACHE_ITEMS = 1024
+LLM_CACHE_DIR = os.path.join("cache", "llm")
+LLM_CACHE_DISK_BYTES = 64 * 1024 * 1024
+
+# Seconds a cached response stays valid, per call type (schema name or "analysis")
+LLM_CACHE_TTLS = {
+    "RouterOptions": 30 * 86400,
+    "RouteInfo": 7 * 86400,
+    "GenerateRouteInfo": 7 * 86400,
+    "analysis": 86400,
+}
+DEFAULT_TTL = 86400
+
+_LOCK = threading.Lock()
+_PRUNE_LOCK = threading.Lock()  # one disk scan at a time (taken without holding _LOCK)
+_MEMORY = OrderedDict()       # key -> (expires, value)
+_INFLIGHT = {}                # key -> Future of a running compute()
+_DISK = {"bytes": None}       # bytes on disk (counted on first write)
+_STATS = {}                   # call type -> {"memory_hits", "disk_hits", "misses", "coalesced"}
+
+
+# Canonical hash of everything that determines a temperature-0 response
+def cache_key(**parts):
+    """Return a sha1 of the parts as sorted, compact JSON."""
+    text = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _count(kind, field):
+    """Increment one hit/miss counter."""
+    stats = _STATS.setdefault(kind, {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0})
+    stats[field] += 1
+
+def _disk_path(key):
+    """Return the file holding one cached response."""
+    return os.path.join(LLM_CACHE_DIR, key[:2], f"{key}.json")
+
+def _remember(key, expires, value):
+    """Store a response in the memory LRU."""
+    _MEMORY[key] = (expires, value)
+    _MEMORY.move_to_end(key)
+    while len(_MEMORY) > LLM_CACHE_ITEMS:
+        _MEMORY.popitem(last=False)
+
+
+# Helpers for the disk tier
+def _read_disk(key):
+    """Return (expires, value) from disk, or None if missing or unreadable."""
+    try:
+        with open(_disk_path(key), "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        return entry["expires"], entry["value"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _prune_disk():
+    """Drop the oldest files until the disk tier is under LLM_CACHE_DISK_BYTES (runs outside _LOCK)."""
+    if not _PRUNE_LOCK.acquire(blocking=False):
+        return
+    try:
+        files = []
+        for path in Path(LLM_CACHE_DIR).glob("*/*.json"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= LLM_CACHE_DISK_BYTES * 0.9:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+        with _LOCK:
+            _DISK["bytes"] = total
+    finally:
+        _PRUNE_LOCK.release()
+
+def _write_disk(key, expires, value):
+    """Persist one response and keep the disk tier bounded."""
+    try:
+        path = _disk_path(key)
+        Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+        data = json.dumps({"expires": expires, "value": value})
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        with _LOCK:
+            if _DISK["bytes"] is not None:
+                _DISK["bytes"] += len(data)
+            prune = _DISK["bytes"] is None or _DISK["bytes"] > LLM_CACHE_DISK_BYTES
+        if prune:
+            _prune_disk()
+    except OSError as e:
+        print(f"LLM cache write failed: {e}")
+
+
+# Return a cached response or compute, store and return a new one
+def cached_response(kind, key, compute):
+    """Look up key in memory, then disk; on a miss call compute() and cache its JSON-serialisable result.
+
+    Concurrent misses for the same key share one compute() call."""
+    now = time.time()
+    with _LOCK:
+        hit = _MEMORY.get(key)
+        if hit and hit[0] > now:
+            _MEMORY.move_to_end(key)
+            _count(kind, "memory_hits")
+            return copy.deepcopy(hit[1])
+    hit = _read_disk(key)
+    if hit and hit[0] > now:
+        with _LOCK:
+            _remember(key, *hit)
+            _count(kind, "disk_hits")
+        return copy.deepcopy(hit[1])
+
+    # Join a computation already running for this key, or become the one that runs it
+    with _LOCK:
+        future = _INFLIGHT.get(key)
+        leader = future is None
+        if leader:
+            future = _INFLIGHT[key] = Future()
+        _count(kind, "misses" if leader else "coalesced")
+    if not leader:
+        return copy.deepcopy(future.result())
+
+    try:
+        value = compute()
+        expires = now + LLM_CACHE_TTLS.get(kind, DEFAULT_TTL)
+        with _LOCK:
+            _remember(key, expires, copy.deepcopy(value))
+        future.set_result(copy.deepcopy(value))
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _LOCK:
+            _INFLIGHT.pop(key, None)
+    _write_disk(key, expires, value)
+    return value
+
+# Hit and miss counters
+def llm_cache_stats():
+    """Return counters per call type plus the memory and disk tier sizes."""
+    with _LOCK:
+        return {"calls": copy.deepcopy(_STATS), "memory_items": len(_MEMORY), "disk_bytes": _DISK["bytes"]}
@@ -1,5 +1,13 @@
+import io, os
+from functools import lru_cache
 from pydantic import BaseModel
 
+from functions.llm_cache import cache_key, cached_response
+
+
+# Model used for every chat call
+LLM_MODEL = 'gpt-4o'
+
 
 # Define response schema for routing user intent
 class RouterOptions(BaseModel):
@@ -15,6 +23,7 @@ class RouteInfo(BaseModel):
     pace: float
     heart_rate: int
     city: str
+    time_of_day: float
 
 # Define schema for run details for generating new route
 class GenerateRouteInfo(BaseModel):
@@ -22,50 +31,86 @@ class GenerateRouteInfo(BaseModel):
     city: str
 
 
+# JSON schema of a response model (part of the cache key)
+@lru_cache(maxsize=None)
+def _schema_json(response_schema):
+    """Return the schema of a pydantic model."""
+    return response_schema.model_json_schema()
+
 # Generate model output following a specific JSON schema
 def llm_with_response_schema(client, user_input, response_schema, system_instructions):
-    """Call LLM with a schema and return structured JSON."""
-    response = client.responses.parse(
-        model='gpt-4o',
-        instructions=system_instructions,
-        input=user_input,
-        text_format=response_schema,
-        temperature=0
-    )
-    return response.output_parsed.model_dump()
+    """Call LLM with a schema and return structured JSON (cached, since temperature is 0)."""
+    def call():
+        response = client.responses.parse(
+            model=LLM_MODEL,
+            instructions=system_instructions,
+            input=user_input,
+            text_format=response_schema,
+            temperature=0
+        )
+        return response.output_parsed.model_dump()
+
+    key = cache_key(model=LLM_MODEL, instructions=system_instructions, schema=_schema_json(response_schema), input=user_input)
+    return cached_response(response_schema.__name__, key, call)
 
 # General chat without schema (normal conversation)
 def llm_general_chat(client, user_input, system_instructions):
     """Call LLM for general chat or summary."""
     response = client.responses.create(
-        model='gpt-4o',
+        model=LLM_MODEL,
         instructions=system_instructions,
         input=user_input,
         temperature=0
     )
     return response.output_text
 
+# Same as llm_general_chat, but yields text as the model produces it
+def llm_general_chat_stream(client, user_input, system_instructions):
+    """Stream LLM text for general chat or summary, one delta at a time."""
+    stream = client.responses.create(
+        model=LLM_MODEL,
+        instructions=system_instructions,
+        input=user_input,
+        temperature=0,
+        stream=True
+    )
+    for event in stream:
+        if event.type == "response.output_text.delta":
+            yield event.delta
+
 # Analyze an activity (with map image)
 def llm_analyze_activity(client, text_blob, image_url, system_instructions):
     """Send text (and image) to LLM for analysis."""
-    parts = [{"role": "user", "content": [{"type": "input_image", "image_url": image_url}]}]
+    content = [{"type": "input_text", "text": text_blob}]
+    if image_url:
+        content.append({"type": "input_image", "image_url": image_url})
+    parts = [{"role": "user", "content": content}]
 
-    # Send both to the model
-    response = client.responses.create(
-        model='gpt-4o',
-        instructions=system_instructions,
-        input=parts,
-        temperature=0
-    )
-    return response.output_text
+    # Send both to the model (same text and image give the same answer, so it is cached)
+    def call():
+        response = client.responses.create(
+            model=LLM_MODEL,
+            instructions=system_instructions,
+            input=parts,
+            temperature=0
+        )
+        return response.output_text
+
+    key = cache_key(model=LLM_MODEL, instructions=system_instructions, input=parts)
+    return cached_response("analysis", key, call)
 
 # Audio transcription to allow speech inpu
-def transcribe_audio(client, audio_path):
-    """ Transcribe an audio file using OpenAI Whisper."""
-    with open(audio_path, "rb") as f:
-        response = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=f,
-            prompt="Transcribe this user request in english."
-        )
+def transcribe_audio(client, audio, filename="input.webm", prompt=None):
+    """ Transcribe audio using OpenAI Whisper (a file path, raw bytes or a file-like object)."""
+    if isinstance(audio, str):
+        with open(audio, "rb") as f:
+            return transcribe_audio(client, f.read(), os.path.basename(audio), prompt)
+    # Kept in memory; the name tells the API which container format it is
+    buffer = io.BytesIO(audio) if isinstance(audio, (bytes, bytearray)) else audio
+    buffer.name = filename
+    response = client.audio.transcriptions.create(
+        model="whisper-1",
+        file=buffer,
+        prompt=prompt or "Transcribe this user request in english."
+    )
     return response.text or ""
\ No newline at end of file
@@ -21,6 +21,8 @@ RUN_INFO_PROMPT = (
 
     "If any information is missing, or not explicitly stated, set its value to an empty string '' (or 0 if numeric). " 
     "E.g. if the user asks for a long run, set distance to 0 since no specific value was given. "
+    "Set time_of_day to the local hour the run should start (0-24, e.g. 18.5 for 18:30, about 7 for morning, 12 for lunch, "
+    "18 for evening), or -1 if no time of day is mentioned. "
 
     "Use the history of messages between user and assistant, and the latest user message. "
     "E.g. if the user earlier asked for a run in Stockholm, and now asks for a 10km route, set distance to 10000 and city to Stockholm. "
@@ -0,0 +1,63 @@
+import threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Threads shared by all chat requests (stages mostly wait on network calls)
+STAGE_WORKERS = 16
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="stage")
+
+
+# Runs named pipeline stages concurrently and records how long each took
+class StageScheduler:
+    def __init__(self, executor=_EXECUTOR):
+        self.executor = executor
+        self.started = time.time()
+        self.futures = {}
+        self.timings = {}
+        self.discarded = []
+        self.lock = threading.Lock()
+
+    def _timed(self, name, fn, args, kwargs):
+        """Run one stage and store its duration."""
+        start = time.time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.timings[name] = time.time() - start
+
+    def start(self, name, fn, *args, **kwargs):
+        """Submit a stage now (no-op if it already started); returns its future."""
+        with self.lock:
+            if name not in self.futures:
+                self.futures[name] = self.executor.submit(self._timed, name, fn, args, kwargs)
+            return self.futures[name]
+
+    def result(self, name, timeout=None):
+        """Wait for a stage and return its result (re-raises its exception)."""
+        return self.futures[name].result(timeout)
+
+    def run(self, name, fn, *args, **kwargs):
+        """Run a dependent stage in the calling thread, timed like the others."""
+        return self._timed(name, fn, args, kwargs)
+
+    def record(self, name, seconds):
+        """Store the duration of work timed by the caller (e.g. a streamed response)."""
+        with self.lock:
+            self.timings[name] = seconds
+
+    def discard(self, *names):
+        """Cancel stages that have not started; running ones finish but their results are ignored."""
+        for name in names:
+            future = self.futures.pop(name, None)
+            if future is not None:
+                future.cancel()
+                self.discarded.append(name)
+
+    def report(self):
+        """Return a one-line summary of stage durations and total wall time."""
+        with self.lock:
+            stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.timings.items())
+        discarded = f" | discarded {', '.join(self.discarded)}" if self.discarded else ""
+        return f"Stages: {stages}{discarded} | total {time.time() - self.started:.2f}s"
@@ -0,0 +1,130 @@
+import hashlib, math, threading
+from collections import OrderedDict
+import numpy as np
+
+
+# Zoom levels with a precomputed simplification (above MAX_LOD_ZOOM the full line is used)
+MIN_LOD_ZOOM = 8
+MAX_LOD_ZOOM = 16
+PIXEL_TOLERANCE = 1.0        # allowed deviation in screen pixels
+LOD_CACHE_SIZE = 512
+
+_LOCK = threading.Lock()
+_LODS = OrderedDict()        # geometry hash -> {zoom: (n, 2) array}
+
+
+# Decode many Google/Strava encoded polylines at once
+def decode_polylines(polylines):
+    """Return one (n, 2) float array of (lat, lon) per encoded string (empty if invalid)."""
+    strings = [p or "" for p in polylines]
+    empty = np.zeros((0, 2), dtype=np.float64)
+    if not any(strings):
+        return [empty for _ in strings]
+
+    # All characters in one array, minus 63 as per encoding spec
+    lengths = np.array([len(p) for p in strings])
+    b = np.frombuffer("".join(strings).encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+
+    # A value ends at every byte without the continuation bit
+    ends = b < 0x20
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    pos = np.arange(len(b)) - np.repeat(starts, np.diff(np.append(starts, len(b))))
+    values = np.add.reduceat((b & 0x1F) << (5 * pos), starts)
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+
+    # Values per string; a valid string ends on a value boundary and has lat/lon pairs
+    byte_end = np.cumsum(lengths)
+    ends_before = np.concatenate(([0], np.cumsum(ends)))
+    counts = np.diff(np.concatenate(([0], ends_before[byte_end])))
+    valid = (counts % 2 == 0) & ((lengths == 0) | ends[np.maximum(byte_end - 1, 0)])
+    if not valid.all():
+        # Decode invalid strings as empty, keep the rest
+        good = [s if ok else "" for s, ok in zip(strings, valid)]
+        return decode_polylines(good) if any(good) else [empty for _ in strings]
+
+    # Running sum per polyline: global cumsum minus the sum before each polyline starts
+    pairs = deltas.reshape(-1, 2)
+    points = np.cumsum(pairs, axis=0)
+    offsets = np.concatenate(([0], np.cumsum(counts // 2)))
+    base = np.repeat(np.vstack([np.zeros((1, 2), dtype=np.int64), points])[offsets[:-1]], counts // 2, axis=0)
+    coords = (points - base) / 1e5
+    return [coords[offsets[i]:offsets[i + 1]] for i in range(len(strings))]
+
+
+# Douglas-Peucker simplification in local metres
+def simplify(points, tolerance_m):
+    """Return the subset of points within tolerance_m of the original line."""
+    n = len(points)
+    if n < 3 or tolerance_m <= 0:
+        return points
+    lat0 = math.radians(float(np.mean(points[:, 0])))
+    xy = np.column_stack((points[:, 1] * 111_320 * math.cos(lat0), points[:, 0] * 110_540))
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        a, seg = xy[i], xy[j] - xy[i]
+        rel = xy[i + 1:j] - a
+        seg_len = math.hypot(*seg)
+        if seg_len == 0:
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dist = np.abs(seg[0] * rel[:, 1] - seg[1] * rel[:, 0]) / seg_len
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance_m:
+            m = i + 1 + k
+            keep[m] = True
+            stack.extend(((i, m), (m, j)))
+    return points[keep]
+
+
+# Ground resolution of one pixel at a zoom level
+def metres_per_pixel(zoom, lat):
+    """Return web-mercator metres per pixel at zoom and latitude."""
+    return 156_543.03 * math.cos(math.radians(lat)) / (2 ** zoom)
+
+# Zoom at which a route fits a viewport of the given size
+def fit_zoom(points, viewport_px=600):
+    """Return the highest integer zoom that shows the whole route."""
+    if len(points) < 2:
+        return MAX_LOD_ZOOM
+    lat = float(np.mean(points[:, 0]))
+    span_m = max(np.ptp(points[:, 0]) * 110_540, np.ptp(points[:, 1]) * 111_320 * math.cos(math.radians(lat)), 1.0)
+    zoom = math.floor(math.log2(156_543.03 * math.cos(math.radians(lat)) * viewport_px / span_m))
+    return int(min(max(zoom, MIN_LOD_ZOOM), MAX_LOD_ZOOM + 1))
+
+
+# Levels of detail for one route, cached by geometry hash
+def route_lods(points):
+    """Return {zoom: simplified points} for MIN_LOD_ZOOM..MAX_LOD_ZOOM."""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    key = hashlib.sha1(points.tobytes()).hexdigest()
+    with _LOCK:
+        if key in _LODS:
+            _LODS.move_to_end(key)
+            return _LODS[key]
+
+    lat = float(np.mean(points[:, 0])) if len(points) else 0.0
+    lods, current = {}, points
+    # From detailed to coarse, each level simplifies the previous one
+    for zoom in range(MAX_LOD_ZOOM, MIN_LOD_ZOOM - 1, -1):
+        current = simplify(current, PIXEL_TOLERANCE * metres_per_pixel(zoom, lat))
+        lods[zoom] = current
+
+    with _LOCK:
+        _LODS[key] = lods
+        while len(_LODS) > LOD_CACHE_SIZE:
+            _LODS.popitem(last=False)
+    return lods
+
+# Points to draw for a route at a given zoom
+def route_at_zoom(points, zoom=None):
+    """Return the simplified route for zoom (full resolution above MAX_LOD_ZOOM)."""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    zoom = fit_zoom(points) if zoom is None else int(zoom)
+    if zoom > MAX_LOD_ZOOM:
+        return points
+    return route_lods(points)[max(zoom, MIN_LOD_ZOOM)]
@@ -1,8 +1,36 @@
-import pandas as pd
 import numpy as np
+import calendar, os, threading, time
+from collections import OrderedDict
 from datetime import datetime
+from functools import lru_cache
 import platform
 
+from functions.embedding_store import get_embedding_store, normalize_rows, text_hash, EMBED_MODEL, EMBEDDINGS_DIR
+from functions.ann_index import IVFIndex
+from functions.feature_ranker import numeric_scores
+
+
+# Recent query embeddings kept in memory (retries and repeated questions skip the API)
+QUERY_CACHE_SIZE = 256
+
+# Activity descriptions kept in memory (formatting dates is the slow part)
+TEXT_CACHE_SIZE = 200_000
+TEXT_FIELDS = ("start_date", "distance", "total_elevation_gain", "moving_time", "average_speed", "average_heartrate")
+
+# Ranking modes: embeddings, numeric features, or embeddings with numeric fallback
+RANKING_MODES = ("auto", "embedding", "numeric")
+EMBED_TIMEOUT_S = 4.0       # auto mode: give up on the embeddings API after this long
+EMBED_COOLDOWN_S = 120      # auto mode: skip the API for this long after a failure
+
+# Approximate index over the embeddings of the whole activity history
+ACTIVITY_INDEX_PATH = os.path.join("cache", "activity_index.npz")
+
+_LOCK = threading.Lock()
+_QUERIES = OrderedDict()    # (model, query) -> unit vector
+_INDEXES = {}               # path -> IVFIndex (None if nothing indexed yet)
+_INDEX_UPDATE = threading.Lock()
+_API_STATE = {"down_until": 0.0}
+
 
 # Helper to format ISO timestamp into date and time strings
 def _format_datetime(iso_str):
@@ -27,38 +55,150 @@ def _row_to_text(row):
         f"time of day {time_str}."
     )
 
-# Compare query embedding with activity embeddings and return top matches
-def find_best_match(client, df, query, embeddings, top_k=5):
-    """Return top matching activities based on cosine similarity."""
-    q_resp = client.embeddings.create(model="text-embedding-3-small", input=query)
-    query_vec = np.array(q_resp.data[0].embedding, dtype=np.float32)
-    
-    # Normalize vectors and compute cosine similarity
-    denom = (np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query_vec) + 1e-8)
-    scores = (embeddings @ query_vec) / denom
-    
-    # Sort by similarity score, highest first
-    best_idx = np.argsort(scores)[::-1] #[:top_k]
-    return df.iloc[best_idx], scores
+# Cached descriptions (missing values read as NaN, like the DataFrame rows did)
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def _describe(values):
+    """Cached text for one tuple of TEXT_FIELDS values."""
+    row = {k: v if k == "start_date" else np.float64(np.nan if v is None else v) for k, v in zip(TEXT_FIELDS, values)}
+    return _row_to_text(row)
+
+def _activity_text(activity):
+    """Describe an activity dict as text for embeddings."""
+    return _describe(tuple(map(activity.get, TEXT_FIELDS)))
+
+
+# Embed a query once and reuse it for repeated questions
+def query_embedding(client, query, model=EMBED_MODEL):
+    """Return the unit-length embedding of a query (LRU cached)."""
+    key = (model, query)
+    with _LOCK:
+        if key in _QUERIES:
+            _QUERIES.move_to_end(key)
+            return _QUERIES[key]
+    q_resp = client.embeddings.create(model=model, input=query)
+    vector = normalize_rows(q_resp.data[0].embedding)
+    with _LOCK:
+        _QUERIES[key] = vector
+        while len(_QUERIES) > QUERY_CACHE_SIZE:
+            _QUERIES.popitem(last=False)
+    return vector
+
+# Indices of the k highest scores, best first
+def top_k_indices(scores, top_k=None):
+    """Return positions of the top_k scores in descending order (all if top_k is None)."""
+    n = len(scores)
+    if top_k is None or top_k >= n:
+        return np.argsort(-scores, kind="stable")
+    best = np.argpartition(-scores, top_k)[:top_k]
+    return best[np.argsort(-scores[best], kind="stable")]
+
+# Cosine similarity of unit vectors: one matrix-vector product
+def find_best_match(query_vec, matrix, rows, top_k=None):
+    """Return (order, scores) for the given rows of a unit-vector matrix."""
+    # Scoring the whole store avoids copying rows when most of it is requested
+    if 2 * len(rows) >= len(matrix):
+        scores = (matrix @ query_vec)[rows]
+    else:
+        scores = matrix[rows] @ query_vec
+    return top_k_indices(scores, top_k), scores
 
 # Main RAG ranking function used in route selection
-def rag_ranking(client, query, activities):
-    """Rank Strava activities by relevance to the user query."""
+def rag_ranking(client, query, activities, store_dir=EMBEDDINGS_DIR, top_k=None):
+    """Rank Strava activities by relevance to the user query (best top_k, or all)."""
     if len(activities) == 0:
         return activities
-    
-    # Convert activities to DataFrame
-    df = pd.DataFrame.from_records(activities)
-
-    # Create natural-language descriptions for embeddings
-    texts = [_row_to_text(row) for _, row in df.iterrows()]
-    
-    # Generate embeddings for each activity
-    response = client.embeddings.create(model="text-embedding-3-small", input=texts)
-    embeddings = np.array([d.embedding for d in response.data])
-    
+
+    # Stored unit embeddings for each activity (only new or changed descriptions are embedded)
+    texts = [_activity_text(a) for a in activities]
+    matrix, rows = get_embedding_store(store_dir, EMBED_MODEL).lookup(client, [a["id"] for a in activities], texts)
+
     # Find the most similar activities to the user query
-    results, scores = find_best_match(client, df, query, embeddings)
+    order, _ = find_best_match(query_embedding(client, query), matrix, rows, top_k)
+    return [activities[i] for i in order]
+
+# Rank by weighted distance of numeric features to the RouteInfo targets (no API calls)
+def numeric_ranking(activities, route_info, top_k=None, weights=None):
+    """Return activities closest to the targets first (best top_k, or all)."""
+    if len(activities) == 0:
+        return activities
+    order = top_k_indices(-numeric_scores(activities, route_info, weights), top_k)
+    return [activities[i] for i in order]
+
+# Client the ranking embeds with: "auto" fails fast, and is skipped while the API is slow or failing
+def embedding_client(client, mode="auto"):
+    """Return the client to embed with under mode, or None when ranking will be numeric."""
+    if mode == "numeric" or (mode == "auto" and time.time() < _API_STATE["down_until"]):
+        return None
+    if mode == "embedding":
+        return client
+    return client.with_options(timeout=EMBED_TIMEOUT_S, max_retries=0) if hasattr(client, "with_options") else client
+
+# Pick the ranking engine; "auto" uses embeddings unless the API is slow or failing
+def rank_activities(client, query, activities, route_info=None, mode="auto", store_dir=EMBEDDINGS_DIR, top_k=None):
+    """Rank activities with embeddings or numeric features according to mode."""
+    embedder = embedding_client(client, mode)
+    if embedder is None:
+        return numeric_ranking(activities, route_info, top_k)
+    if mode == "embedding":
+        return rag_ranking(embedder, query, activities, store_dir, top_k)
+    try:
+        return rag_ranking(embedder, query, activities, store_dir, top_k)
+    except Exception as e:
+        _API_STATE["down_until"] = time.time() + EMBED_COOLDOWN_S
+        print(f"Embedding ranking unavailable, using numeric ranking: {e}")
+        return numeric_ranking(activities, route_info, top_k)
+
+
+# Load the history index once per path
+def get_activity_index(index_path=ACTIVITY_INDEX_PATH):
+    """Return the IVFIndex saved at index_path, or None if none exists yet."""
+    with _LOCK:
+        if index_path not in _INDEXES:
+            try:
+                _INDEXES[index_path] = IVFIndex.load(index_path) if os.path.exists(index_path) else None
+            except Exception as e:
+                print(f"Activity index unreadable, rebuilding: {e}")
+                _INDEXES[index_path] = None
+        return _INDEXES[index_path]
+
+# Bring the history index in line with the activity list (new, edited and deleted activities)
+def update_activity_index(client, activities, index_path=ACTIVITY_INDEX_PATH, store_dir=EMBEDDINGS_DIR):
+    """Embed changed activities and upsert them into the index; returns the number of changes."""
+    with _INDEX_UPDATE:
+        index = get_activity_index(index_path)
+        texts = {a["id"]: _activity_text(a) for a in activities if a.get("id") is not None and a.get("start_date")}
+        hashes = {i: text_hash(t) for i, t in texts.items()}
+        known = index.hashes if index is not None else {}
+        changed = [i for i, h in hashes.items() if known.get(i) != h]
+        deleted = [i for i in known if i not in hashes]
+        if not changed and not deleted:
+            return 0
+
+        if changed:
+            by_id = {a["id"]: a for a in activities}
+            matrix, rows = get_embedding_store(store_dir, EMBED_MODEL).lookup(client, changed, [texts[i] for i in changed])
+            if index is None:
+                index = IVFIndex(matrix.shape[1])
+            meta = {
+                "start_ts": [calendar.timegm(datetime.strptime(by_id[i]["start_date"], "%Y-%m-%dT%H:%M:%SZ").timetuple()) for i in changed],
+                "distance": [np.nan if by_id[i].get("distance") is None else by_id[i]["distance"] for i in changed],
+            }
+            index.add(changed, matrix[rows], meta, [hashes[i] for i in changed])
+        index.remove(deleted)
+        index.save(index_path)
+        with _LOCK:
+            _INDEXES[index_path] = index
+        print(f"Activity index: {len(changed)} updated, {len(deleted)} removed, {len(index)} total")
+        return len(changed) + len(deleted)
 
-    # Return reordered list of activities as dicts
-    return df.iloc[results.index].to_dict('records')
\ No newline at end of file
+# Semantic search over the whole history with optional metadata ranges
+def search_activity_history(client, query, filters=None, top_k=10, index_path=ACTIVITY_INDEX_PATH):
+    """Return activity ids best matching query; filters {field: (low, high)} are dropped if nothing passes them."""
+    index = get_activity_index(index_path)
+    if index is None or not len(index):
+        return []
+    query_vec = query_embedding(client, query)
+    ids, _ = index.search(query_vec, top_k, filters)
+    if not len(ids) and filters:
+        ids, _ = index.search(query_vec, top_k)
+    return ids.tolist()
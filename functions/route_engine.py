@@ -0,0 +1,334 @@
+import atexit, os, random, threading
+import multiprocessing as mp
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from functions.activity_filter import haversine_km
+
+
+# Number of converted graphs kept in memory
+CSR_CACHE_SIZE = 4
+
+# Recent Dijkstra trees kept per graph (start trees are reused across requests)
+TREE_CACHE_SIZE = 8
+
+# Leg tolerances tried when looking for ring nodes
+LEG_TOLERANCES = (0.25, 0.40)
+
+# Candidate loop generation
+POOL_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+WORKER_GRAPHS = 2          # graphs each pool worker keeps attached
+TURN_ANGLE_DEG = 45        # heading change counted as a turn
+SCORE_WEIGHTS = {"distance_error": 1.0, "overlap_ratio": 0.5, "turns_per_km": 0.02, "climb_per_km": 0.002}
+
+_LOCK = threading.Lock()
+_CACHE = OrderedDict()   # id(G) -> (G, RouteGraph)
+_POOL = {"pool": None}
+_POOL_LOCK = threading.Lock()
+
+# Arrays a graph is shared with pool workers through (CSR parts plus node data)
+_SHARED_FIELDS = ("nodes", "lat", "lon", "elevation", "data", "indices", "indptr")
+
+# Set inside pool workers: shared memory name -> RouteGraph
+_WORKER = OrderedDict()
+
+
+# Compact CSR adjacency of a street graph
+class RouteGraph:
+    def __init__(self, G):
+        nodes = list(G.nodes)
+        index = {n: i for i, n in enumerate(nodes)}
+        self.nodes = np.array(nodes)
+        self.lat = np.array([G.nodes[n]["y"] for n in nodes], dtype=np.float64)
+        self.lon = np.array([G.nodes[n]["x"] for n in nodes], dtype=np.float64)
+        self.elevation = np.array([G.nodes[n].get("elevation", np.nan) for n in nodes], dtype=np.float64)
+
+        # Edge arrays; parallel edges keep their shortest length
+        edges = [(index[u], index[v], float(length or 0)) for u, v, length in G.edges(data="length") if u != v]
+        u, v, w = (np.array(col) for col in zip(*edges)) if edges else (np.zeros(0, int), np.zeros(0, int), np.zeros(0))
+        order = np.lexsort((w, v, u))
+        u, v, w = u[order], v[order], w[order]
+        first = np.ones(len(u), dtype=bool)
+        first[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+        # Zero weights would be read as missing edges
+        w = np.maximum(w[first], 1e-3)
+        n = len(nodes)
+        self._setup(csr_matrix((w, (u[first], v[first])), shape=(n, n)))
+
+    # Build from arrays already in CSR form (used by pool workers)
+    @classmethod
+    def from_arrays(cls, nodes, lat, lon, elevation, matrix):
+        """Return a RouteGraph over the given node arrays and csr adjacency."""
+        rg = cls.__new__(cls)
+        rg.nodes, rg.lat, rg.lon, rg.elevation = nodes, lat, lon, elevation
+        rg._setup(matrix)
+        return rg
+
+    def _setup(self, matrix):
+        """Derive the reverse graph and empty caches from the adjacency."""
+        self.matrix = matrix
+        self.reverse = self.matrix.T.tocsr()
+        self.symmetric = (abs(self.matrix - self.reverse) > 1e-6).nnz == 0
+        self._trees = OrderedDict()     # (source, limit, reverse) -> recent search results
+        self._lock = threading.Lock()   # guards the tree cache and the shared block
+        self._shared = None             # shared memory block handed to pool workers
+
+    # Pickled without the lock, the cached trees or the shared block
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["_trees"], state["_lock"], state["_shared"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._trees = OrderedDict()
+        self._lock = threading.Lock()
+        self._shared = None
+
+    def share(self):
+        """Copy the graph into one shared memory block (once) and return the (name, layout) handle workers attach with."""
+        with self._lock:
+            if self._shared is None:
+                arrays = {"nodes": self.nodes, "lat": self.lat, "lon": self.lon, "elevation": self.elevation,
+                          "data": self.matrix.data, "indices": self.matrix.indices, "indptr": self.matrix.indptr}
+                # Non-numeric node ids stay in this process; workers only need node positions
+                arrays = {field: a for field, a in arrays.items() if a.dtype != object}
+                layout, offset = [], 0
+                for field, a in arrays.items():
+                    layout.append((field, a.dtype.str, len(a), offset))
+                    offset += a.nbytes
+                shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+                for field, dtype, length, start in layout:
+                    np.ndarray(length, dtype, shm.buf, start)[:] = arrays[field]
+                self._shared = (shm, (shm.name, tuple(layout)))
+            return self._shared[1]
+
+    def release(self):
+        """Free the shared memory block, if any (workers keep their own copies)."""
+        with self._lock:
+            if self._shared is not None:
+                shm, self._shared = self._shared[0], None
+                shm.close()
+                shm.unlink()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def nearest(self, lat, lon):
+        """Return index of the node closest to (lat, lon)."""
+        return int(np.argmin(haversine_km(lat, lon, self.lat, self.lon)))
+
+    def shortest_tree(self, source, limit, reverse=False):
+        """Bounded Dijkstra from source; returns (distances, predecessors), keeping the most recently used trees."""
+        key = (int(source), round(limit), reverse)
+        with self._lock:
+            hit = self._trees.get(key)
+            if hit is not None:
+                self._trees.move_to_end(key)
+                return hit
+        # Searched outside the lock; two threads missing together both compute the same tree
+        matrix = self.reverse if reverse else self.matrix
+        tree = dijkstra(matrix, directed=True, indices=source, limit=limit, return_predecessors=True)
+        with self._lock:
+            self._trees[key] = tree
+            self._trees.move_to_end(key)
+            while len(self._trees) > TREE_CACHE_SIZE:
+                self._trees.popitem(last=False)
+        return tree
+
+    def to_latlon(self, path):
+        """Convert node indices into (lat, lon) tuples."""
+        return list(zip(self.lat[path].tolist(), self.lon[path].tolist()))
+
+
+# Get the CSR form of a graph, converting it once
+def get_route_graph(G):
+    """Return a cached RouteGraph for a networkx graph."""
+    key = id(G)
+    with _LOCK:
+        hit = _CACHE.get(key)
+        if hit and hit[0] is G:
+            _CACHE.move_to_end(key)
+            return hit[1]
+    rg = RouteGraph(G)
+    with _LOCK:
+        _CACHE[key] = (G, rg)
+        while len(_CACHE) > CSR_CACHE_SIZE:
+            _CACHE.popitem(last=False)[1][1].release()
+    return rg
+
+# Free shared blocks on exit instead of leaving them to the resource tracker
+@atexit.register
+def _release_all():
+    with _LOCK:
+        for _, rg in _CACHE.values():
+            rg.release()
+
+
+# Walk a predecessor array from target back to the tree's source
+def path_from_tree(pred, target):
+    """Return node indices from the tree source to target (empty if unreachable)."""
+    path = [target]
+    while pred[path[-1]] >= 0:
+        path.append(int(pred[path[-1]]))
+    return path[::-1]
+
+
+# Build one triangle loop of about 3 * leg metres
+def loop_from_start(rg, start, leg, rng=random, d_start=None, pred_start=None):
+    """Return node indices of a loop start -> p1 -> p2 -> start, or [] if none found."""
+    if d_start is None:
+        d_start, pred_start = rg.shortest_tree(start, (1 + LEG_TOLERANCES[-1]) * leg)
+
+    # Nodes around one leg length from start
+    ring, tol = np.zeros(0, dtype=np.int64), LEG_TOLERANCES[-1]
+    for tol in LEG_TOLERANCES:
+        ring = np.flatnonzero((d_start >= (1 - tol) * leg) & (d_start <= (1 + tol) * leg))
+        if len(ring):
+            break
+    if not len(ring):
+        return []
+
+    # Pick first point on the ring and search from it (bounded)
+    p1 = int(rng.choice(ring))
+    d_p1, pred_p1 = rg.shortest_tree(p1, (1 + tol) * leg)
+
+    # Find second point that forms a roughly equal triangle
+    others = ring[(ring != start) & (ring != p1)]
+    if not len(others):
+        return []
+    near = others[np.abs(d_p1[others] - leg) <= tol * leg]
+    pool = near if len(near) else others
+    scores = np.abs(d_start[pool] - leg) + np.abs(np.where(np.isfinite(d_p1[pool]), d_p1[pool], 1e12) - leg)
+    K = 20 if len(pool) > 40 else max(5, len(pool) // 4)
+    best = pool[np.argsort(scores)[:K]]
+    p2 = int(rng.choice(best))
+
+    # Legs come from the trees already computed; no extra searches
+    path_a = path_from_tree(pred_start, p1)
+    path_b = path_from_tree(pred_p1, p2)
+    if not path_b or path_b[0] != p1:
+        return []
+    if rg.symmetric:
+        path_c = path_from_tree(pred_start, p2)[::-1]
+    else:
+        _, pred_back = rg.shortest_tree(start, (1 + tol) * leg * 2, reverse=True)
+        path_c = path_from_tree(pred_back, p2)[::-1]
+    if path_c[-1] != start:
+        return []
+    return path_a + path_b[1:] + path_c[1:]
+
+
+# Measure how good a loop is (lower score is better)
+def score_loop(rg, path, target_m):
+    """Return length, distance error, retrace ratio, turns, elevation gain and a combined score."""
+    u, v = np.array(path[:-1]), np.array(path[1:])
+    lengths = np.asarray(rg.matrix[u, v]).ravel() if len(u) else np.zeros(0)
+    total = float(lengths.sum())
+
+    # Length on street segments used more than once (either direction)
+    pairs = np.stack([np.minimum(u, v), np.maximum(u, v)], axis=1) if len(u) else np.zeros((0, 2), int)
+    _, first = np.unique(pairs, axis=0, return_index=True)
+    overlap = (total - float(lengths[first].sum())) / total if total else 0.0
+
+    # Heading changes above TURN_ANGLE_DEG
+    lat, lon = rg.lat[path], rg.lon[path]
+    dy, dx = np.diff(lat), np.diff(lon) * np.cos(np.radians(lat[:-1]))
+    moving = (dx != 0) | (dy != 0)
+    heading = np.degrees(np.arctan2(dy[moving], dx[moving]))
+    change = (np.diff(heading) + 180) % 360 - 180
+    turns = int(np.sum(np.abs(change) > TURN_ANGLE_DEG))
+
+    # Elevation gain if the graph has node elevations
+    elev = rg.elevation[path]
+    climb = float(np.nansum(np.clip(np.diff(elev), 0, None))) if np.isfinite(elev).any() else None
+
+    km = max(total / 1000, 1e-6)
+    error = abs(total - target_m) / target_m if target_m else 0.0
+    score = (SCORE_WEIGHTS["distance_error"] * error + SCORE_WEIGHTS["overlap_ratio"] * overlap
+             + SCORE_WEIGHTS["turns_per_km"] * turns / km + SCORE_WEIGHTS["climb_per_km"] * (climb or 0) / km)
+    return {"distance": round(total), "distance_error": round(error, 3), "overlap_ratio": round(overlap, 3),
+            "turns": turns, "elevation_gain": None if climb is None else round(climb, 1), "score": round(score, 4)}
+
+
+# Pool worker side: attach to a shared graph and build candidates
+def _attach(handle):
+    """Return the worker's copy of a shared graph, reading it from shared memory on first use."""
+    name, layout = handle
+    if name in _WORKER:
+        _WORKER.move_to_end(name)
+        return _WORKER[name]
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        arrays = {field: np.ndarray(length, dtype, shm.buf, start).copy() for field, dtype, length, start in layout}
+    finally:
+        shm.close()
+    n = len(arrays["lat"])
+    matrix = csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]), shape=(n, n))
+    rg = RouteGraph.from_arrays(arrays.get("nodes", np.arange(n)), arrays["lat"], arrays["lon"], arrays["elevation"], matrix)
+    _WORKER[name] = rg
+    while len(_WORKER) > WORKER_GRAPHS:
+        _WORKER.popitem(last=False)
+    return rg
+
+def _candidate_batch(graph, start, leg, seeds):
+    """Build and score one loop per seed for a RouteGraph or a shared graph handle (start trees are cached per graph)."""
+    rg = graph if isinstance(graph, RouteGraph) else _attach(graph)
+    d_start, pred_start = rg.shortest_tree(start, (1 + LEG_TOLERANCES[-1]) * leg)
+    results = []
+    for seed in seeds:
+        path = loop_from_start(rg, start, leg, random.Random(seed), d_start, pred_start)
+        if path:
+            results.append((path, score_loop(rg, path, 3 * leg)))
+    return results
+
+# One long-lived pool shared by all requests and graphs
+def _pool():
+    """Return the process pool, starting it on first use (forkserver where available, else spawn)."""
+    with _POOL_LOCK:
+        if _POOL["pool"] is None:
+            method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+            _POOL["pool"] = ProcessPoolExecutor(max_workers=POOL_WORKERS, mp_context=mp.get_context(method))
+        return _POOL["pool"]
+
+def _reset_pool(pool):
+    """Drop a broken pool so the next request starts a new one."""
+    with _POOL_LOCK:
+        if _POOL["pool"] is pool:
+            _POOL["pool"] = None
+    pool.shutdown(wait=False)
+
+
+# Generate several loops in parallel and keep the best ones
+def generate_loops(rg, start, leg, n_candidates=8, top_k=3, budget_s=8.0):
+    """Return up to top_k (path, metrics) pairs sorted by score."""
+    seeds = [random.randrange(2**32) for _ in range(n_candidates)]
+    chunks = [seeds[i::POOL_WORKERS] for i in range(POOL_WORKERS) if seeds[i::POOL_WORKERS]]
+    results = []
+    pool = None
+    try:
+        pool = _pool()
+        handle = rg.share()
+        futures = [pool.submit(_candidate_batch, handle, start, leg, chunk) for chunk in chunks]
+        done, _ = wait(futures, timeout=budget_s)
+        for future in done:
+            error = future.exception()
+            if error is None:
+                results.extend(future.result())
+            elif isinstance(error, BrokenProcessPool):
+                raise error
+    except Exception as e:
+        print(f"Candidate pool failed, running in-process: {e}")
+        if isinstance(e, BrokenProcessPool):
+            _reset_pool(pool)
+    if not results:
+        results = _candidate_batch(rg, start, leg, seeds[:2])
+
+    # Drop duplicate loops and rank
+    unique = {tuple(path): (path, metrics) for path, metrics in results}
+    return sorted(unique.values(), key=lambda item: item[1]["score"])[:top_k]
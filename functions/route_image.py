@@ -0,0 +1,181 @@
+import base64, hashlib, math, os, struct, threading, zlib
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+
+
+# Image layout (pixels)
+IMAGE_WIDTH = 512
+TRACK_HEIGHT = 384
+PROFILE_HEIGHT = 96           # added below the track when elevation is known
+PADDING = 16
+PROFILE_MARGIN = 6            # gap above and below the elevation curve
+LINE_RADIUS = 2               # route line half-width
+
+# Colours (RGB)
+BACKGROUND = (246, 245, 242)
+ROUTE_COLOR = (252, 82, 0)
+START_COLOR = (46, 160, 67)
+END_COLOR = (40, 40, 40)
+PROFILE_FILL = (200, 200, 196)
+PROFILE_LINE = (110, 110, 106)
+
+# Rendered PNGs kept in memory (also written to cache_dir when given, least recently used dropped above the size)
+IMAGE_CACHE_SIZE = 128
+IMAGE_DISK_BYTES = 64 * 1024 * 1024
+
+_LOCK = threading.Lock()
+_IMAGES = OrderedDict()       # cache key -> png bytes
+
+
+# Minimal PNG encoder for an (h, w, 3) uint8 array
+def encode_png(rgb):
+    """Return PNG bytes for an RGB image."""
+    h, w, _ = rgb.shape
+    raw = np.concatenate([np.zeros((h, 1), dtype=np.uint8), rgb.reshape(h, w * 3)], axis=1)
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw.tobytes(), 9)) + chunk(b"IEND", b"")
+
+
+# Draw thick polylines by stamping a disc along densely sampled segments
+def _draw_path(img, xs, ys, color, radius=LINE_RADIUS):
+    """Draw connected segments through pixel coordinates xs, ys onto img."""
+    if len(xs) == 0:
+        return
+    if len(xs) == 1:
+        px, py = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+    else:
+        # One sample per pixel of segment length
+        dx, dy = np.diff(xs), np.diff(ys)
+        steps = np.maximum(np.ceil(np.hypot(dx, dy)).astype(int), 1)
+        seg = np.repeat(np.arange(len(steps)), steps)
+        t = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)) / np.repeat(steps, steps)
+        px = np.append(xs[seg] + dx[seg] * t, xs[-1])
+        py = np.append(ys[seg] + dy[seg] * t, ys[-1])
+    px, py = np.rint(px).astype(int), np.rint(py).astype(int)
+
+    h, w, _ = img.shape
+    for oy in range(-radius, radius + 1):
+        for ox in range(-radius, radius + 1):
+            if ox * ox + oy * oy > radius * radius + radius:
+                continue
+            x, y = px + ox, py + oy
+            ok = (x >= 0) & (x < w) & (y >= 0) & (y < h)
+            img[y[ok], x[ok]] = color
+
+# Project (lat, lon) to pixels, keeping the aspect ratio
+def _project(points, width, height):
+    """Return pixel x, y arrays that fit points into a width x height box."""
+    lat0 = math.radians(float(np.mean(points[:, 0])))
+    x = points[:, 1] * math.cos(lat0)
+    y = points[:, 0]
+    scale = min((width - 2 * PADDING) / max(float(np.ptp(x)), 1e-9), (height - 2 * PADDING) / max(float(np.ptp(y)), 1e-9))
+    px = PADDING + (x - x.min()) * scale + ((width - 2 * PADDING) - np.ptp(x) * scale) / 2
+    py = PADDING + (y.max() - y) * scale + ((height - 2 * PADDING) - np.ptp(y) * scale) / 2
+    return px, py
+
+# Filled elevation profile in the bottom band
+def _draw_profile(img, top, distance, elevation):
+    """Draw elevation against distance between row top and the bottom of img."""
+    ok = np.isfinite(distance) & np.isfinite(elevation)
+    distance, elevation = distance[ok], elevation[ok]
+    if len(distance) < 2 or np.ptp(distance) <= 0:
+        return
+    h, w, _ = img.shape
+    cols = np.arange(PADDING, w - PADDING)
+    at = np.interp(np.linspace(distance.min(), distance.max(), len(cols)), distance, elevation)
+    low, rise = float(at.min()), max(float(np.ptp(at)), 10.0)   # flat runs stay flat
+    band = h - top - 2 * PROFILE_MARGIN
+    ys = top + PROFILE_MARGIN + band * (1 - (at - low) / rise)
+    rows = np.arange(h)[:, None]
+    img[:, PADDING:w - PADDING][(rows >= ys[None, :]) & (rows < h - PROFILE_MARGIN)] = PROFILE_FILL
+    _draw_path(img, cols.astype(np.float64), ys, PROFILE_LINE, radius=1)
+
+
+# Render a route (and optional elevation profile) to PNG
+def render_route_png(coords, distance=None, elevation=None):
+    """Return PNG bytes of the route shape, with an elevation profile if given."""
+    points = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    has_profile = distance is not None and elevation is not None and len(distance) > 1
+    height = TRACK_HEIGHT + (PROFILE_HEIGHT if has_profile else 0)
+    img = np.empty((height, IMAGE_WIDTH, 3), dtype=np.uint8)
+    img[:] = BACKGROUND
+
+    if len(points):
+        px, py = _project(points, IMAGE_WIDTH, TRACK_HEIGHT)
+        _draw_path(img, px, py, ROUTE_COLOR)
+        _draw_path(img, px[-1:], py[-1:], END_COLOR, radius=5)
+        _draw_path(img, px[:1], py[:1], START_COLOR, radius=5)
+    if has_profile:
+        _draw_profile(img, TRACK_HEIGHT, np.asarray(distance, dtype=np.float64), np.asarray(elevation, dtype=np.float64))
+    return encode_png(img)
+
+
+# Keep the disk cache below IMAGE_DISK_BYTES (oldest access first)
+def _evict_disk(cache_dir):
+    """Delete least recently used images until under the size limit."""
+    stats = []
+    for p in Path(cache_dir).glob("*.png"):
+        try:
+            st = p.stat()
+            stats.append((st.st_mtime, st.st_size, p))
+        except OSError:
+            continue
+    stats.sort(key=lambda x: x[0])
+    total = sum(size for _, size, _ in stats)
+    for _, size, path in stats:
+        if total <= IMAGE_DISK_BYTES:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+# Cached route image for an activity or generated route
+def get_route_image(route_id, coords, distance=None, elevation=None, cache_dir=None):
+    """Return PNG bytes for a route, rendering once per route id and geometry."""
+    points = np.ascontiguousarray(np.asarray(coords, dtype=np.float64).reshape(-1, 2))
+    digest = hashlib.sha1(points.tobytes())
+    if distance is not None and elevation is not None:
+        digest.update(np.asarray(elevation, dtype=np.float32).tobytes())
+    key = f"{route_id}-{digest.hexdigest()[:16]}"
+
+    with _LOCK:
+        if key in _IMAGES:
+            _IMAGES.move_to_end(key)
+            return _IMAGES[key]
+
+    # Disk copy from an earlier run
+    path = os.path.join(cache_dir, f"{key}.png") if cache_dir else None
+    png = None
+    if path and os.path.exists(path):
+        try:
+            with open(path, "rb") as f:
+                png = f.read()
+            os.utime(path)  # mark as recently used
+        except OSError:
+            png = None
+    if png is None:
+        png = render_route_png(points, distance, elevation)
+        if path:
+            try:
+                Path(cache_dir).mkdir(parents=True, exist_ok=True)
+                with open(path + ".tmp", "wb") as f:
+                    f.write(png)
+                os.replace(path + ".tmp", path)
+                _evict_disk(cache_dir)
+            except OSError as e:
+                print(f"Route image not cached: {e}")
+
+    with _LOCK:
+        _IMAGES[key] = png
+        while len(_IMAGES) > IMAGE_CACHE_SIZE:
+            _IMAGES.popitem(last=False)
+    return png
+
+# Data URL for sending a PNG to the LLM
+def png_data_url(png):
+    """Return a base64 data URL for PNG bytes."""
+    return "data:image/png;base64," + base64.b64encode(png).decode("ascii")
@@ -1,25 +1,31 @@
-import json, time, os, requests
+import json, os, threading, time
+from collections import OrderedDict
+from pathlib import Path
+
+from functions.token_manager import get_token_manager
+from functions.strava_fetcher import SESSION, EXECUTOR, DEFAULT_TIMEOUT, REQUEST_MAX_WAIT, api_get, fetch_activity_pages
 
 
 # Constants used in the Strava API
-STRAVA_API_BASE = "https://www.strava.com/api/v3"
 STRAVA_OAUTH_URL = "https://www.strava.com/oauth"
-DEFAULT_TIMEOUT = 20
+
+# Activity detail cache (memory LRU in front of one JSON file per activity)
+DETAIL_TTL = 6 * 3600
+DETAIL_CACHE_SIZE = 256
+_DETAILS = OrderedDict()   # activity_id -> (fetched_at, detail)
+_INFLIGHT = {}             # activity_id -> Future of a running fetch
+_DETAILS_LOCK = threading.Lock()
 
 
-# Helper for loading tokens from file
+# Helper for loading tokens (cached in memory, re-read only when file changes)
 def _load_tokens(token_file):
-    """Read tokens from disk or return empty dict."""
-    if os.path.exists(token_file):
-        with open(token_file, "r") as f:
-            return json.load(f)
-    return {}
+    """Return tokens or empty dict."""
+    return get_token_manager(token_file).load()
 
 # Helper for saving tokens to file
 def _save_tokens(tokens, token_file):
-    """Write tokens to disk."""
-    with open(token_file, "w") as f:
-        json.dump(tokens, f)
+    """Write tokens to disk atomically."""
+    get_token_manager(token_file).save(tokens)
 
 # Helper for building the Strava login URL
 def _auth_url(strava_client_id, redirect_uri):
@@ -33,14 +39,11 @@ def _auth_url(strava_client_id, redirect_uri):
         "&approval_prompt=auto"
     )
 
-# Helper for refreshing token if expired
+# Helper for refreshing token if expired (or about to expire)
 def _refresh_if_needed(token_file, strava_client_id, strava_client_secret):
-    """Return a valid access token, refreshing if expired."""
-    tokens = _load_tokens(token_file)
-    if not tokens:
-        return None
-    if tokens.get("expires_at", 0) <= int(time.time()):
-        r = requests.post(
+    """Return a valid access token, refreshing once per process when needed."""
+    def refresh(tokens):
+        r = SESSION.post(
             f"{STRAVA_OAUTH_URL}/token",
             data={
                 "client_id": strava_client_id,
@@ -51,42 +54,121 @@ def _refresh_if_needed(token_file, strava_client_id, strava_client_secret):
             timeout=DEFAULT_TIMEOUT
         )
         r.raise_for_status()
-        tokens = r.json()
-        _save_tokens(tokens, token_file)
-    return tokens.get("access_token")
-
-# Helper for making auth headers
-def _auth_header(access_token):
-    """Return HTTP Authorization header."""
-    return {"Authorization": f"Bearer {access_token}"}
+        return r.json()
+    return get_token_manager(token_file).access_token(refresh)
 
-
-# Get one Strava activity by ID
-def get_strava_activity(activity_id, token_file, strava_client_id, strava_client_secret):
-    """Fetch one activity from Strava by ID."""
+# Helper for getting a token or failing loudly
+def _require_token(token_file, strava_client_id, strava_client_secret):
+    """Return a valid access token or raise if not logged in."""
     access_token = _refresh_if_needed(token_file, strava_client_id, strava_client_secret)
     if not access_token:
         raise Exception("No access token available. Please authenticate with Strava.")
-    r = requests.get(
-        f"{STRAVA_API_BASE}/activities/{activity_id}",
-        headers=_auth_header(access_token),
-        params={"include_all_efforts": False},
-        timeout=DEFAULT_TIMEOUT
-    )
-    r.raise_for_status()
-    return r.json()
+    return access_token
+
+
+# Helpers for the detail cache
+def _detail_path(cache_dir, activity_id):
+    """Return disk path for one cached activity detail."""
+    return os.path.join(cache_dir, f"{activity_id}.json")
+
+def _remember_detail(activity_id, detail, fetched_at, cache_dir=None):
+    """Put a detail in the memory LRU (and on disk if cache_dir is set)."""
+    with _DETAILS_LOCK:
+        _DETAILS[activity_id] = (fetched_at, detail)
+        _DETAILS.move_to_end(activity_id)
+        while len(_DETAILS) > DETAIL_CACHE_SIZE:
+            _DETAILS.popitem(last=False)
+    if cache_dir:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        tmp_path = _detail_path(cache_dir, activity_id) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(detail, f)
+        os.replace(tmp_path, _detail_path(cache_dir, activity_id))
+
+def _cached_detail(activity_id, cache_dir=None):
+    """Return a fresh cached detail from memory or disk, or None."""
+    now = time.time()
+    with _DETAILS_LOCK:
+        hit = _DETAILS.get(activity_id)
+        if hit and now - hit[0] < DETAIL_TTL:
+            _DETAILS.move_to_end(activity_id)
+            return hit[1]
+    if cache_dir:
+        path = _detail_path(cache_dir, activity_id)
+        try:
+            fetched_at = os.path.getmtime(path)
+            if now - fetched_at < DETAIL_TTL:
+                with open(path, "r") as f:
+                    detail = json.load(f)
+                _remember_detail(activity_id, detail, fetched_at)
+                return detail
+        except (OSError, ValueError):
+            pass
+    return None
+
+def _fetch_detail(activity_id, access_token, cache_dir=None):
+    """Download one detail from Strava and cache it."""
+    try:
+        detail = api_get(f"/activities/{activity_id}", access_token, {"include_all_efforts": False}, REQUEST_MAX_WAIT)
+        _remember_detail(activity_id, detail, time.time(), cache_dir)
+        return detail
+    finally:
+        with _DETAILS_LOCK:
+            _INFLIGHT.pop(activity_id, None)
+
+def _start_fetch(activity_id, access_token, cache_dir=None):
+    """Return the running fetch for an id, starting one if needed."""
+    with _DETAILS_LOCK:
+        future = _INFLIGHT.get(activity_id)
+        if future is None:
+            future = EXECUTOR.submit(_fetch_detail, activity_id, access_token, cache_dir)
+            _INFLIGHT[activity_id] = future
+        return future
+
+
+# Get one Strava activity by ID (served from cache when possible)
+def get_strava_activity(activity_id, token_file, strava_client_id, strava_client_secret, cache_dir=None):
+    """Fetch one activity from Strava by ID."""
+    activity_id = str(activity_id)
+    detail = _cached_detail(activity_id, cache_dir)
+    if detail is not None:
+        return detail
+    access_token = _require_token(token_file, strava_client_id, strava_client_secret)
+    return _start_fetch(activity_id, access_token, cache_dir).result()
+
+# Warm the detail cache in the background
+def prefetch_strava_activities(activity_ids, token_file, strava_client_id, strava_client_secret, cache_dir=None):
+    """Start fetching details that are not cached yet; does not wait for them."""
+    missing = [str(i) for i in activity_ids if i is not None and _cached_detail(str(i), cache_dir) is None]
+    if not missing:
+        return
+    access_token = _require_token(token_file, strava_client_id, strava_client_secret)
+    for activity_id in missing:
+        _start_fetch(activity_id, access_token, cache_dir)
+
+# Drop cached details (e.g. after a sync reported changes)
+def invalidate_activity_details(activity_ids, cache_dir=None):
+    """Forget cached details for the given activity ids."""
+    for activity_id in map(str, activity_ids):
+        with _DETAILS_LOCK:
+            _DETAILS.pop(activity_id, None)
+        if cache_dir:
+            try:
+                os.remove(_detail_path(cache_dir, activity_id))
+            except OSError:
+                pass
 
 # Get recent Strava activities
-def get_strava_activities(limit, token_file, strava_client_id, strava_client_secret):
-    """Fetch recent activities up to given limit."""
-    access_token = _refresh_if_needed(token_file, strava_client_id, strava_client_secret)
-    if not access_token:
-        raise Exception("No access token available. Please authenticate with Strava.")
-    r = requests.get(
-        f"{STRAVA_API_BASE}/athlete/activities",
-        headers=_auth_header(access_token),
-        params={"per_page": limit},
-        timeout=DEFAULT_TIMEOUT
-    )
-    r.raise_for_status()
-    return r.json()
\ No newline at end of file
+def get_strava_activities(limit, token_file, strava_client_id, strava_client_secret, page=1, after=None):
+    """Fetch one page of activities (optionally only those started after a Unix timestamp)."""
+    access_token = _require_token(token_file, strava_client_id, strava_client_secret)
+    params = {"per_page": limit, "page": page}
+    if after is not None:
+        params["after"] = int(after)
+    return api_get("/athlete/activities", access_token, params, REQUEST_MAX_WAIT)
+
+# Get every Strava activity (optionally only those started after a Unix timestamp)
+def get_all_strava_activities(token_file, strava_client_id, strava_client_secret, after=None):
+    """Page through the full activity list concurrently, paced by Strava's rate limits."""
+    access_token = _require_token(token_file, strava_client_id, strava_client_secret)
+    return fetch_activity_pages(access_token, after=after, max_wait=REQUEST_MAX_WAIT)
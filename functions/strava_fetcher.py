@@ -0,0 +1,157 @@
+import os, threading, time, requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+
+# Base URL can point at a local fake Strava server for testing (read per request, so .env loaded later applies)
+DEFAULT_API_BASE = "https://www.strava.com/api/v3"
+DEFAULT_TIMEOUT = 20
+
+# Fetcher settings
+MAX_WORKERS = 8          # concurrent requests to Strava
+SAFETY_MARGIN = 5        # requests kept in reserve in each quota window
+MAX_RETRIES = 3          # retries after a 429 or connection error
+WINDOW_SECONDS = 15 * 60 # Strava's short quota window (aligned to quarter hours)
+REQUEST_MAX_WAIT = 10    # longest a caller sleeps for quota before RateLimitExceeded
+
+
+class RateLimitExceeded(Exception):
+    """Raised when waiting for Strava quota would take longer than allowed."""
+
+
+# Token bucket refilled at Strava's window boundaries and corrected from X-RateLimit-* headers
+class RateLimiter:
+    def __init__(self, short_limit=200, daily_limit=2000):
+        self._lock = threading.Lock()
+        self.short_limit, self.daily_limit = short_limit, daily_limit
+        self.short_used, self.daily_used = 0, 0
+        self._window, self._day = self._current_window(), self._current_day()
+
+    @staticmethod
+    def _current_window(now=None):
+        return int((now or time.time()) // WINDOW_SECONDS)
+
+    @staticmethod
+    def _current_day(now=None):
+        return int((now or time.time()) // 86400)
+
+    def _roll(self, now):
+        """Refill the bucket when a new window or day starts."""
+        if self._current_window(now) != self._window:
+            self._window, self.short_used = self._current_window(now), 0
+        if self._current_day(now) != self._day:
+            self._day, self.daily_used = self._current_day(now), 0
+
+    def _wait_time(self, now):
+        """Seconds until a request may be sent (0 if tokens are left)."""
+        if self.daily_used >= self.daily_limit - SAFETY_MARGIN:
+            return (self._day + 1) * 86400 - now
+        if self.short_used >= self.short_limit - SAFETY_MARGIN:
+            return (self._window + 1) * WINDOW_SECONDS - now
+        return 0
+
+    def acquire(self, max_wait=None):
+        """Take one token, sleeping until the quota window resets if needed."""
+        while True:
+            with self._lock:
+                now = time.time()
+                self._roll(now)
+                wait = self._wait_time(now)
+                if wait <= 0:
+                    self.short_used += 1
+                    self.daily_used += 1
+                    return
+            if max_wait is not None and wait > max_wait:
+                raise RateLimitExceeded(f"Strava rate limit reached, quota resets in {int(wait)} s.")
+            time.sleep(min(wait, 60))
+
+    def update(self, headers):
+        """Sync counters with Strava's reported limits and usage (stricter of read/overall)."""
+        pairs = []
+        for prefix in ("X-RateLimit", "X-ReadRateLimit"):
+            limit, usage = headers.get(f"{prefix}-Limit"), headers.get(f"{prefix}-Usage")
+            if limit and usage:
+                try:
+                    pairs.append((tuple(int(v) for v in limit.split(",")[:2]), tuple(int(v) for v in usage.split(",")[:2])))
+                except ValueError:
+                    continue
+        if not pairs:
+            return
+        with self._lock:
+            self._roll(time.time())
+            # Use the tightest remaining quota; never lower local usage (requests may still be in flight)
+            (short_limit, daily_limit), (short_used, daily_used) = min(pairs, key=lambda p: p[0][0] - p[1][0])
+            self.short_limit, self.daily_limit = short_limit, daily_limit
+            self.short_used = max(self.short_used, short_used)
+            self.daily_used = max(self.daily_used, daily_used)
+
+    def exhaust(self):
+        """Mark current window as used up (after a 429)."""
+        with self._lock:
+            self.short_used = self.short_limit
+
+
+# Shared pooled session, limiter and worker pool
+def _build_session():
+    """Create a keep-alive session with a connection pool sized for the workers."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+SESSION = _build_session()
+LIMITER = RateLimiter()
+EXECUTOR = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="strava")
+
+
+# Strava API base URL
+def _api_base():
+    """Return STRAVA_API_BASE from the environment, or the public API."""
+    return os.getenv("STRAVA_API_BASE", DEFAULT_API_BASE).rstrip("/")
+
+# Send one rate-limited GET to the Strava API
+def api_get(path, access_token, params=None, max_wait=REQUEST_MAX_WAIT):
+    """GET a Strava API path and return decoded JSON."""
+    for attempt in range(MAX_RETRIES + 1):
+        LIMITER.acquire(max_wait)
+        try:
+            r = SESSION.get(
+                f"{_api_base()}{path}",
+                headers={"Authorization": f"Bearer {access_token}"},
+                params=params,
+                timeout=DEFAULT_TIMEOUT
+            )
+        except requests.ConnectionError:
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(2 ** attempt)
+            continue
+        LIMITER.update(r.headers)
+        if r.status_code == 429 and attempt < MAX_RETRIES:
+            LIMITER.exhaust()
+            continue
+        r.raise_for_status()
+        return r.json()
+
+# Fetch activity list pages concurrently until a short page marks the end
+def fetch_activity_pages(access_token, per_page=200, after=None, max_workers=MAX_WORKERS, max_wait=REQUEST_MAX_WAIT):
+    """Return every listed activity (in page order) using a bounded worker pool."""
+    # Start with one page (incremental syncs rarely need more), then widen the wave
+    activities, page, wave = [], 1, 1
+    while True:
+        params = [{"per_page": per_page, "page": p} for p in range(page, page + wave)]
+        if after is not None:
+            for p in params:
+                p["after"] = int(after)
+        futures = [EXECUTOR.submit(api_get, "/athlete/activities", access_token, p, max_wait) for p in params]
+        for future in futures:
+            batch = future.result()
+            activities.extend(batch)
+            if len(batch) < per_page:
+                # Later pages in this wave are empty; let them finish quietly
+                for rest in futures:
+                    rest.cancel()
+                return activities
+        page += wave
+        wave = min(wave * 2, max_workers)
@@ -0,0 +1,243 @@
+import json, os, threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from functions.strava_api import _require_token
+from functions.strava_fetcher import api_get, REQUEST_MAX_WAIT
+
+
+# Strava stream types we keep (latlng is split into lat/lng columns)
+STREAM_KEYS = ("time", "distance", "latlng", "altitude", "heartrate", "cadence", "velocity_smooth")
+
+# Files inside the streams directory
+DATA_FILE = "streams.f32"    # append-only float32 columns for all activities
+INDEX_FILE = "index.json"    # activity_id -> {"offset", "length", "columns"}
+
+# Newly synced activities whose streams are fetched in the background per sync
+BACKGROUND_INGEST_LIMIT = 50
+
+# The data file is rewritten once this share of it belongs to replaced or deleted activities
+COMPACT_RATIO = 0.3
+
+# Stream downloads run on their own pool so they never hold up the shared Strava workers
+STREAM_WORKERS = 4
+STREAM_EXECUTOR = ThreadPoolExecutor(max_workers=STREAM_WORKERS, thread_name_prefix="streams")
+
+_LOCK = threading.Lock()
+_INFLIGHT = {}               # activity_id -> future of a running download
+_STATE = {"dir": None, "index": None, "index_mtime": None, "mmap": None, "mmap_size": None}
+
+
+# Helper for loading the offset index (reloaded when file changes)
+def _index(streams_dir):
+    """Return the stream index for a directory."""
+    path = os.path.join(streams_dir, INDEX_FILE)
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    if _STATE["dir"] != streams_dir or _STATE["index_mtime"] != mtime:
+        index = {}
+        if mtime is not None:
+            with open(path, "r") as f:
+                index = json.load(f)
+        _STATE.update({"dir": streams_dir, "index": index, "index_mtime": mtime, "mmap": None, "mmap_size": None})
+    return _STATE["index"]
+
+# Helper for writing the index atomically
+def _write_index(streams_dir, index):
+    """Persist the stream index."""
+    path = os.path.join(streams_dir, INDEX_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(path + ".tmp", path)
+    _STATE.update({"index": index, "index_mtime": os.path.getmtime(path)})
+
+# Helper for mapping the data file (remapped when it grows)
+def _data(streams_dir):
+    """Return a read-only memory map over all stored samples."""
+    path = os.path.join(streams_dir, DATA_FILE)
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    if _STATE["mmap"] is None or _STATE["mmap_size"] != size:
+        _STATE["mmap"] = np.memmap(path, dtype=np.float32, mode="r") if size else np.zeros(0, dtype=np.float32)
+        _STATE["mmap_size"] = size
+    return _STATE["mmap"]
+
+
+# Convert Strava's key_by_type response into equal-length float32 columns
+def _to_columns(raw):
+    """Return {column: np.ndarray} from a Strava streams response."""
+    columns = {}
+    for key in STREAM_KEYS:
+        data = (raw.get(key) or {}).get("data")
+        if not data:
+            continue
+        if key == "latlng":
+            arr = np.asarray(data, dtype=np.float32).reshape(-1, 2)
+            columns["lat"], columns["lng"] = arr[:, 0], arr[:, 1]
+        else:
+            columns[key] = np.asarray([np.nan if v is None else v for v in data], dtype=np.float32)
+    if not columns:
+        return {}
+    n = min(len(c) for c in columns.values())
+    return {k: c[:n] for k, c in columns.items()}
+
+# Store streams for one activity (replaces any older copy)
+def save_streams(activity_id, columns, streams_dir):
+    """Append columns to the data file and point the index at them."""
+    if not columns:
+        return
+    Path(streams_dir).mkdir(parents=True, exist_ok=True)
+    names = sorted(columns)
+    length = len(columns[names[0]])
+    with _LOCK:
+        index = dict(_index(streams_dir))
+        path = os.path.join(streams_dir, DATA_FILE)
+        offset = (os.path.getsize(path) if os.path.exists(path) else 0) // 4
+        with open(path, "ab") as f:
+            for name in names:
+                np.ascontiguousarray(columns[name], dtype=np.float32).tofile(f)
+        index[str(activity_id)] = {"offset": offset, "length": length, "columns": names}
+        _write_index(streams_dir, index)
+
+# Read streams for one activity as memory-mapped views
+def load_streams(activity_id, streams_dir):
+    """Return {column: array view} for an activity, or None if not stored."""
+    with _LOCK:
+        entry = _index(streams_dir).get(str(activity_id))
+        if not entry:
+            return None
+        data = _data(streams_dir)
+    start, n = entry["offset"], entry["length"]
+    return {name: data[start + i * n: start + (i + 1) * n] for i, name in enumerate(entry["columns"])}
+
+# Forget streams for deleted or updated activities
+def delete_streams(activity_ids, streams_dir):
+    """Remove activities from the index (data is reclaimed by compact_streams)."""
+    with _LOCK:
+        index = dict(_index(streams_dir))
+        removed = [index.pop(str(i), None) for i in activity_ids]
+        if any(removed):
+            _write_index(streams_dir, index)
+
+# Rewrite the data file without unreferenced blocks
+def compact_streams(streams_dir, min_dead_ratio=COMPACT_RATIO):
+    """Drop space left by replaced or deleted activities once it exceeds min_dead_ratio of the file; returns True if rewritten."""
+    with _LOCK:
+        index, data = _index(streams_dir), _data(streams_dir)
+        live = sum(entry["length"] * len(entry["columns"]) for entry in index.values())
+        if not len(data) or (len(data) - live) / len(data) <= min_dead_ratio:
+            return False
+        path = os.path.join(streams_dir, DATA_FILE)
+        new_index, offset = {}, 0
+        with open(path + ".tmp", "wb") as f:
+            for activity_id, entry in index.items():
+                size = entry["length"] * len(entry["columns"])
+                np.asarray(data[entry["offset"]: entry["offset"] + size]).tofile(f)
+                new_index[activity_id] = {**entry, "offset": offset}
+                offset += size
+        _STATE["mmap"] = None
+        os.replace(path + ".tmp", path)
+        _write_index(streams_dir, new_index)
+    return True
+
+
+# Download and store streams for one activity
+def _fetch_streams(activity_id, access_token, streams_dir, max_wait):
+    """Fetch one activity's streams from Strava and save them."""
+    try:
+        params = {"keys": ",".join(STREAM_KEYS), "key_by_type": "true"}
+        save_streams(activity_id, _to_columns(api_get(f"/activities/{activity_id}/streams", access_token, params, max_wait)), streams_dir)
+        return activity_id
+    finally:
+        with _LOCK:
+            _INFLIGHT.pop(activity_id, None)
+
+# Start downloads in the background (joins downloads already running for the same activity)
+def start_stream_ingest(activity_ids, streams_dir, token_file, strava_client_id, strava_client_secret, max_wait=REQUEST_MAX_WAIT):
+    """Start fetching streams that are not stored yet; return {activity_id: future} without waiting."""
+    with _LOCK:
+        index = _index(streams_dir)
+        missing = [str(i) for i in activity_ids if i is not None and str(i) not in index]
+    if not missing:
+        return {}
+    access_token = _require_token(token_file, strava_client_id, strava_client_secret)
+    futures = {}
+    with _LOCK:
+        for activity_id in missing:
+            future = _INFLIGHT.get(activity_id)
+            if future is None:
+                future = STREAM_EXECUTOR.submit(_fetch_streams, activity_id, access_token, streams_dir, max_wait)
+                _INFLIGHT[activity_id] = future
+            futures[activity_id] = future
+    return futures
+
+# Download and store streams for many activities concurrently
+def ingest_streams(activity_ids, streams_dir, token_file, strava_client_id, strava_client_secret, max_wait=REQUEST_MAX_WAIT):
+    """Fetch streams that are not stored yet; return ids that were ingested."""
+    futures = start_stream_ingest(activity_ids, streams_dir, token_file, strava_client_id, strava_client_secret, max_wait)
+    done = []
+    for activity_id, future in futures.items():
+        try:
+            done.append(future.result())
+        except Exception as e:
+            print(f"Stream ingest failed for {activity_id}: {e}")
+    return done
+
+# Get streams for one activity, fetching them on first use
+def get_activity_streams(activity_id, streams_dir, token_file, strava_client_id, strava_client_secret):
+    """Return stored streams for an activity (None if Strava has none)."""
+    streams = load_streams(activity_id, streams_dir)
+    if streams is None:
+        ingest_streams([activity_id], streams_dir, token_file, strava_client_id, strava_client_secret)
+        streams = load_streams(activity_id, streams_dir)
+    return streams
+
+
+# Split a run into fixed-distance segments using per-second data
+def compute_splits(streams, split_m=1000):
+    """Return one dict per split with time, pace, heart rate and elevation gain."""
+    if not streams or "time" not in streams or "distance" not in streams:
+        return []
+    t = np.asarray(streams["time"], dtype=np.float64)
+    d = np.asarray(streams["distance"], dtype=np.float64)
+    if len(d) < 2 or d[-1] < split_m / 2:
+        return []
+
+    # Sample index where each split boundary is crossed
+    bounds = np.arange(split_m, d[-1] + split_m, split_m)
+    ends = np.minimum(np.searchsorted(d, np.minimum(bounds, d[-1])), len(d) - 1)
+    starts = np.concatenate(([0], ends[:-1]))
+
+    hr, alt = streams.get("heartrate"), streams.get("altitude")
+    climb = np.concatenate(([0.0], np.clip(np.diff(np.asarray(alt, dtype=np.float64)), 0, None))) if alt is not None else None
+    splits = []
+    for i, (s, e) in enumerate(zip(starts, ends), start=1):
+        dist, secs = d[e] - d[s], t[e] - t[s]
+        if dist <= 0:
+            continue
+        splits.append({
+            "split": i,
+            "distance_m": round(float(dist)),
+            "seconds": round(float(secs)),
+            "pace_min_km": round(float(secs / 60 / (dist / 1000)), 2),
+            "avg_heartrate": round(float(np.nanmean(hr[s:e + 1])), 1) if hr is not None else None,
+            "elevation_gain_m": round(float(np.nansum(climb[s + 1:e + 1])), 1) if climb is not None else None,
+        })
+    return splits
+
+# Short text description of per-second data for LLM analysis
+def describe_streams(streams):
+    """Summarize splits and intensity from streams as plain text."""
+    splits = compute_splits(streams)
+    if not splits:
+        return ""
+    lines = ["Per-km splits (split, pace min/km, avg HR, elevation gain m):"]
+    for s in splits:
+        lines.append(f"{s['split']}: {s['pace_min_km']}, {s['avg_heartrate']}, {s['elevation_gain_m']}")
+    hr = streams.get("heartrate")
+    if hr is not None and len(hr):
+        lines.append(f"Heart rate min/avg/max: {np.nanmin(hr):.0f}/{np.nanmean(hr):.0f}/{np.nanmax(hr):.0f} bpm")
+    cadence = streams.get("cadence")
+    if cadence is not None and len(cadence):
+        # Strava reports running cadence per leg
+        lines.append(f"Average cadence: {np.nanmean(cadence) * 2:.0f} spm")
+    return "\n".join(lines)
@@ -0,0 +1,93 @@
+import json, os, tempfile, threading, time
+
+
+# Refresh tokens this many seconds before they expire
+REFRESH_MARGIN = 300
+
+# One manager per token file in this process
+_MANAGERS = {}
+_MANAGERS_LOCK = threading.Lock()
+
+
+# Keeps OAuth tokens in memory, reloads on file change and refreshes single-flight
+class TokenManager:
+    def __init__(self, token_file):
+        self.token_file = token_file
+        self._lock = threading.Lock()           # guards cached tokens
+        self._refresh_lock = threading.Lock()   # only one refresh at a time
+        self._tokens, self._stamp = {}, None
+
+    def _file_stamp(self):
+        """Return (mtime, size) of the token file or None if missing."""
+        try:
+            st = os.stat(self.token_file)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def load(self):
+        """Return cached tokens, re-reading the file only if it changed."""
+        stamp = self._file_stamp()
+        with self._lock:
+            if stamp is None:
+                self._tokens, self._stamp = {}, None
+            elif stamp != self._stamp:
+                with open(self.token_file, "r") as f:
+                    self._tokens = json.load(f)
+                self._stamp = stamp
+            return self._tokens
+
+    def save(self, tokens):
+        """Write tokens atomically (temp file + rename) and update the cache."""
+        folder = os.path.dirname(os.path.abspath(self.token_file))
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".tokens-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(tokens, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.token_file)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self._tokens, self._stamp = tokens, self._file_stamp()
+
+    @staticmethod
+    def _needs_refresh(tokens):
+        return tokens.get("expires_at", 0) - REFRESH_MARGIN <= time.time()
+
+    def access_token(self, refresh):
+        """Return a valid access token; refresh(tokens) is called by at most one thread at a time."""
+        tokens = self.load()
+        if not tokens:
+            return None
+        if not self._needs_refresh(tokens):
+            return tokens.get("access_token")
+
+        with self._refresh_lock:
+            # Another thread may have refreshed while we waited
+            tokens = self.load()
+            if self._needs_refresh(tokens):
+                try:
+                    tokens = {**tokens, **refresh(tokens)}
+                except Exception:
+                    # Proactive refresh failed but the old token still works
+                    if tokens.get("expires_at", 0) > time.time():
+                        return tokens.get("access_token")
+                    raise
+                self.save(tokens)
+        return tokens.get("access_token")
+
+
+# Get the shared manager for a token file
+def get_token_manager(token_file):
+    """Return the process-wide TokenManager for this file."""
+    key = os.path.abspath(token_file)
+    with _MANAGERS_LOCK:
+        if key not in _MANAGERS:
+            _MANAGERS[key] = TokenManager(token_file)
+        return _MANAGERS[key]
@@ -0,0 +1,70 @@
+import threading, time
+
+from functions.geocoding import geocode_city
+from functions.graph_cache import get_graph
+from functions.route_engine import get_route_graph, LEG_TOLERANCES
+
+
+# Default loop lengths (m) warmed for each home area
+WARMUP_DISTANCES = (5000,)
+
+# Reload graphs this often (s) so edits in OSM and evicted tiles come back
+WARMUP_INTERVAL = 6 * 3600
+
+_LOCK = threading.Lock()
+_STATUS = {}             # area -> {"state", "nodes", "updated_at", "error"}
+_THREAD = {"thread": None}
+
+
+# Helper for updating one area's status
+def _set_status(area, **fields):
+    """Merge fields into the status of an area."""
+    with _LOCK:
+        _STATUS[area] = {**_STATUS.get(area, {}), **fields}
+
+# Load graph and shortest-path structures for one area
+def warm_area(area, distances=WARMUP_DISTANCES, network_type="walk", max_age=None):
+    """Geocode an area and build its graph, CSR form and start tree for each distance (re-fetching tiles older than max_age s)."""
+    _set_status(area, state="loading", error=None)
+    try:
+        coords = geocode_city(area)
+        if not coords:
+            raise ValueError(f"Could not geocode '{area}'")
+        nodes = 0
+        for distance in distances:
+            # Same sizing as generate_routes so requests hit the warm entries
+            leg = distance / 3.0
+            G = get_graph(coords, max(1200, int(leg * 1.3)), network_type, max_age=max_age)
+            rg = get_route_graph(G)
+            rg.shortest_tree(rg.nearest(*coords), (1 + LEG_TOLERANCES[-1]) * leg)
+            nodes = max(nodes, len(rg))
+        _set_status(area, state="ready", nodes=nodes, updated_at=time.time())
+    except Exception as e:
+        _set_status(area, state="error", error=str(e), updated_at=time.time())
+
+# Warm all areas now and then periodically
+def _warmup_loop(areas, distances, network_type, interval):
+    """Run forever: warm every area, then sleep; later passes download tiles older than the interval again."""
+    max_age = None
+    while True:
+        for area in areas:
+            warm_area(area, distances, network_type, max_age)
+        max_age = interval
+        time.sleep(interval)
+
+# Start the background warm-up worker (once per process)
+def start_warmup(areas, distances=WARMUP_DISTANCES, network_type="walk", interval=WARMUP_INTERVAL):
+    """Start a daemon thread that preloads street graphs for the given areas."""
+    if not areas or _THREAD["thread"] is not None:
+        return
+    for area in areas:
+        _set_status(area, state="pending", nodes=0, updated_at=None, error=None)
+    thread = threading.Thread(target=_warmup_loop, args=(list(areas), distances, network_type, interval), name="graph-warmup", daemon=True)
+    _THREAD["thread"] = thread
+    thread.start()
+
+# Report which areas are ready
+def warmup_status():
+    """Return a copy of the per-area warm-up status."""
+    with _LOCK:
+        return {area: dict(status) for area, status in _STATUS.items()}
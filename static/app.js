@@ -105,36 +105,33 @@ function spinnerSVG(){
 
 
 // === Map iframe helpers ===
-// Resolve when the map iframe fires "load" (with a fallback timeout)
-function waitForMapLoad(timeoutMs=4000){
-  return new Promise((resolve)=>{
-    let done=false, t=null;
-    const finish=()=>{ if(done) return; done=true; clearTimeout(t); mapFrame?.removeEventListener('load', finish); setTimeout(resolve, 250); };
-    mapFrame?.addEventListener('load', finish);
-    t=setTimeout(finish, timeoutMs);
-  });
-}
+// The map page loads once and announces itself with MAP_READY
+const mapReady = new Promise((resolve)=>{
+  const onMsg=(e)=>{ if((e.data||{}).type==='MAP_READY'){ window.removeEventListener('message', onMsg); resolve(); } };
+  window.addEventListener('message', onMsg);
+  // In case the map loaded before this script ran, ask it again
+  const ping=()=>{ try{ mapFrame?.contentWindow?.postMessage({type:'PING'}, '*'); }catch(_){} };
+  mapFrame?.addEventListener('load', ping);
+  ping();
+});
 
-// Ask the iframe to export a PNG via postMessage and wait for the reply
-function requestMapPng(timeoutMs=5000){
-  return new Promise((resolve, reject)=>{
-    let done=false, t=null;
+// Send a command to the map page and wait for MAP_DONE (with a fallback timeout)
+let mapCommandId = 0;
+async function mapCommand(msg, timeoutMs=4000){
+  await mapReady;
+  const id = ++mapCommandId;
+  return new Promise((resolve)=>{
+    let t=null;
     const onMsg=(e)=>{
       const d=e.data||{};
-      if(d.type==='EXPORT_MAP_RESULT'){
-        window.removeEventListener('message', onMsg);
-        done=true; clearTimeout(t);
-        if(d.error) reject(new Error(d.error));
-        else resolve(d.dataURL);
-      }
+      if(d.type==='MAP_DONE' && d.id===id){ window.removeEventListener('message', onMsg); clearTimeout(t); resolve(); }
     };
     window.addEventListener('message', onMsg);
-    try{ mapFrame?.contentWindow?.postMessage({type:'EXPORT_MAP'}, '*'); }catch(_){}
-    t=setTimeout(()=>{ if(done) return; window.removeEventListener('message', onMsg); reject(new Error('Map export timeout')); }, timeoutMs);
+    try{ mapFrame?.contentWindow?.postMessage({...msg, id}, '*'); }catch(_){}
+    t=setTimeout(()=>{ window.removeEventListener('message', onMsg); resolve(); }, timeoutMs);
   });
 }
 
-
 // === Route selection state & helpers ===
 // Store all returned routes by id
 const ROUTES = new Map(); // route_id -> { route_id, kind, name, polyline?, coords? }
@@ -146,26 +143,24 @@ function registerRoute(r) {
   ROUTES.set(r.route_id, r);
 }
 
-// Send a map render request to backend and refresh iframe
-async function pushMap(payload) {
+// Fetch a route's GeoJSON once and swap it into the map layer
+async function showRoute(r) {
   try {
-    await fetch('/api/select_route', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify(payload),
-    });
-  } catch (e) {}
-  const src = `/static/map.html?ts=${Date.now()}`;
-  if (mapFrame) mapFrame.src = src;
+    const url = `/api/route/${encodeURIComponent(r.route_id)}.geojson`;
+    if (!r.geojson) {
+      const res = await fetch(url);
+      if (!res.ok) throw new Error('Route not found');
+      r.geojson = await res.json();
+    }
+    await mapCommand({ type: 'SHOW_ROUTE', geojson: r.geojson, url });
+  } catch (e) {
+    await clearMap();
+  }
 }
 
-// Clear the map on backend and refresh iframe
+// Remove the route layer from the map
 async function clearMap() {
-  try {
-    await fetch('/api/clear_route', { method: 'POST' });
-  } catch (e) {}
-  const src = `/static/map.html?ts=${Date.now()}`;
-  if (mapFrame) mapFrame.src = src;
+  await mapCommand({ type: 'CLEAR_ROUTE' });
 }
 
 // Toggle which activity card is selected (and update map)
@@ -177,40 +172,83 @@ function updateSelectedUI(activeId) {
   });
 }
 
-// Select/deselect a route and render it to the map
+// Select/deselect a route and render it to the map (resolves when drawn)
 function toggleSelect(routeId) {
   if (selectedRouteId === routeId) {
     selectedRouteId = null;
     updateSelectedUI(null);
-    clearMap();
-    return;
+    return clearMap();
   }
   selectedRouteId = routeId;
   updateSelectedUI(routeId);
   const r = ROUTES.get(routeId);
-  if (!r) return;
-  if (r.kind === 'generated' && Array.isArray(r.coords)) {
-    pushMap({ name: r.name || 'Generated Route', coords: r.coords });
-  } else if (r.polyline) {
-    pushMap({ name: r.name || 'Activity', polyline: r.polyline });
-  } else {
-    clearMap();
+  if (!r) return Promise.resolve();
+  if ((r.kind === 'generated' && Array.isArray(r.coords)) || r.polyline) {
+    return showRoute(r);
   }
+  return clearMap();
 }
 
 
 // === Mic recording (speech-to-text) ===
+// With MIC_SEGMENT_MS > 0 audio is uploaded in segments while recording and transcribed as it arrives;
+// 0 uploads one clip when recording stops
+const MIC_SEGMENT_MS = 4000;
+
 let mediaRecorder = null;
 let micChunks = [];
 let recording = false;
+let micStream = null;
+let micSession = null;
+
+// Start a recorder on the mic stream; each recorder produces one self-contained webm file
+function startSegment() {
+  const rec = new MediaRecorder(micStream, { mimeType: 'audio/webm' });
+  rec.index = micSession.index++;
+  const chunks = [];
+  rec.ondataavailable = (e) => { if (e.data && e.data.size) chunks.push(e.data); };
+  rec.stopped = new Promise((resolve) => { rec.onstop = () => resolve(new Blob(chunks, { type: 'audio/webm' })); });
+  rec.start();
+  return rec;
+}
+
+// Upload one segment of a session (the final one answers with the full transcript)
+function uploadSegment(session, index, blob, final = false) {
+  const fd = new FormData();
+  fd.append('file', blob, `segment-${index}.webm`);
+  fd.append('session', session.id);
+  fd.append('index', String(index));
+  if (final) fd.append('final', '1');
+  return fetch('/api/transcribe/segment', { method: 'POST', body: fd });
+}
+
+// Close the current segment and continue recording into a new one
+function rotateSegment() {
+  const session = micSession;
+  if (!recording || !mediaRecorder || !session || session.rotating) return;
+  const prev = mediaRecorder;
+  mediaRecorder = startSegment();
+  prev.stop();
+  // Stopping waits for this, so the upload is queued before the final segment is sent
+  session.rotating = prev.stopped.then((blob) => {
+    session.uploads.push(uploadSegment(session, prev.index, blob));
+    session.rotating = null;
+  });
+}
 
 async function startRecording() {
   // Request mic
-  const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
+  micStream = await navigator.mediaDevices.getUserMedia({ audio: true });
   micChunks = [];
-  mediaRecorder = new MediaRecorder(stream, { mimeType: 'audio/webm' });
-  mediaRecorder.ondataavailable = (e) => { if (e.data && e.data.size) micChunks.push(e.data); };
-  mediaRecorder.start();
+  if (MIC_SEGMENT_MS > 0) {
+    micSession = { id: crypto.randomUUID(), index: 0, uploads: [], timer: null, rotating: null };
+    mediaRecorder = startSegment();
+    micSession.timer = setInterval(rotateSegment, MIC_SEGMENT_MS);
+  } else {
+    mediaRecorder = new MediaRecorder(micStream, { mimeType: 'audio/webm' });
+    mediaRecorder.ondataavailable = (e) => { if (e.data && e.data.size) micChunks.push(e.data); };
+    mediaRecorder.start();
+  }
   recording = true;
   micBtn?.classList.add('pulsing');
 }
@@ -219,17 +257,30 @@ function stopTracks(stream) {
   try { stream.getTracks().forEach(t => t.stop()); } catch (_){}
 }
 
-async function stopRecordingAndTranscribe() {
-  if (!mediaRecorder) return;
+// Stop recording and return the server's response with the transcript
+async function finishRecording() {
+  const stream = micStream;
+  const session = micSession;
+  if (session) {
+    clearInterval(session.timer);
+    recording = false;
+    // Let a rotation in progress queue its upload, then close the last segment
+    if (session.rotating) await session.rotating;
+    const rec = mediaRecorder;
+    rec.stop();
+    const last = await rec.stopped;
+    stopTracks(stream);
+    // Earlier segments must have arrived before the final one is sent
+    await Promise.all(session.uploads);
+    return uploadSegment(session, rec.index, last, true);
+  }
 
-  const stream = mediaRecorder.stream;
   const done = new Promise((resolve) => {
     mediaRecorder.onstop = resolve;
   });
   mediaRecorder.stop();
   await done;
   recording = false;
-  micBtn?.classList.remove('pulsing');
 
   // Build a single Blob from chunks
   const blob = new Blob(micChunks, { type: 'audio/webm' });
@@ -238,9 +289,15 @@ async function stopRecordingAndTranscribe() {
   // Upload to backend for Whisper
   const fd = new FormData();
   fd.append('file', blob, 'input.webm');
+  return fetch('/api/transcribe', { method: 'POST', body: fd });
+}
+
+async function stopRecordingAndTranscribe() {
+  if (!mediaRecorder) return;
+  micBtn?.classList.remove('pulsing');
 
   try {
-    const res = await fetch('/api/transcribe', { method: 'POST', body: fd });
+    const res = await finishRecording();
     const data = await res.json();
     if (!res.ok || !data || typeof data.text !== 'string') {
       throw new Error(data?.error || 'Transcription failed');
@@ -260,6 +317,8 @@ async function stopRecordingAndTranscribe() {
   } finally {
     mediaRecorder = null;
     micChunks = [];
+    micStream = null;
+    micSession = null;
   }
 }
 
@@ -324,7 +383,7 @@ function activityBox(a){
   analysisWrap.className = 'act-analysis';
   analysisWrap.textContent = ''; // will fill later
 
-  // Handle analyze click: ensure map is on this route, export PNG, call backend, show result
+  // Handle analyze click: show this route on the map and ask the backend (which renders its own image)
   analyze.addEventListener('click', async (ev) => {
     ev.stopPropagation();
     analyze.disabled = true;
@@ -334,19 +393,14 @@ function activityBox(a){
     analyze.setAttribute('aria-busy','true');
 
     try{
-      // If not selected, select it so the map shows the same route
+      // If not selected, select it so the map shows the same route (no need to wait for tiles)
       const ridNow = w.getAttribute('data-route-id');
-      const wasSelected = (selectedRouteId === ridNow);
-      if (ridNow && !wasSelected) toggleSelect(ridNow);
-      if (!wasSelected) await waitForMapLoad();
-
-      // Ask the iframe to export current map view
-      const dataURL = await requestMapPng();
+      if (ridNow && selectedRouteId !== ridNow) toggleSelect(ridNow);
 
       // Build request payload for the server
-      let payload = { name: a.name || 'Activity', image_data_url: dataURL };
-      if (a.kind === 'strava') { payload.kind = 'strava'; payload.id = a.id; }
-      else { payload.kind = 'generated'; payload.coords = a.coords || []; payload.distance = a.distance; }
+      let payload = { name: a.name || 'Activity', route_id: rid, kind: a.kind };
+      if (a.kind === 'strava') payload.id = a.id;
+      else payload.distance = a.distance;
 
       // Call backend to analyze
       const res = await fetch('/api/analyze_activity', {
@@ -414,8 +468,87 @@ function hideSuggestions() {
 }
 
 
+// === Streaming chat ===
+// Read a Server-Sent Events response, calling onEvent(name, data) per event
+async function readEventStream(res, onEvent){
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = '';
+  for(;;){
+    const { value, done } = await reader.read();
+    if (done) break;
+    buf += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buf.indexOf('\n\n')) >= 0){
+      const frame = buf.slice(0, sep);
+      buf = buf.slice(sep + 2);
+      let event = 'message', data = '';
+      frame.split('\n').forEach(line=>{
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      });
+      if (data) onEvent(event, JSON.parse(data));
+    }
+  }
+}
+
+// Build route cards after the summary bubble and show the first route
+function renderRunResults(data, after) {
+  // Build activity cards (collapsed to 3 by default)
+  let last = after;
+  const place = (node) => { last.after(node); last = node; };
+  if (Array.isArray(data.results) && data.results.length) {
+    const group = document.createElement('div');
+    group.className = 'activity-group';
+    const boxes = data.results.map(r=>{
+      registerRoute(r);
+      return activityBox(r);
+    });
+
+    // Initially show up to 3
+    const initial = Math.min(3, boxes.length);
+    boxes.forEach((box, i)=>{
+      if(i >= initial) box.classList.add('hidden');
+      group.appendChild(box);
+    });
+    place(group);
+
+    // "Show all / Hide" toggle if there are more than 3
+    if (boxes.length > 3) {
+      const toggle = document.createElement('button');
+      toggle.className = 'activity-toggle';
+      const total = data.count ?? boxes.length;
+      const setText = (expanded) => {
+        toggle.textContent = expanded ? 'Hide activities' : `Show all ${total} activities`;
+        toggle.setAttribute('aria-expanded', expanded ? 'true' : 'false');
+      };
+      setText(false);
+      toggle.addEventListener('click', ()=>{
+        const expanded = toggle.getAttribute('aria-expanded') === 'true';
+        if(expanded){
+          boxes.forEach((b,i)=>{ if(i>=initial) b.classList.add('hidden'); });
+          setText(false);
+        }else{
+          boxes.forEach((b)=> b.classList.remove('hidden'));
+          setText(true);
+        }
+      });
+      place(toggle);
+    }
+  }
+
+  // Auto-select first route if provided, otherwise clear the map
+  if (data.auto_select_route_id) {
+    toggleSelect(data.auto_select_route_id);
+  } else {
+    selectedRouteId = null;
+    clearMap();
+  }
+}
+
+
 // === Shared send function (form + suggestions) ===
-// Handle sending a user message, calling backend, and rendering results
+// Handle sending a user message, calling backend, and rendering results as they stream in
 async function sendMessage(userMsg) {
   if (pending || !userMsg) return;
   hideSuggestions();
@@ -424,92 +557,50 @@ async function sendMessage(userMsg) {
   input.readOnly = true;
   updateSendDisabled();
 
-  // Add user message and a temporary "Thinking..." bubble
+  // Add user message and a "Thinking..." bubble that becomes the reply
   const userNode = msgBubble(userMsg, 'user'),
-    thinking = msgBubble('Thinking...', 'bot');
+    reply = msgBubble('Thinking...', 'bot');
   out.appendChild(userNode);
-  out.appendChild(thinking);
+  out.appendChild(reply);
 
   try {
-    // Call backend chat router
-    const res = await fetch('/api/chat', {
+    // Call backend chat router (streamed)
+    const res = await fetch('/api/chat/stream', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ message: userMsg }),
     });
-    const data = await res.json();
-    thinking.remove();
 
     // Error from server
     if (!res.ok) {
-      out.appendChild(msgBubble(`Error: ${data.error || 'Unknown error'}`));
+      const data = await res.json().catch(()=>({}));
+      reply.textContent = `Error: ${data.error || 'Unknown error'}`;
       return;
     }
 
-    // Run mode -> show summary + route cards + map
-    if (data.mode === 'run') {
-      out.appendChild(msgBubble(data.response || '—', 'bot'));
-
-      // Build activity cards (collapsed to 3 by default)
-      if (Array.isArray(data.results) && data.results.length) {
-        const group = document.createElement('div');
-        group.className = 'activity-group';
-        const boxes = data.results.map(r=>{
-          registerRoute(r);
-          return activityBox(r);
-        });
-
-        // Initially show up to 3
-        const initial = Math.min(3, boxes.length);
-        boxes.forEach((box, i)=>{
-          if(i >= initial) box.classList.add('hidden');
-          group.appendChild(box);
-        });
-        out.appendChild(group);
-
-        // "Show all / Hide" toggle if there are more than 3
-        if (boxes.length > 3) {
-          const toggle = document.createElement('button');
-          toggle.className = 'activity-toggle';
-          const total = data.count ?? boxes.length;
-          const setText = (expanded) => {
-            toggle.textContent = expanded ? 'Hide activities' : `Show all ${total} activities`;
-            toggle.setAttribute('aria-expanded', expanded ? 'true' : 'false');
-          };
-          setText(false);
-          toggle.addEventListener('click', ()=>{
-            const expanded = toggle.getAttribute('aria-expanded') === 'true';
-            if(expanded){
-              boxes.forEach((b,i)=>{ if(i>=initial) b.classList.add('hidden'); });
-              setText(false);
-            }else{
-              boxes.forEach((b)=> b.classList.remove('hidden'));
-              setText(true);
-            }
-          });
-          out.appendChild(toggle);
-        }
-      }
-
-      // Auto-select first route if provided, otherwise just refresh map
-      if (data.auto_select_route_id) {
-        toggleSelect(data.auto_select_route_id);
-      } else {
-        const src = (data.map || '/static/map.html') + `?ts=${Date.now()}`;
-        mapFrame.src = src;
+    // Routes first, then summary text token by token
+    let shownResults = false, streamed = false;
+    await readEventStream(res, (event, data) => {
+      if (event === 'results' && data.mode === 'run') {
+        renderRunResults(data, reply);
+        shownResults = true;
+      } else if (event === 'delta') {
+        if (!streamed) reply.textContent = '';
+        streamed = true;
+        reply.textContent += data.text;
+      } else if (event === 'done') {
+        reply.textContent = data.response || '—';
+        if (data.mode === 'run' && !shownResults) renderRunResults(data, reply);
+      } else if (event === 'error') {
+        reply.textContent = `Error: ${data.error || 'Unknown error'}`;
       }
-    } else {
-      // Plain chat response
-      out.appendChild(msgBubble(data.response || '—', 'bot'));
-    }
-
-    // Keep scroll at bottom
-    out.scrollTop = out.scrollHeight;
+      // Keep scroll at bottom
+      out.scrollTop = out.scrollHeight;
+    });
 
   } catch (err) {
     // Network/other errors
-    thinking.remove();
-    out.appendChild(msgBubble(`Error: ${err.message}`, 'bot'));
+    reply.textContent = `Error: ${err.message}`;
   } finally {
     // Reset input state
     pending = false;
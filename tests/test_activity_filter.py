@@ -0,0 +1,53 @@
+import numpy as np
+
+from functions.activity_filter import FILTER_TOLERANCES, GRID_DEG, ActivityTable, haversine_km
+
+
+UPPSALA = (59.8586, 17.6389)
+
+
+def _run(i, latlng=UPPSALA, **fields):
+    base = {"id": i, "distance": 5000.0, "total_elevation_gain": 40.0, "moving_time": 1500.0, "average_speed": 3.3,
+            "average_heartrate": 150.0, "start_latlng": list(latlng)}
+    return {**base, **fields}
+
+
+def test_radius_only_query_keeps_runs_with_missing_values():
+    flat, no_hr, no_coords = _run(1, total_elevation_gain=0), _run(2, average_heartrate=None), _run(3, start_latlng=[])
+    # What filter_activities(activities, {}, center=...) asks for in the history fallback
+    rows = ActivityTable([flat, no_hr, no_coords]).query(dict.fromkeys(FILTER_TOLERANCES), UPPSALA)
+    assert rows.tolist() == [0, 1]
+
+
+def test_missing_value_only_excludes_queries_on_that_field():
+    table = ActivityTable([_run(1, total_elevation_gain=0), _run(2)])
+    assert table.query({"distance": 5000}).tolist() == [0, 1]
+    assert table.query({"elevation_gain": 40}).tolist() == [1]
+
+
+def test_within_radius_matches_brute_force():
+    rng = np.random.default_rng(0)
+    points = np.column_stack((rng.uniform(59.0, 61.0, 3000), rng.uniform(16.0, 19.5, 3000)))
+    table = ActivityTable([_run(i, latlng=p) for i, p in enumerate(points.tolist())])
+    for lat, lon, radius in [(*UPPSALA, 15.0), (60.0, 17.0, 40.0), (59.5, 18.0, 0.5), (62.5, 17.0, 10.0)]:
+        expected = np.flatnonzero(haversine_km(lat, lon, points[:, 0], points[:, 1]) <= radius)
+        assert table.within_radius(lat, lon, radius).tolist() == expected.tolist()
+
+
+def test_radius_reaches_across_grid_cells():
+    # Both runs are ~1 km from the centre but in neighbouring cells (and across the prime meridian)
+    edge = 60 * GRID_DEG
+    table = ActivityTable([_run(1, latlng=(edge + 0.009, 0.005)), _run(2, latlng=(edge - 0.009, -0.005)),
+                           _run(3, latlng=(edge + 0.2, 0.0))])
+    assert table.within_radius(edge, 0.0, 2.0).tolist() == [0, 1]
+    assert table.within_radius(edge, 0.0, 30.0).tolist() == [0, 1, 2]
+
+
+def test_query_combines_targets_and_centre():
+    stockholm = (59.3293, 18.0686)
+    runs = [_run(1), _run(2, distance=10000.0), _run(3, latlng=stockholm), _run(4, latlng=(59.9, 17.7))]
+    table = ActivityTable(runs)
+    assert table.query({"distance": 5000}, UPPSALA).tolist() == [0, 3]
+    assert table.query({"distance": 5000}, UPPSALA, radius_km=2.0).tolist() == [0]
+    assert table.query({"distance": 5000}, stockholm).tolist() == [2]
+    assert table.query({"distance": 10000}).tolist() == [1]
@@ -0,0 +1,68 @@
+import pytest
+
+from functions import activity_store
+from functions.activity_store import load_activities, sync_activities
+
+
+def _activity(i, day, name=None):
+    return {"id": i, "name": name or f"Run {i}", "start_date": f"2024-05-{day:02d}T07:00:00Z", "distance": 5000.0}
+
+
+@pytest.fixture
+def strava(monkeypatch):
+    """Fake Strava listing: set .activities; records the after= cursor of each call."""
+    class Fake:
+        activities, afters = [], []
+    def fetch(token_file, client_id, client_secret, after=None):
+        Fake.afters.append(after)
+        return [a for a in Fake.activities if after is None or activity_store._start_ts(a) > after]
+    monkeypatch.setattr(activity_store, "get_all_strava_activities", fetch)
+    return Fake
+
+
+def test_first_sync_backfills_everything(tmp_path, strava):
+    db = str(tmp_path / "activities.db")
+    strava.activities = [_activity(1, 1), _activity(2, 2)]
+    changes = sync_activities(db, "tokens.json", "id", "secret")
+    assert sorted(changes["added"]) == [1, 2] and strava.afters == [None]
+    assert [a["id"] for a in load_activities(db)] == [2, 1]
+
+
+def test_incremental_sync_finds_new_edited_and_deleted(tmp_path, strava):
+    db = str(tmp_path / "activities.db")
+    strava.activities = [_activity(1, 1), _activity(2, 10), _activity(3, 12)]
+    sync_activities(db, "tokens.json", "id", "secret")
+    strava.activities = [_activity(1, 1), _activity(2, 10, "Renamed"), _activity(4, 13)]
+    changes = sync_activities(db, "tokens.json", "id", "secret", force=True)
+    assert changes == {"added": [4], "updated": [2], "deleted": [3], "reshaped": []}
+    assert strava.afters[-1] is not None
+    assert {a["id"]: a["name"] for a in load_activities(db)} == {1: "Run 1", 2: "Renamed", 4: "Run 4"}
+
+
+def test_sync_is_skipped_within_the_interval(tmp_path, strava):
+    db = str(tmp_path / "activities.db")
+    strava.activities = [_activity(1, 1)]
+    sync_activities(db, "tokens.json", "id", "secret")
+    strava.activities = [_activity(1, 1), _activity(2, 2)]
+    assert not any(sync_activities(db, "tokens.json", "id", "secret").values())
+    assert len(strava.afters) == 1
+
+
+def test_load_is_cached_until_the_store_changes(tmp_path, strava):
+    db = str(tmp_path / "activities.db")
+    strava.activities = [_activity(1, 1)]
+    sync_activities(db, "tokens.json", "id", "secret")
+    first = load_activities(db)
+    assert load_activities(db) is first
+    strava.activities = [_activity(1, 1), _activity(2, 2)]
+    sync_activities(db, "tokens.json", "id", "secret", force=True)
+    assert len(load_activities(db)) == 2
+
+
+def test_only_route_or_stat_edits_reshape(tmp_path, strava):
+    db = str(tmp_path / "activities.db")
+    strava.activities = [_activity(1, 10), _activity(2, 11)]
+    sync_activities(db, "tokens.json", "id", "secret")
+    strava.activities = [{**_activity(1, 10), "kudos_count": 3}, {**_activity(2, 11), "distance": 5200.0}]
+    changes = sync_activities(db, "tokens.json", "id", "secret", force=True)
+    assert changes["updated"] == [1, 2] and changes["reshaped"] == [2]
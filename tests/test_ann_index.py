@@ -0,0 +1,78 @@
+import numpy as np
+
+from functions.ann_index import TRAIN_MIN, IVFIndex
+
+
+def _unit(rng, n, dim=8):
+    v = rng.normal(size=(n, dim)).astype(np.float32)
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def _filled(n, dim=8, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = _unit(rng, n, dim)
+    index = IVFIndex(dim)
+    meta = {"start_ts": np.arange(n, dtype=np.float64), "distance": rng.uniform(1000, 20000, n)}
+    index.add(range(n), vectors, meta=meta, hashes=[f"h{i}" for i in range(n)])
+    return index, vectors, meta
+
+
+def test_small_index_search_is_exact():
+    index, vectors, _ = _filled(50)
+    q = vectors[7]
+    ids, scores = index.search(q, k=5)
+    expected = np.argsort(-(vectors @ q), kind="stable")[:5]
+    assert ids.tolist() == expected.tolist()
+    assert np.allclose(scores, (vectors @ q)[expected])
+    assert index.centroids is None and len(index) == 50
+
+
+def test_trained_index_matches_exact_search_when_probing_every_list():
+    index, vectors, _ = _filled(TRAIN_MIN * 2)
+    assert index.centroids is not None and index.n_sorted == index.size
+    q = vectors[123]
+    ids, _ = index.search(q, k=10, n_probe=len(index.centroids))
+    assert ids.tolist() == np.argsort(-(vectors @ q))[:10].tolist()
+    assert index.search(q, k=1)[0][0] == 123
+
+
+def test_add_replaces_and_remove_deletes():
+    index, vectors, _ = _filled(TRAIN_MIN + 100)
+    fresh = -vectors[5]
+    index.add([5], fresh[None], meta={"start_ts": [1.0], "distance": [5000.0]}, hashes=["new"])
+    assert len(index) == TRAIN_MIN + 100 and index.hashes[5] == "new"
+    assert index.search(fresh, k=1, n_probe=len(index.centroids))[0][0] == 5
+    assert 5 not in index.search(vectors[5], k=20, n_probe=len(index.centroids))[0].tolist()
+
+    index.remove([5, 6])
+    assert len(index) == TRAIN_MIN + 98 and 5 not in index.hashes
+    found = index.search(vectors[6], k=len(index), n_probe=len(index.centroids))[0].tolist()
+    assert 5 not in found and 6 not in found and len(found) == len(index)
+
+
+def test_filters_keep_only_rows_in_range():
+    index, vectors, meta = _filled(TRAIN_MIN * 2)
+    ids, _ = index.search(vectors[0], k=20, filters={"distance": (4000, 6000), "start_ts": (100, None)})
+    assert len(ids) == 20
+    for i in ids.tolist():
+        assert 4000 <= meta["distance"][i] <= 6000 and meta["start_ts"][i] >= 100
+
+    # Rows without metadata never match a range
+    index.add([10**6], vectors[:1], hashes=["x"])
+    assert 10**6 not in index.search(vectors[0], k=50, filters={"distance": (0, None)})[0].tolist()
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index, vectors, _ = _filled(TRAIN_MIN * 2)
+    index.remove([3])
+    path = str(tmp_path / "sub" / "index.npz")
+    index.save(path)
+    loaded = IVFIndex.load(path)
+    assert len(loaded) == len(index) and loaded.hashes == index.hashes
+    assert np.array_equal(loaded.centroids, index.centroids)
+    for q in vectors[:5]:
+        for filters in (None, {"distance": (5000, 15000)}):
+            a, sa = index.search(q, k=10, filters=filters)
+            b, sb = loaded.search(q, k=10, filters=filters)
+            assert a.tolist() == b.tolist() and np.allclose(sa, sb)
+    assert 3 not in loaded.positions
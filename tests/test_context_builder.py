@@ -0,0 +1,78 @@
+from functions.context_builder import (ROLLUP_PREFIX, activity_detail_text, activity_table, coords_text, count_tokens,
+                                       fit_messages, rollup, truncate_to_tokens)
+
+
+DETAIL = {
+    "name": "Morning Run", "distance": 10234.5, "moving_time": 3100, "average_speed": 3.3,
+    "map": {"polyline": "x" * 5000}, "segment_efforts": [{"name": "hill"}] * 50,
+    "splits_metric": [{"split": 1, "moving_time": 300, "average_speed": 3.33, "elevation_difference": 2.1}],
+}
+
+
+def _messages(n, words=100):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i} " + "blah " * words} for i in range(n)]
+
+
+def test_detail_keeps_used_fields_and_drops_the_rest():
+    text = activity_detail_text(DETAIL)
+    assert "name: Morning Run" in text
+    assert "moving_time: 0:51:40" in text
+    assert "polyline" not in text and "hill" not in text
+    assert "Per-km splits:" in text
+
+
+def test_detail_without_splits():
+    text = activity_detail_text(DETAIL, splits=False)
+    assert "Per-km splits" not in text
+    assert "name: Morning Run" in text
+
+
+def test_detail_respects_budget():
+    assert count_tokens(activity_detail_text({**DETAIL, "description": "word " * 2000}, budget=50)) <= 52
+
+
+def test_activity_table_skips_empty_columns_and_cuts_at_budget():
+    rows = [{"name": f"Run {i}", "distance": 5000 + i, "moving_time": 1500} for i in range(200)]
+    text = activity_table(rows, budget=100)
+    assert text.splitlines()[0] == "name | km | time"
+    assert text.splitlines()[-1].endswith("more not shown")
+    assert count_tokens(text) <= 120
+
+
+def test_coords_text_thins_evenly_and_keeps_endpoints():
+    coords = [(59.85 + i * 1e-4, 17.63) for i in range(1000)]
+    points = coords_text(coords, budget=100).split(";")
+    assert 2 <= len(points) < 1000
+    assert points[0] == "59.8500,17.6300" and points[-1] == "59.9499,17.6300"
+
+
+def test_truncate_marks_the_cut():
+    assert truncate_to_tokens("short", 10) == "short"
+    assert truncate_to_tokens("word " * 1000, 20).endswith("[...]")
+
+
+def test_fit_messages_keeps_last_and_rolls_up_older_as_system():
+    msgs = _messages(20) + [{"role": "user", "content": "5k in Lund"}]
+    fitted = fit_messages(msgs, 1000)
+    assert fitted[-1] == msgs[-1]
+    assert fitted[0]["role"] == "system"
+    assert fitted[0]["content"].startswith(ROLLUP_PREFIX)
+    assert "user: message" in fitted[0]["content"] or "assistant: message" in fitted[0]["content"]
+    assert sum(count_tokens(m["content"]) + 4 for m in fitted) <= 1000
+
+
+def test_fit_messages_leaves_short_history_alone():
+    msgs = _messages(4, words=3)
+    assert fit_messages(msgs, 1000) == msgs
+
+
+def test_fit_messages_truncates_an_oversized_last_message():
+    fitted = fit_messages([{"role": "user", "content": "word " * 5000}], 100)
+    assert len(fitted) == 1 and count_tokens(fitted[0]["content"]) <= 100
+
+
+def test_rollup_merges_an_earlier_rollup():
+    first = rollup(_messages(2, words=3))
+    second = rollup([first] + _messages(2, words=3))
+    assert second["content"].count(ROLLUP_PREFIX) == 1
+    assert second["content"].count("message 0") == 2
@@ -0,0 +1,38 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+
+from functions.embedding_store import EmbeddingStore
+
+
+class FakeEmbeddings:
+    """Embeds a text as [len(text), 1, 0] and counts the texts it was asked for."""
+    def __init__(self):
+        self.embedded = []
+        self.embeddings = self
+
+    def create(self, model, input):
+        self.embedded.extend(input)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[float(len(t)), 1.0, 0.0]) for t in input])
+
+
+def test_rows_are_stored_unit_length(tmp_path):
+    matrix = EmbeddingStore(str(tmp_path)).vectors(FakeEmbeddings(), [1, 2], ["a", "bbbb"])
+    assert np.allclose(np.linalg.norm(matrix, axis=1), 1)
+
+
+def test_only_new_or_changed_texts_are_embedded(tmp_path):
+    client = FakeEmbeddings()
+    EmbeddingStore(str(tmp_path)).lookup(client, [1, 2], ["a", "bb"])
+    reopened = EmbeddingStore(str(tmp_path))
+    reopened.lookup(client, [1, 2, 3], ["a", "changed", "c"])
+    assert client.embedded == ["a", "bb", "changed", "c"]
+
+
+def test_forget_drops_ids_from_the_saved_index(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.lookup(FakeEmbeddings(), [1, 2], ["a", "b"])
+    store.forget([1])
+    with open(store.index_path) as f:
+        assert list(json.load(f)["items"]) == ["2"]
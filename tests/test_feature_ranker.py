@@ -0,0 +1,22 @@
+from functions.feature_ranker import numeric_scores
+
+
+def _run(hour, day="2024-05-01"):
+    return {"distance": 5000, "start_date": f"{day}T{hour:02d}:00:00Z", "start_date_local": f"{day}T{hour:02d}:00:00Z"}
+
+
+RUNS = [_run(7), _run(12), _run(19)]
+
+
+def test_time_of_day_prefers_runs_near_the_hour():
+    scores = numeric_scores(RUNS, {"distance": 5000, "time_of_day": 18.5})
+    assert scores.argmin() == 2
+
+
+def test_time_of_day_wraps_around_midnight():
+    scores = numeric_scores([_run(1), _run(12)], {"time_of_day": 23})
+    assert scores[0] < scores[1]
+
+
+def test_negative_time_of_day_means_not_given():
+    assert (numeric_scores(RUNS, {"distance": 5000, "time_of_day": -1}) == numeric_scores(RUNS, {"distance": 5000})).all()
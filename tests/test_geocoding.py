@@ -0,0 +1,34 @@
+import pytest
+
+from functions import geocoding
+from functions.geocoding import geocode_city
+
+
+@pytest.fixture
+def offline(tmp_path, monkeypatch):
+    # Empty caches and no Nominatim: only the bundled gazetteer answers
+    def unreachable(city):
+        raise OSError("offline")
+    monkeypatch.setattr(geocoding, "GEOCODE_CACHE_FILE", str(tmp_path / "geocode.json"))
+    monkeypatch.setattr(geocoding, "_nominatim", unreachable)
+    monkeypatch.setattr(geocoding, "_MEMORY", type(geocoding._MEMORY)())
+    monkeypatch.setitem(geocoding._STATE, "disk", None)
+
+
+def test_bare_name_uses_the_gazetteer(offline):
+    assert geocode_city("Paris") == pytest.approx((48.85, 2.35), abs=0.01)
+
+
+@pytest.mark.parametrize("city", ["Uppsala, Sweden", "uppsala, SE", "Uppsala,  sverige, Sweden"])
+def test_qualifier_matching_the_place(offline, city):
+    assert geocode_city(city) == pytest.approx((59.86, 17.64), abs=0.01)
+
+
+def test_qualifier_for_another_place_is_not_the_bare_name(offline):
+    assert geocode_city("Paris, Texas") is None
+
+
+def test_qualified_name_goes_to_nominatim(offline, monkeypatch):
+    monkeypatch.setattr(geocoding, "_nominatim", lambda city: (33.66, -95.56))
+    assert geocode_city("Paris, Texas") == (33.66, -95.56)
+    assert geocode_city("Paris") == pytest.approx((48.85, 2.35), abs=0.01)
@@ -0,0 +1,17 @@
+import pytest
+
+pytest.importorskip("osmnx")
+
+from functions.graph_cache import TILE_DEG, tile_bounds, tiles_for_area  # noqa: E402
+
+
+def test_tile_bounds_cover_only_the_tile_plus_overlap():
+    west, south, east, north = tile_bounds((598, 176), pad_m=150)
+    assert south == pytest.approx(59.8 - 150 / 111_320) and north == pytest.approx(59.9 + 150 / 111_320)
+    # At 60 N the padding in longitude is about twice that in latitude, and the box stays close to one tile wide
+    assert east - west == pytest.approx(TILE_DEG + 2 * 150 / (111_320 * 0.5), rel=0.01)
+
+
+def test_tiles_for_area_spans_the_square():
+    tiles = tiles_for_area((59.85, 17.65), 3000)
+    assert (598, 176) in tiles and len(tiles) == len(set(tiles))
@@ -0,0 +1,109 @@
+import json
+import pytest
+
+from functions import intent_classifier
+from functions.intent_classifier import INTENTS, INTENT_THRESHOLD, classify_intent, extract_slots, log_router_decision
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    # No saved model: the classifier starts from the seed phrases
+    return str(tmp_path / "intent_model.json")
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("find me a 5k run in Uppsala", "suggest_run"),
+    ("show me my runs in Stockholm", "suggest_run"),
+    ("ok, generate a 10 km loop in Lund", "generate_new_route"),
+    ("make me a 5k loop in Malmö", "generate_new_route"),
+    ("thanks!", "enable_chat"),
+    ("thanks a lot!", "enable_chat"),
+])
+def test_clear_requests_skip_the_router(model_path, text, intent):
+    result = classify_intent(text, model_path=model_path)
+    assert result["intent"] == intent
+    assert result["confidence"] >= INTENT_THRESHOLD
+    assert result["decision"] == {c: c == intent for c in intent_classifier.INTENTS}
+
+
+@pytest.mark.parametrize("text", [
+    "Show me how to stretch after runs",
+    "Any tips for hill runs?",
+    "Give me advice on my long runs",
+    "How do I make my runs more fun?",
+    "Thanks! Now a 5k in Lund please",
+])
+def test_weak_evidence_goes_to_the_router(model_path, text):
+    assert classify_intent(text, model_path=model_path)["confidence"] < INTENT_THRESHOLD
+
+
+def test_slots_fill_route_info_for_simple_messages(model_path):
+    result = classify_intent("find me a 5k run in Uppsala", model_path=model_path)
+    assert result["route_info"]["distance"] == 5000
+    assert result["route_info"]["city"] == "Uppsala"
+    assert result["generate_info"] == {"distance": 5000, "city": "Uppsala"}
+
+
+def test_other_numbers_leave_extraction_to_the_llm(model_path):
+    result = classify_intent("find a 10 km run with 150 m of climbing", model_path=model_path)
+    assert result["route_info"] is None
+
+
+def test_history_without_a_city_leaves_extraction_to_the_llm(model_path):
+    result = classify_intent("find me a 5k run", has_history=True, model_path=model_path)
+    assert result["route_info"] is None
+
+
+@pytest.mark.parametrize("text, metres", [("5k", 5000), ("10 km", 10000), ("3 miles", 4828.032), ("half marathon", 21097.5)])
+def test_extract_distance(text, metres):
+    assert extract_slots(f"a {text} run")["distance"] == pytest.approx(metres)
+
+
+def test_router_log_retrains_every_n_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(intent_classifier, "RETRAIN_EVERY", 5)
+    log_path, model_path = str(tmp_path / "log.jsonl"), str(tmp_path / "model.json")
+    for i in range(7):
+        log_router_decision(f"message {i}", {"enable_chat": True, "suggest_run": False}, log_path, model_path)
+    with open(log_path, encoding="utf-8") as f:
+        assert [json.loads(line)["intent"] for line in f] == ["enable_chat"] * 7
+    assert intent_classifier.get_intent_model(model_path).trained_on == 5
+
+
+def test_time_of_day_leaves_extraction_to_the_llm(model_path):
+    result = classify_intent("find me a 5k evening run in Uppsala", model_path=model_path)
+    assert result["route_info"] is None
+    assert result["generate_info"] == {"distance": 5000, "city": "Uppsala"}
+
+
+def test_simple_route_info_has_no_time_of_day(model_path):
+    assert classify_intent("find me a 5k run in Uppsala", model_path=model_path)["route_info"]["time_of_day"] == -1
+
+
+def test_probabilities_cover_every_intent(model_path):
+    result = classify_intent("how do I improve my pace?", model_path=model_path)
+    assert set(result["probabilities"]) == set(INTENTS)
+    assert sum(result["probabilities"].values()) == pytest.approx(1, abs=0.01)
+    assert result["probabilities"]["suggest_run"] < 0.1
+
+
+def test_rule_raises_its_intent_probability(model_path):
+    result = classify_intent("find me a route", model_path=model_path)
+    assert result["probabilities"]["suggest_run"] >= INTENT_THRESHOLD
+
+
+@pytest.mark.parametrize("text", ["generate a new route", "generate a 10 km loop", "make me a new loop in Uppsala"])
+def test_generating_without_distance_and_city_asks_the_router(model_path, text):
+    result = classify_intent(text, model_path=model_path)
+    assert result["generate_info"] is None
+    assert result["confidence"] < INTENT_THRESHOLD
+
+
+@pytest.mark.parametrize("text", ["find me a 5k run in paris texas", "find me a 5k run in Paris, Texas"])
+def test_qualified_place_leaves_the_city_to_the_llm(model_path, text):
+    assert extract_slots(text)["city"] is None
+    result = classify_intent(text, model_path=model_path)
+    assert result["route_info"] is None and result["generate_info"] is None
+
+
+def test_filler_after_the_place_keeps_the_city():
+    assert extract_slots("find me a 5k run in Uppsala please")["city"] == "Uppsala"
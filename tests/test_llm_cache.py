@@ -0,0 +1,73 @@
+import threading, time
+from collections import OrderedDict
+
+import pytest
+
+from functions import llm_cache
+from functions.llm_cache import cache_key, cached_response, llm_cache_stats
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(llm_cache, "_MEMORY", OrderedDict())
+    monkeypatch.setattr(llm_cache, "_STATS", {})
+    monkeypatch.setitem(llm_cache._DISK, "bytes", None)
+
+
+def test_key_ignores_argument_order():
+    assert cache_key(a=1, b=[1, 2]) == cache_key(b=[1, 2], a=1) != cache_key(a=2, b=[1, 2])
+
+
+def test_memory_then_disk_hits(monkeypatch):
+    calls = []
+    compute = lambda: calls.append(1) or {"answer": 42}
+    assert cached_response("analysis", "k1", compute) == {"answer": 42}
+    assert cached_response("analysis", "k1", compute) == {"answer": 42}
+    monkeypatch.setattr(llm_cache, "_MEMORY", OrderedDict())
+    assert cached_response("analysis", "k1", compute) == {"answer": 42}
+    assert len(calls) == 1
+    assert llm_cache_stats()["calls"]["analysis"] == {"memory_hits": 1, "disk_hits": 1, "misses": 1, "coalesced": 0}
+
+
+def test_hits_are_copies():
+    cached_response("analysis", "k2", lambda: {"items": [1]})
+    cached_response("analysis", "k2", lambda: None)["items"].append(2)
+    assert cached_response("analysis", "k2", lambda: None) == {"items": [1]}
+
+
+def test_concurrent_misses_share_one_compute():
+    started, release, calls = threading.Event(), threading.Event(), []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"answer": len(calls)}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cached_response("analysis", "k3", compute)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(cached_response("analysis", "k3", compute))) for _ in range(3)]
+    for t in followers:
+        t.start()
+    time.sleep(0.05)
+    release.set()
+    for t in [leader] + followers:
+        t.join(5)
+    assert calls == [1] and results == [{"answer": 1}] * 4
+    assert llm_cache_stats()["calls"]["analysis"]["coalesced"] == 3
+
+
+def test_failed_compute_is_not_cached():
+    with pytest.raises(RuntimeError):
+        cached_response("analysis", "k4", lambda: (_ for _ in ()).throw(RuntimeError("api down")))
+    assert cached_response("analysis", "k4", lambda: "ok") == "ok"
+
+
+def test_disk_tier_is_pruned(monkeypatch):
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_DISK_BYTES", 2000)
+    for i in range(40):
+        cached_response("analysis", cache_key(i=i), lambda: "x" * 100)
+    assert 0 < llm_cache_stats()["disk_bytes"] <= 2000
@@ -0,0 +1,67 @@
+import numpy as np
+
+from functions.polyline_funcs import decode_polylines
+
+
+# Reference one-string decoder, one character at a time
+def _decode_scalar(polyline_str):
+    coords, index, lat, lon = [], 0, 0, 0
+    while index < len(polyline_str):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                b = ord(polyline_str[index]) - 63
+                index += 1
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat, lon = lat + deltas[0], lon + deltas[1]
+        coords.append((lat / 1e5, lon / 1e5))
+    return coords
+
+
+def _encode(points):
+    out, prev = [], (0, 0)
+    for point in points:
+        ints = tuple(int(round(v * 1e5)) for v in point)
+        for value in (ints[0] - prev[0], ints[1] - prev[1]):
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        prev = ints
+    return "".join(out)
+
+
+def test_known_polyline():
+    decoded = decode_polylines(["_p~iF~ps|U_ulLnnqC_mqNvxq`@"])[0]
+    assert np.allclose(decoded, [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)])
+
+
+def test_batch_matches_scalar_decoder():
+    rng = np.random.default_rng(0)
+    strings = [None, ""]
+    for n in (1, 2, 30, 500):
+        start = rng.uniform((-80, -179), (80, 179))
+        strings.append(_encode(start + np.cumsum(rng.normal(0, 0.01, (n, 2)), axis=0)))
+    strings += ["", None, _encode([(-0.00001, 0.00001)])]
+    decoded = decode_polylines(strings)
+    assert len(decoded) == len(strings)
+    for s, coords in zip(strings, decoded):
+        assert coords.shape == (len(_decode_scalar(s or "")), 2)
+        assert np.allclose(coords.reshape(-1, 2), np.array(_decode_scalar(s or "")).reshape(-1, 2), atol=1e-9)
+
+
+def test_empty_and_invalid_inputs():
+    assert [c.shape for c in decode_polylines([None, ""])] == [(0, 2), (0, 2)]
+    assert decode_polylines([]) == []
+    good = _encode([(59.85, 17.63), (59.86, 17.64)])
+    # Cut mid-value, and cut after a latitude with no longitude
+    truncated, odd = good[:-1], good[:next(i for i, c in enumerate(good) if ord(c) - 63 < 0x20) + 1]
+    decoded = decode_polylines([truncated, good, odd])
+    assert decoded[0].shape == (0, 2) and decoded[2].shape == (0, 2)
+    assert np.allclose(decoded[1], _decode_scalar(good))
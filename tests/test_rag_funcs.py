@@ -0,0 +1,26 @@
+import time
+
+from functions import rag_funcs
+from functions.rag_funcs import embedding_client
+
+
+class FakeClient:
+    def with_options(self, **options):
+        fast = FakeClient()
+        fast.options = options
+        return fast
+
+
+def test_embedding_client_per_mode(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setitem(rag_funcs._API_STATE, "down_until", 0.0)
+    assert embedding_client(client, "numeric") is None
+    assert embedding_client(client, "embedding") is client
+    fast = embedding_client(client, "auto")
+    assert fast.options == {"timeout": rag_funcs.EMBED_TIMEOUT_S, "max_retries": 0}
+
+
+def test_auto_mode_skips_embeddings_while_the_api_is_down(monkeypatch):
+    monkeypatch.setitem(rag_funcs._API_STATE, "down_until", time.time() + 60)
+    assert embedding_client(FakeClient(), "auto") is None
+    assert embedding_client(FakeClient(), "embedding") is not None
@@ -0,0 +1,80 @@
+import pickle
+
+import pytest
+
+from functions import route_engine
+from functions.route_engine import RouteGraph
+
+
+class GridGraph:
+    """Just enough of a networkx graph for RouteGraph: an n x n grid of 100 m streets."""
+    def __init__(self, n=6):
+        self.nodes = {i * n + j: {"y": 59.85 + i * 0.0009, "x": 17.63 + j * 0.0018} for i in range(n) for j in range(n)}
+        self._edges = []
+        for i in range(n):
+            for j in range(n):
+                a = i * n + j
+                if j + 1 < n:
+                    self._edges += [(a, a + 1, 100.0), (a + 1, a, 100.0)]
+                if i + 1 < n:
+                    self._edges += [(a, a + n, 100.0), (a + n, a, 100.0)]
+
+    def edges(self, data=None):
+        return list(self._edges)
+
+
+def test_route_graph_is_symmetric_csr():
+    rg = RouteGraph(GridGraph())
+    assert len(rg) == 36
+    assert rg.symmetric
+    d, _ = rg.shortest_tree(0, 10_000)
+    assert d[35] == 1000.0
+
+
+def test_tree_cache_is_lru(monkeypatch):
+    monkeypatch.setattr(route_engine, "TREE_CACHE_SIZE", 2)
+    rg = RouteGraph(GridGraph())
+    first = rg.shortest_tree(0, 500)
+    rg.shortest_tree(1, 500)
+    assert rg.shortest_tree(0, 500) is first      # hit moves 0 to the newest end
+    rg.shortest_tree(2, 500)                      # evicts 1, not 0
+    assert rg.shortest_tree(0, 500) is first
+    assert [key[0] for key in rg._trees] == [2, 0]
+
+
+def test_route_graph_pickles_without_trees():
+    rg = RouteGraph(GridGraph())
+    rg.shortest_tree(0, 500)
+    copy = pickle.loads(pickle.dumps(rg))
+    assert len(copy) == len(rg) and not copy._trees
+    assert copy.shortest_tree(0, 500)[0][1] == 100.0
+
+
+def test_shared_graph_round_trip():
+    rg = RouteGraph(GridGraph())
+    handle = rg.share()
+    assert rg.share() == handle
+    try:
+        copy = route_engine._attach(handle)
+        assert route_engine._attach(handle) is copy
+        assert len(copy) == len(rg) and copy.symmetric
+        assert (copy.matrix != rg.matrix).nnz == 0
+        assert copy.shortest_tree(0, 10_000)[0][35] == 1000.0
+    finally:
+        route_engine._WORKER.clear()
+        rg.release()
+    with pytest.raises(FileNotFoundError):
+        route_engine._attach(handle)
+
+
+def test_generate_loops_keeps_one_pool_across_graphs():
+    first, second = RouteGraph(GridGraph()), RouteGraph(GridGraph(8))
+    try:
+        loops = route_engine.generate_loops(first, 0, 400, n_candidates=4, top_k=2, budget_s=60)
+        pool = route_engine._POOL["pool"]
+        route_engine.generate_loops(second, 0, 400, n_candidates=4, top_k=2, budget_s=60)
+        assert route_engine._POOL["pool"] is pool
+        assert loops and all(path[0] == path[-1] == 0 for path, _ in loops)
+    finally:
+        first.release()
+        second.release()
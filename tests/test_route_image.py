@@ -0,0 +1,29 @@
+import numpy as np
+
+from functions import route_image
+
+
+COORDS = np.column_stack([59.85 + np.linspace(0, 0.02, 200), 17.63 + np.sin(np.linspace(0, 6, 200)) * 0.01])
+
+
+def test_render_returns_png_with_profile():
+    png = route_image.render_route_png(COORDS, np.linspace(0, 5000, 200), np.linspace(10, 60, 200))
+    assert png.startswith(b"\x89PNG\r\n\x1a\n")
+    height = int.from_bytes(png[20:24], "big")
+    assert height == route_image.TRACK_HEIGHT + route_image.PROFILE_HEIGHT
+
+
+def test_images_are_cached_by_route_and_geometry(tmp_path):
+    first = route_image.get_route_image("r1", COORDS, cache_dir=str(tmp_path))
+    assert route_image.get_route_image("r1", COORDS, cache_dir=str(tmp_path)) is first
+    assert len(list(tmp_path.glob("*.png"))) == 1
+
+
+def test_disk_cache_is_bounded(tmp_path, monkeypatch):
+    one = len(route_image.render_route_png(COORDS))
+    monkeypatch.setattr(route_image, "IMAGE_DISK_BYTES", 3 * one)
+    for i in range(8):
+        route_image.get_route_image(f"bounded-{i}", COORDS + i * 1e-3, cache_dir=str(tmp_path))
+    sizes = [p.stat().st_size for p in tmp_path.glob("*.png")]
+    assert 0 < len(sizes) < 8
+    assert sum(sizes) <= 3 * one * 1.2
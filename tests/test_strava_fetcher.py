@@ -0,0 +1,148 @@
+import json, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytest
+
+from functions import strava_fetcher
+from functions.strava_fetcher import RateLimiter, RateLimitExceeded, SAFETY_MARGIN
+
+
+def test_acquire_counts_tokens():
+    limiter = RateLimiter(short_limit=100, daily_limit=1000)
+    for _ in range(3):
+        limiter.acquire(max_wait=0)
+    assert (limiter.short_used, limiter.daily_used) == (3, 3)
+
+
+def test_acquire_fails_fast_when_quota_is_used_up():
+    limiter = RateLimiter(short_limit=10, daily_limit=1000)
+    for _ in range(10 - SAFETY_MARGIN):
+        limiter.acquire(max_wait=0)
+    start = time.time()
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire(max_wait=1)
+    assert time.time() - start < 0.5
+
+
+def test_exhaust_blocks_the_current_window():
+    limiter = RateLimiter(short_limit=100, daily_limit=1000)
+    limiter.exhaust()
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire(max_wait=0)
+
+
+def test_update_uses_the_tightest_reported_quota():
+    limiter = RateLimiter(short_limit=200, daily_limit=2000)
+    limiter.update({
+        "X-RateLimit-Limit": "200,2000", "X-RateLimit-Usage": "10,100",
+        "X-ReadRateLimit-Limit": "100,1000", "X-ReadRateLimit-Usage": "90,500",
+    })
+    assert (limiter.short_limit, limiter.daily_limit) == (100, 1000)
+    assert (limiter.short_used, limiter.daily_used) == (90, 500)
+
+
+def test_update_never_lowers_local_usage():
+    limiter = RateLimiter(short_limit=200, daily_limit=2000)
+    for _ in range(20):
+        limiter.acquire(max_wait=0)
+    limiter.update({"X-RateLimit-Limit": "200,2000", "X-RateLimit-Usage": "5,5"})
+    assert limiter.short_used == 20
+
+
+def test_api_base_is_read_when_requests_are_made(monkeypatch):
+    monkeypatch.setenv("STRAVA_API_BASE", "http://localhost:9999/api/")
+    assert strava_fetcher._api_base() == "http://localhost:9999/api"
+    monkeypatch.delenv("STRAVA_API_BASE")
+    assert strava_fetcher._api_base() == strava_fetcher.DEFAULT_API_BASE
+
+
+# Local stand-in for the Strava activity list endpoint
+class FakeStrava(BaseHTTPRequestHandler):
+    activities, failures, pages = [], 0, []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: int(v[0]) for k, v in parse_qs(url.query).items()}
+        server = type(self)
+        if url.path != "/api/v3/athlete/activities" or self.headers.get("Authorization") != "Bearer token":
+            return self._reply(404, {})
+        with server.lock:
+            if server.failures:
+                server.failures -= 1
+                return self._reply(429, {"message": "Rate Limit Exceeded"})
+            server.pages.append(query["page"])
+        start = (query["page"] - 1) * query["per_page"]
+        after = query.get("after", -1)
+        listed = [a for a in server.activities if a["start"] > after]
+        self._reply(200, listed[start:start + query["per_page"]])
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-RateLimit-Limit", "200,2000")
+        self.send_header("X-RateLimit-Usage", "0,0")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_strava(monkeypatch):
+    handler = type("Handler", (FakeStrava,), {"activities": [], "failures": 0, "pages": [], "lock": threading.Lock()})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("STRAVA_API_BASE", f"http://127.0.0.1:{server.server_port}/api/v3")
+    monkeypatch.setattr(strava_fetcher, "LIMITER", RateLimiter())
+    yield handler
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_pages_in_order_until_a_short_page(fake_strava):
+    fake_strava.activities = [{"id": i, "start": i} for i in range(23)]
+    activities = strava_fetcher.fetch_activity_pages("token", per_page=5)
+    assert [a["id"] for a in activities] == list(range(23))
+    # Waves of 1, 2 and 4 pages; the wave holding the short page 5 stops the paging
+    assert sorted(fake_strava.pages)[:5] == [1, 2, 3, 4, 5] and max(fake_strava.pages) <= 7
+
+
+def test_fetch_stops_after_one_short_page(fake_strava):
+    fake_strava.activities = [{"id": i, "start": i} for i in range(30)]
+    activities = strava_fetcher.fetch_activity_pages("token", per_page=5, after=27)
+    assert [a["id"] for a in activities] == [28, 29]
+    assert fake_strava.pages == [1]
+
+
+def test_fetch_handles_an_exact_multiple_of_the_page_size(fake_strava):
+    fake_strava.activities = [{"id": i, "start": i} for i in range(10)]
+    assert len(strava_fetcher.fetch_activity_pages("token", per_page=5)) == 10
+    assert sorted(fake_strava.pages)[:3] == [1, 2, 3]
+
+
+def test_api_get_retries_after_429(fake_strava, monkeypatch):
+    fake_strava.activities = [{"id": 1, "start": 1}]
+    fake_strava.failures = 1
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        strava_fetcher.LIMITER.short_used = 0      # the quota window rolls over
+
+    # The 429 exhausts the window; the retry sleeps until it resets instead of hammering the server
+    monkeypatch.setattr(strava_fetcher.RateLimiter, "_wait_time", lambda self, now: 30 if self.short_used >= self.short_limit else 0)
+    monkeypatch.setattr(strava_fetcher.time, "sleep", sleep)
+    assert strava_fetcher.api_get("/athlete/activities", "token", {"per_page": 5, "page": 1}, max_wait=60) == [{"id": 1, "start": 1}]
+    assert sleeps == [30] and fake_strava.pages == [1]
+
+
+def test_api_get_gives_up_after_max_retries(fake_strava, monkeypatch):
+    fake_strava.failures = strava_fetcher.MAX_RETRIES + 1
+    monkeypatch.setattr(strava_fetcher.RateLimiter, "exhaust", lambda self: None)
+    with pytest.raises(strava_fetcher.requests.HTTPError):
+        strava_fetcher.api_get("/athlete/activities", "token", {"per_page": 5, "page": 1})
+    assert fake_strava.failures == 0 and fake_strava.pages == []
@@ -0,0 +1,29 @@
+import os
+
+import numpy as np
+
+from functions.stream_store import DATA_FILE, compact_streams, delete_streams, load_streams, save_streams
+
+
+def _columns(n, value):
+    return {"time": np.arange(n, dtype=np.float32), "distance": np.full(n, value, dtype=np.float32)}
+
+
+def test_save_and_load_round_trip(tmp_path):
+    save_streams(1, _columns(5, 2.0), str(tmp_path))
+    streams = load_streams(1, str(tmp_path))
+    assert streams["time"].tolist() == [0, 1, 2, 3, 4] and streams["distance"].tolist() == [2.0] * 5
+    assert load_streams(2, str(tmp_path)) is None
+
+
+def test_compaction_waits_for_enough_dead_space(tmp_path):
+    streams_dir = str(tmp_path)
+    for i in range(4):
+        save_streams(i, _columns(100, float(i)), streams_dir)
+    delete_streams([0], streams_dir)
+    assert not compact_streams(streams_dir, min_dead_ratio=0.3)      # 25% dead
+    delete_streams([1], streams_dir)
+    assert compact_streams(streams_dir, min_dead_ratio=0.3)          # 50% dead
+    assert os.path.getsize(os.path.join(streams_dir, DATA_FILE)) == 2 * 2 * 100 * 4
+    assert load_streams(3, streams_dir)["distance"][0] == 3.0
+    assert not compact_streams(streams_dir, min_dead_ratio=0.3)
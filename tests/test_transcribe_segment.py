@@ -0,0 +1,55 @@
+import importlib, io, os, time
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("openai")
+pytest.importorskip("dotenv")
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    # Import without background work: no home areas to warm and no stored activities to index
+    cwd = os.getcwd()
+    os.environ.setdefault("OPENAI_API_KEY", "test")
+    os.environ["HOME_AREAS"] = ""
+    os.chdir(tmp_path_factory.mktemp("app"))
+    try:
+        return importlib.import_module("app")
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def client(app_module, monkeypatch):
+    def fake_transcribe(client, audio, filename):
+        time.sleep(0.05 if audio == b"first" else 0)   # segments finish out of order
+        return audio.decode()
+    monkeypatch.setattr(app_module, "transcribe_audio", fake_transcribe)
+    app_module.TRANSCRIPTS.clear()
+    return app_module.app.test_client()
+
+
+def _send(client, session, index, audio, final=False):
+    data = {"session": session, "index": str(index), "file": (io.BytesIO(audio), "segment.webm")}
+    if final:
+        data["final"] = "1"
+    return client.post("/api/transcribe/segment", data=data, content_type="multipart/form-data")
+
+
+def test_segments_are_joined_in_recording_order(client):
+    assert _send(client, "s1", 0, b"first").get_json() == {"ok": True}
+    assert _send(client, "s1", 1, b"second").get_json() == {"ok": True}
+    response = _send(client, "s1", 2, b"third", final=True)
+    assert response.get_json() == {"text": "first second third", "segments": 3}
+
+
+def test_segments_after_the_final_one_are_refused(client):
+    _send(client, "s2", 0, b"only", final=True)
+    response = _send(client, "s2", 1, b"late")
+    assert response.status_code == 409
+
+
+def test_missing_fields_are_rejected(client):
+    response = client.post("/api/transcribe/segment", data={"session": "s3"}, content_type="multipart/form-data")
+    assert response.status_code == 400